@@ -0,0 +1,47 @@
+"""
+Compares the cost of the TOTP enrollment QR code renderers.
+
+Run from the repository root with::
+
+    python benchmarks/bench_qrcode.py
+"""
+
+from base64 import b32encode
+import os
+import sys
+import timeit
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path[:0] = [ROOT_DIR, os.path.join(ROOT_DIR, "testproj")]
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "testproj.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from kagi.views.totp_devices import render_qrcode  # noqa: E402
+
+
+def otpauth_url():
+    secret = b32encode(os.urandom(20)).decode()
+    return f"otpauth://totp/Kagi:admin?secret={secret}&digits=6&issuer=Kagi"
+
+
+def main(number=50):
+    print(f"{'renderer':<12} {'ms/render':>10} {'bytes':>8}")
+    for image_format in ("svg", "png"):
+        urls = [otpauth_url() for _ in range(number)]
+        elapsed = timeit.timeit(
+            lambda: render_qrcode(urls.pop(), image_format), number=number
+        )
+        size = len(render_qrcode(otpauth_url(), image_format))
+        print(f"{image_format:<12} {elapsed / number * 1000:>10.3f} {size:>8}")
+
+    url = otpauth_url()
+    render_qrcode(url)
+    elapsed = timeit.timeit(lambda: render_qrcode(url), number=number * 100)
+    print(f"{'svg (cached)':<12} {elapsed / (number * 100) * 1000:>10.4f}")
+
+
+if __name__ == "__main__":
+    main()
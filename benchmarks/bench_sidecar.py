@@ -0,0 +1,96 @@
+"""
+Measures the throughput of the verification server with many concurrent
+connections, each verifying invalid TOTP tokens in a row.
+
+Run from the repository root with::
+
+    python benchmarks/bench_sidecar.py --connections 1000 --requests 20
+
+The server runs in the same process, against an in-memory SQLite database, so
+the figures are a lower bound for a server with a database of its own.
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path[:0] = [ROOT_DIR, os.path.join(ROOT_DIR, "testproj")]
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "testproj.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.contrib.auth import get_user_model  # noqa: E402
+from django.db import connection  # noqa: E402
+
+from kagi import settings as kagi_settings  # noqa: E402
+from kagi.models import TOTPDevice  # noqa: E402
+from kagi.sidecar.client import AsyncClient  # noqa: E402
+from kagi.sidecar.server import VerificationServer  # noqa: E402
+
+
+def create_users(count):
+    User = get_user_model()
+    users = User.objects.bulk_create(User(username=f"user{i}") for i in range(count))
+    TOTPDevice.objects.bulk_create(
+        TOTPDevice(user=user, key=os.urandom(20)) for user in users
+    )
+
+
+async def run_client(path, username, requests, latencies):
+    async with AsyncClient(path, timeout=60) as client:
+        for _ in range(requests):
+            start = time.perf_counter()
+            response = await client.verify(username, "totp", "000000")
+            latencies.append(time.perf_counter() - start)
+            assert "error" not in response, response
+
+
+async def run(path, args):
+    server = VerificationServer(workers=args.workers)
+    await server.start(path, backlog=args.connections)
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(
+            run_client(path, f"user{i % args.users}", args.requests, latencies)
+            for i in range(args.connections)
+        )
+    )
+    elapsed = time.perf_counter() - start
+    server.close()
+    return elapsed, latencies
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--connections", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args(argv)
+
+    connection.creation.create_test_db(verbosity=0, serialize=False)
+    create_users(args.users)
+    # Every attempt is measured, instead of being refused past the limits.
+    kagi_settings.KAGI_RATE_LIMIT_USER_ATTEMPTS = None
+    kagi_settings.KAGI_RATE_LIMIT_IP_ATTEMPTS = None
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        elapsed, latencies = asyncio.run(run(os.path.join(tmp_dir, "kagi.sock"), args))
+
+    latencies.sort()
+    print(f"{len(latencies)} verifications in {elapsed:.2f}s")
+    print(f"{len(latencies) / elapsed:.0f} verifications/s")
+    print(f"median latency {statistics.median(latencies) * 1000:.2f}ms")
+    print(f"p99 latency {latencies[int(len(latencies) * 0.99)] * 1000:.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
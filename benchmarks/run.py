@@ -0,0 +1,298 @@
+"""
+Microbenchmarks for the cryptographic and ORM hot paths of Kagi.
+
+The benchmarks run offline, against an in-memory SQLite database. Run them
+from the repository root with::
+
+    python benchmarks/run.py
+
+Results are printed, and written as JSON with ``--output``. They are compared
+against ``benchmarks/baseline.json``, and the script exits with an error when
+a benchmark is slower than its baseline by more than ``--tolerance``. Use
+``--save-baseline`` to update the baseline after an intended change, on the
+machine that runs the comparisons.
+"""
+
+import argparse
+import datetime
+import fnmatch
+import json
+import os
+import platform
+import statistics
+import sys
+import timeit
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path[:0] = [ROOT_DIR, os.path.join(ROOT_DIR, "testproj")]
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "testproj.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.contrib.auth import get_user_model  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test import RequestFactory  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from webauthn.helpers import bytes_to_base64url  # noqa: E402
+
+from kagi.forms import TOTPForm  # noqa: E402
+from kagi.models import HOTPDevice, TOTPDevice  # noqa: E402
+from kagi.oath import hotp, hotp_window, totp  # noqa: E402
+from kagi.repositories import (  # noqa: E402
+    InMemoryCredentialRepository,
+    ORMCredentialRepository,
+)
+from kagi.utils import webauthn  # noqa: E402
+from kagi.utils.authenticator import ALGORITHMS, SoftwareAuthenticator  # noqa: E402
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+ORIGIN = "http://localhost"
+RP_ID = "localhost"
+KEY = b"12345678901234567890"
+
+# Benchmark setup functions, keyed by benchmark name. Each one returns the
+# callable to time.
+BENCHMARKS = {}
+
+
+def benchmark(name, **params):
+    def register(setup):
+        label = ",".join(f"{key}={value}" for key, value in params.items())
+        BENCHMARKS[f"{name}[{label}]" if label else name] = lambda: setup(**params)
+        return setup
+
+    return register
+
+
+def create_user():
+    User = get_user_model()
+    return User.objects.create_user(f"user{User.objects.count()}", password=None)
+
+
+@benchmark("oath.hotp")
+def bench_hotp():
+    return lambda: hotp(KEY, 1234)
+
+
+@benchmark("oath.totp")
+def bench_totp():
+    now = timezone.now()
+    return lambda: totp(KEY, now)
+
+
+@benchmark("TOTPDevice.validate_token")
+def bench_validate_token():
+    # An invalid token checks every time step of the window.
+    device = TOTPDevice(key=KEY)
+    return lambda: device.validate_token("000000")
+
+
+@benchmark("oath.hotp_window", count=50)
+def bench_hotp_window(count):
+    return lambda: hotp_window(KEY, 1234, count)
+
+
+@benchmark("HOTPDevice.validate_token")
+def bench_validate_hotp_token():
+    # An invalid token checks every counter of the look-ahead window.
+    device = HOTPDevice(key=KEY)
+    return lambda: device.validate_token("000000")
+
+
+for devices in (1, 10, 50):
+
+    @benchmark("TOTPForm.validate_second_factor", devices=devices)
+    def bench_validate_second_factor(devices):
+        user = create_user()
+        TOTPDevice.objects.bulk_create(
+            TOTPDevice(user=user, key=os.urandom(20)) for _ in range(devices)
+        )
+        request = RequestFactory().post("/")
+
+        def validate():
+            form = TOTPForm(
+                {"token": "000000"}, user=user, request=request, appId=ORIGIN
+            )
+            form.is_valid()
+            return form.validate_second_factor()
+
+        return validate
+
+
+def create_authenticators(user, algorithm, keys):
+    authenticators = [SoftwareAuthenticator(algorithm) for _ in range(keys)]
+    user.webauthn_keys.bulk_create(
+        user.webauthn_keys.model(
+            user=user,
+            key_name=f"Key {i}",
+            sign_count=0,
+            credential_id=bytes_to_base64url(authenticator.credential_id),
+            public_key=bytes_to_base64url(authenticator.public_key),
+        )
+        for i, authenticator in enumerate(authenticators)
+    )
+    return authenticators
+
+
+for keys in (1, 10):
+
+    @benchmark("get_assertion_options", keys=keys)
+    def bench_get_assertion_options(keys):
+        user = create_user()
+        create_authenticators(user, "ES256", keys)
+        challenge = webauthn.generate_webauthn_challenge()
+        return lambda: webauthn.get_assertion_options(
+            user, challenge=challenge, rp_id=RP_ID
+        )
+
+    for algorithm in ALGORITHMS:
+
+        @benchmark("verify_assertion_response", algorithm=algorithm, keys=keys)
+        def bench_verify_assertion_response(algorithm, keys):
+            user = create_user()
+            # Only the key of the assertion is checked, found among all of them.
+            authenticator = create_authenticators(user, algorithm, keys)[-1]
+            challenge = webauthn.generate_webauthn_challenge()
+            options = webauthn.get_assertion_options(
+                user, challenge=challenge, rp_id=RP_ID
+            )
+            assertion = authenticator.get_assertion(options, origin=ORIGIN)
+            return lambda: webauthn.verify_assertion_response(
+                assertion, challenge=challenge, user=user, origin=ORIGIN, rp_id=RP_ID
+            )
+
+
+REPOSITORIES = {
+    "orm": ORMCredentialRepository,
+    "memory": InMemoryCredentialRepository,
+}
+
+
+def create_repository(name, user, *, devices=0, keys=0):
+    repository = REPOSITORIES[name]()
+    if name == "orm":
+        TOTPDevice.objects.bulk_create(
+            TOTPDevice(user=user, key=os.urandom(20)) for _ in range(devices)
+        )
+        create_authenticators(user, "ES256", keys)
+        return repository
+    for _ in range(devices):
+        repository.add_totp_device(user, os.urandom(20))
+    for i in range(keys):
+        authenticator = SoftwareAuthenticator()
+        repository.add_webauthn_key(
+            user,
+            key_name=f"Key {i}",
+            sign_count=0,
+            credential_id=bytes_to_base64url(authenticator.credential_id),
+            public_key=bytes_to_base64url(authenticator.public_key),
+        )
+    return repository
+
+
+for repository in REPOSITORIES:
+    for count in (1, 10):
+
+        @benchmark(
+            "CredentialRepository.get_totp_devices",
+            repository=repository,
+            devices=count,
+        )
+        def bench_get_totp_devices(repository, devices):
+            user = create_user()
+            repository = create_repository(repository, user, devices=devices)
+            return lambda: repository.get_totp_devices(user)
+
+        @benchmark(
+            "CredentialRepository.get_webauthn_keys", repository=repository, keys=count
+        )
+        def bench_get_webauthn_keys(repository, keys):
+            user = create_user()
+            repository = create_repository(repository, user, keys=keys)
+            return lambda: repository.get_webauthn_keys(user)
+
+
+def measure(func, repeat):
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    timings = [elapsed / number for elapsed in timer.repeat(repeat, number)]
+    return {
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "number": number,
+        "repeat": repeat,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    Returns the names of the benchmarks whose median is slower than the
+    baseline by more than the tolerance, as a ratio.
+    """
+    return [
+        name
+        for name, result in results.items()
+        if name in baseline
+        and result["median"] > baseline[name]["median"] * (1 + tolerance)
+    ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-k", dest="pattern", default="*", help="benchmark filter")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="allowed slowdown against the baseline (default: %(default)s)",
+    )
+    args = parser.parse_args(argv)
+
+    connection.creation.create_test_db(verbosity=0, serialize=False)
+
+    results = {}
+    for name, setup in BENCHMARKS.items():
+        if fnmatch.fnmatchcase(name, args.pattern):
+            results[name] = measure(setup(), args.repeat)
+
+    try:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+    except FileNotFoundError:
+        baseline = {}
+
+    print(f"{'benchmark':<72} {'median µs':>11} {'baseline µs':>12}")
+    for name, result in results.items():
+        expected = baseline.get(name, {}).get("median")
+        expected = f"{expected * 1e6:>12.1f}" if expected else f"{'-':>12}"
+        print(f"{name:<72} {result['median'] * 1e6:>11.1f} {expected}")
+
+    report = {
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        return 0
+
+    regressions = compare(results, baseline, args.tolerance)
+    for name in regressions:
+        print(f"Regression: {name} is slower than its baseline.", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,17 +1,34 @@
 from django.contrib import admin
-from django.contrib.auth import REDIRECT_FIELD_NAME
+from django.contrib.auth import (
+    REDIRECT_FIELD_NAME,
+    get_permission_codename,
+    get_user_model,
+)
+from django.db import transaction
 from django.http import HttpResponseRedirect
 from django.urls import reverse
-from django.utils.translation import gettext as _
+from django.utils.translation import gettext as _, gettext_lazy, ngettext
 
-from .models import WebAuthnKey
+from . import settings
+from .models import BackupCode, HOTPDevice, TOTPDevice, WebAuthnKey
+from .trusted_devices import revoke_trusted_devices
 
+SECOND_FACTOR_MODELS = [WebAuthnKey, TOTPDevice, HOTPDevice, BackupCode]
 
-def make_login_view(view_class):
+
+def make_login_view(view_class=None):
     def login(self, request, extra_context=None):
         """
         Displays the login form for the given HttpRequest.
         """
+        nonlocal view_class
+        if view_class is None:
+            # Resolved on first use rather than when the app registry is ready,
+            # so that starting a process does not import kagi's views.
+            from kagi.views.login import KagiLoginView
+
+            view_class = KagiLoginView
+
         if request.method == "GET" and self.has_permission(request):
             # Already logged-in, redirect to admin index
             index_path = reverse("admin:index", current_app=self.name)
@@ -47,16 +64,115 @@ def make_login_view(view_class):
 
 
 def monkeypatch_admin(view_class=None):
-    if view_class is None:
-        from kagi.views.login import KagiLoginView
-
-        view_class = KagiLoginView
-
     from django.contrib.admin.sites import AdminSite
 
     AdminSite.login = make_login_view(view_class)
 
 
+def revoke_second_factors(user_ids):
+    """
+    Deletes every WebAuthn key, TOTP and HOTP device and backup code of the
+    users, in transactions of ``KAGI_ADMIN_REVOKE_BATCH_SIZE`` users, and
+    revokes their trusted devices.
+    """
+    user_ids = list(user_ids)
+    batch_size = settings.KAGI_ADMIN_REVOKE_BATCH_SIZE
+    for start in range(0, len(user_ids), batch_size):
+        batch = user_ids[start : start + batch_size]
+        with transaction.atomic():
+            for model in SECOND_FACTOR_MODELS:
+                model.objects.filter(user__in=batch).delete()
+        for user in get_user_model()._default_manager.filter(pk__in=batch).only("pk"):
+            revoke_trusted_devices(user)
+
+
+@admin.action(
+    description=gettext_lazy("Revoke all second factors of the selected users"),
+    permissions=["revoke"],
+)
+def revoke_all_second_factors(modeladmin, request, queryset):
+    user_ids = list(queryset.order_by().values_list("user", flat=True).distinct())
+    revoke_second_factors(user_ids)
+    modeladmin.message_user(
+        request,
+        ngettext(
+            "Revoked the second factors of %(count)d user.",
+            "Revoked the second factors of %(count)d users.",
+            len(user_ids),
+        )
+        % {"count": len(user_ids)},
+    )
+
+
+class SecondFactorAdmin(admin.ModelAdmin):
+    # Scales to millions of rows: no full count, no user dropdown, one query
+    # per page, and searches that can use the indexes.
+    show_full_result_count = False
+    list_select_related = ["user"]
+    raw_id_fields = ["user"]
+    actions = [revoke_all_second_factors]
+    deferred_fields = []
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).defer(*self.deferred_fields)
+
+    def get_search_fields(self, request):
+        username_field = get_user_model().USERNAME_FIELD
+        return [f"user__{username_field}__startswith", *self.search_fields]
+
+    def has_revoke_permission(self, request):
+        # Revoking deletes the rows of every second factor model, not only
+        # those of this admin.
+        return all(
+            request.user.has_perm(
+                f"{model._meta.app_label}."
+                f"{get_permission_codename('delete', model._meta)}"
+            )
+            for model in SECOND_FACTOR_MODELS
+        )
+
+
 @admin.register(WebAuthnKey)
-class WebAuthnKeyAdmin(admin.ModelAdmin):
-    pass
+class WebAuthnKeyAdmin(SecondFactorAdmin):
+    list_display = ["key_name", "user", "created_at", "last_used_at"]
+    search_fields = ["key_name__startswith"]
+    readonly_fields = ["public_key", "credential_id", "sign_count"]
+    deferred_fields = ["public_key"]
+
+
+@admin.register(TOTPDevice)
+class TOTPDeviceAdmin(SecondFactorAdmin):
+    list_display = ["id", "user", "created_at", "last_used_at"]
+    # Secrets are never displayed, and devices are only set up by their users.
+    # Encrypted secrets are bound to their user, so devices cannot be moved.
+    exclude = ["key", "key_id", "last_t"]
+    readonly_fields = ["user"]
+    deferred_fields = ["key"]
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(HOTPDevice)
+class HOTPDeviceAdmin(SecondFactorAdmin):
+    list_display = ["id", "name", "user", "created_at", "last_used_at"]
+    search_fields = ["name__startswith"]
+    # The counter stays editable, to resynchronize tokens pressed beyond the
+    # look-ahead window.
+    exclude = ["key", "key_id"]
+    readonly_fields = ["user"]
+    deferred_fields = ["key"]
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(BackupCode)
+class BackupCodeAdmin(SecondFactorAdmin):
+    list_display = ["id", "user"]
+    # Codes are never displayed, and only generated by their users.
+    exclude = ["code"]
+    readonly_fields = ["user"]
+
+    def has_add_permission(self, request):
+        return False
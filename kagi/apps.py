@@ -10,5 +10,26 @@ class KagiConfig(AppConfig):
 
         monkeypatch_admin()
 
+    def connect_signals(self):
+        from django.db.models.signals import post_delete, post_save
+
+        from .fragments import invalidate_factor_version
+        from .models import HOTPDevice, TOTPDevice, WebAuthnKey
+        from .shared_cache import invalidate_credential_ids
+
+        # Registered or deleted keys change the credential descriptors.
+        post_save.connect(invalidate_credential_ids, sender=WebAuthnKey)
+        post_delete.connect(invalidate_credential_ids, sender=WebAuthnKey)
+        # Added or deleted factors change the cached factor lists. Backup codes
+        # are not cached.
+        for model in [WebAuthnKey, TOTPDevice, HOTPDevice]:
+            post_save.connect(invalidate_factor_version, sender=model)
+            post_delete.connect(invalidate_factor_version, sender=model)
+
     def ready(self):
+        from .relying_party import get_resolver
+
         self.monkeypatch_login_view()
+        self.connect_signals()
+        # Fails early on invalid relying party settings.
+        get_resolver()
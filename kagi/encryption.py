@@ -0,0 +1,162 @@
+"""
+Envelope encryption of TOTP secrets.
+
+When ``KAGI_TOTP_ENCRYPTION_KEY_ID`` names one of the master keys of
+``KAGI_TOTP_ENCRYPTION_KEYS``, each new TOTP secret is encrypted with AES-GCM
+under its own random data key, which is in turn encrypted under the master
+key. Devices store the ID of the master key along with both ciphertexts, so
+that master keys can be rotated by re-encrypting the data keys only, with the
+``rotatetotpkeys`` command. Devices without a key ID hold plain secrets.
+
+Decrypted secrets are kept in a bounded in-process cache for
+``KAGI_TOTP_SECRET_CACHE_TTL`` seconds, so that users verifying tokens in a
+row only pay for one decryption.
+"""
+
+import base64
+from collections import OrderedDict
+import os
+import threading
+import time
+
+from django.core.exceptions import ImproperlyConfigured
+
+from . import settings
+
+NONCE_SIZE = 12
+DATA_KEY_SIZE = 32
+TAG_SIZE = 16
+# The nonce, encrypted data key and tag that start each stored secret.
+WRAPPED_KEY_SIZE = NONCE_SIZE + DATA_KEY_SIZE + TAG_SIZE
+
+
+def get_master_key(key_id):
+    try:
+        key = base64.urlsafe_b64decode(settings.KAGI_TOTP_ENCRYPTION_KEYS[key_id])
+    except KeyError:
+        raise ImproperlyConfigured(f"Unknown TOTP encryption key {key_id!r}.")
+    except ValueError:
+        # binascii.Error, raised on invalid base64, is a ValueError.
+        raise ImproperlyConfigured(
+            f"The TOTP encryption key {key_id!r} is not valid base64."
+        )
+    if len(key) != DATA_KEY_SIZE:
+        raise ImproperlyConfigured(
+            f"The TOTP encryption key {key_id!r} must be {DATA_KEY_SIZE} bytes long."
+        )
+    return key
+
+
+def _seal(key, data, associated_data):
+    # cryptography is only needed when secrets are encrypted, so it is not
+    # imported with the module.
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+    nonce = os.urandom(NONCE_SIZE)
+    return nonce + AESGCM(key).encrypt(nonce, data, associated_data)
+
+
+def _open(key, sealed, associated_data):
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+    return AESGCM(key).decrypt(
+        sealed[:NONCE_SIZE], sealed[NONCE_SIZE:], associated_data
+    )
+
+
+# Ciphertexts are bound to their user, and data keys to their master key, so
+# that they cannot be swapped between rows.
+
+
+def _secret_aad(user_id):
+    return f"kagi.totp.secret:{user_id}".encode()
+
+
+def _data_key_aad(user_id, key_id):
+    return f"kagi.totp.data-key:{user_id}:{key_id}".encode()
+
+
+def encrypt_secret(secret, user_id, key_id):
+    """
+    Returns the ciphertext of ``secret`` under a new data key, encrypted with
+    the master key ``key_id``.
+    """
+    data_key = os.urandom(DATA_KEY_SIZE)
+    wrapped_key = _seal(
+        get_master_key(key_id), data_key, _data_key_aad(user_id, key_id)
+    )
+    return wrapped_key + _seal(data_key, secret, _secret_aad(user_id))
+
+
+def _unwrap_data_key(ciphertext, user_id, key_id):
+    return _open(
+        get_master_key(key_id),
+        ciphertext[:WRAPPED_KEY_SIZE],
+        _data_key_aad(user_id, key_id),
+    )
+
+
+def decrypt_secret(ciphertext, user_id, key_id):
+    data_key = _unwrap_data_key(ciphertext, user_id, key_id)
+    return _open(data_key, ciphertext[WRAPPED_KEY_SIZE:], _secret_aad(user_id))
+
+
+def rewrap_secret(ciphertext, user_id, key_id, new_key_id):
+    """
+    Returns ``ciphertext`` with its data key encrypted with the master key
+    ``new_key_id`` instead of ``key_id``. The secret is not decrypted.
+    """
+    data_key = _unwrap_data_key(ciphertext, user_id, key_id)
+    wrapped_key = _seal(
+        get_master_key(new_key_id), data_key, _data_key_aad(user_id, new_key_id)
+    )
+    return wrapped_key + ciphertext[WRAPPED_KEY_SIZE:]
+
+
+class SecretCache:
+    """
+    A least recently used cache of at most ``size`` entries, which expire
+    ``ttl`` seconds after being stored.
+    """
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get_or_set(self, key, default):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.entries.move_to_end(key)
+                return entry[1]
+        value = default()
+        with self.lock:
+            self.entries[key] = (now + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+secret_cache = SecretCache(
+    settings.KAGI_TOTP_SECRET_CACHE_SIZE, settings.KAGI_TOTP_SECRET_CACHE_TTL
+)
+
+
+def get_secret(ciphertext, user_id, key_id):
+    """
+    Returns the decrypted secret, from the cache when possible. Entries are
+    keyed by the ciphertext, so that re-encrypted secrets are not mixed up.
+    """
+    ciphertext = bytes(ciphertext)
+    return secret_cache.get_or_set(
+        (user_id, key_id, ciphertext),
+        lambda: decrypt_secret(ciphertext, user_id, key_id),
+    )
@@ -0,0 +1,175 @@
+"""
+Recording of ``AuthEvent`` audit entries off the request path.
+
+Events are put on a bounded in-process queue, and written in batches with
+``bulk_create`` by a background thread. What happens when the queue is full is
+set by ``KAGI_AUTH_EVENT_QUEUE_POLICY``: ``"drop"`` discards the new event,
+``"block"`` waits for room for up to ``KAGI_AUTH_EVENT_QUEUE_TIMEOUT`` seconds,
+then discards it. Pending events are written when the process exits.
+"""
+
+import atexit
+import logging
+import queue
+import threading
+
+from django.db import close_old_connections, connection
+
+from . import settings
+from .models import AuthEvent
+
+logger = logging.getLogger(__name__)
+
+DROP = "drop"
+BLOCK = "block"
+
+_STOP = object()
+
+# Factor types are sent by clients, and any other value is recorded as unknown,
+# so that it cannot fail the insert of a whole batch.
+FACTOR_TYPES = {"webauthn", "passkey", "totp", "hotp", "backup", "trusted_device"}
+UNKNOWN_FACTOR_TYPE = "unknown"
+
+
+class EventQueue:
+    def __init__(
+        self,
+        *,
+        maxsize,
+        policy,
+        batch_size,
+        flush_interval,
+        timeout=None,
+        background=True,
+    ):
+        if policy not in (DROP, BLOCK):
+            raise ValueError(f"Unknown auth event queue policy: {policy!r}")
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.policy = policy
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.background = background
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def put(self, event):
+        if self.background and self.thread is None:
+            self.start()
+        try:
+            self.queue.put(event, block=self.policy == BLOCK, timeout=self.timeout)
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+            logger.warning("Dropped an auth event, the queue is full.")
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.run, name="kagi-auth-events", daemon=True
+                )
+                self.thread.start()
+                atexit.register(self.close)
+
+    def get_batch(self, timeout=None):
+        """
+        Waits for an event, then returns it along with whatever other events are
+        pending, up to the batch size.
+        """
+        try:
+            batch = [self.queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def write(self, batch):
+        events = [event for event in batch if event is not _STOP]
+        try:
+            AuthEvent.objects.bulk_create(events)
+        except Exception:
+            logger.exception("Could not write %d auth events.", len(events))
+        else:
+            return
+        # Retry one by one, so that a single invalid event is the only one lost.
+        for event in events:
+            try:
+                AuthEvent.objects.bulk_create([event])
+            except Exception:
+                with self.lock:
+                    self.dropped += 1
+                logger.exception("Dropped an auth event that could not be written.")
+
+    def run(self):
+        while True:
+            batch = self.get_batch(timeout=self.flush_interval)
+            close_old_connections()
+            self.write(batch)
+            if _STOP in batch:
+                connection.close()
+                return
+
+    def flush(self):
+        """
+        Writes the pending events from the calling thread.
+        """
+        while batch := self.get_batch(timeout=0):
+            self.write(batch)
+
+    def close(self, timeout=5):
+        """
+        Stops the background thread once it has written the pending events.
+        """
+        if self.thread is None:
+            self.flush()
+            return
+        self.queue.put(_STOP)
+        self.thread.join(timeout)
+
+
+event_queue = EventQueue(
+    maxsize=settings.KAGI_AUTH_EVENT_QUEUE_SIZE,
+    policy=settings.KAGI_AUTH_EVENT_QUEUE_POLICY,
+    batch_size=settings.KAGI_AUTH_EVENT_BATCH_SIZE,
+    flush_interval=settings.KAGI_AUTH_EVENT_FLUSH_INTERVAL,
+    timeout=settings.KAGI_AUTH_EVENT_QUEUE_TIMEOUT,
+)
+
+
+def record_event(
+    request,
+    user,
+    factor_type,
+    *,
+    succeeded,
+    factor_id=None,
+    action=None,
+    ip_address=None,
+):
+    """
+    Queues an ``AuthEvent`` for the given request. Outside of a request, such as
+    in the verification server, ``request`` is ``None`` and the client address
+    is given as ``ip_address``.
+    """
+    if factor_type not in FACTOR_TYPES:
+        factor_type = UNKNOWN_FACTOR_TYPE
+    if request is not None:
+        ip_address = request.META.get("REMOTE_ADDR")
+    event_queue.put(
+        AuthEvent(
+            # Assigning the user itself would route the event for writing, which
+            # pins the reads of the request to the primary database.
+            user_id=user.pk if user is not None else None,
+            action=action or AuthEvent.VERIFY,
+            factor_type=factor_type,
+            factor_id=factor_id,
+            succeeded=succeeded,
+            ip_address=ip_address,
+        )
+    )
@@ -1,7 +1,11 @@
+from base64 import b32decode
+
 from django import forms
-from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
+from .instrumentation import STAGE_FAILURE, stage
+from .repositories import get_repository
+
 
 class SecondFactorForm(forms.Form):
     def __init__(self, *args, **kwargs):
@@ -13,24 +17,27 @@ class SecondFactorForm(forms.Form):
 
 class BackupCodeForm(SecondFactorForm):
     INVALID_ERROR_MESSAGE = _("That is not a valid backup code.")
+    token_field = "code"
 
     code = forms.CharField(
         label=_("Code"), widget=forms.TextInput(attrs={"autocomplete": "off"})
     )
 
     def validate_second_factor(self):
-        count, _ = self.user.backup_codes.filter(
-            code=self.cleaned_data["code"]
-        ).delete()
-        if count == 0:
+        with stage("backup.delete_code") as timing:
+            consumed = get_repository().consume_backup_code(
+                self.user, self.cleaned_data["code"]
+            )
+            if not consumed:
+                timing.outcome = STAGE_FAILURE
+        if not consumed:
             self.add_error("code", self.INVALID_ERROR_MESSAGE)
-            return False
-        elif count == 1:
-            return True
+        return consumed
 
 
 class TOTPForm(SecondFactorForm):
     INVALID_ERROR_MESSAGE = _("That token is invalid.")
+    token_field = "token"
 
     token = forms.CharField(
         min_length=6,
@@ -39,15 +46,78 @@ class TOTPForm(SecondFactorForm):
         widget=forms.TextInput(attrs={"autocomplete": "off"}),
     )
 
+    factor_type = "totp"
+
+    def get_devices(self, repository):
+        return repository.get_totp_devices(self.user)
+
+    def record_use(self, repository, device):
+        return repository.record_totp_use(device)
+
     def validate_second_factor(self):
-        for device in self.user.totp_devices.all():
-            if device.validate_token(self.cleaned_data["token"]):
-                device.last_used_at = timezone.now()
-                device.save()
+        repository = get_repository()
+        with stage(f"{self.factor_type}.query_devices"):
+            devices = self.get_devices(repository)
+        for device in devices:
+            if not device.validate_token(self.cleaned_data["token"]):
+                continue
+            # The token is only accepted if no concurrent request used it.
+            with stage(f"{self.factor_type}.save_device"):
+                recorded = self.record_use(repository, device)
+            if recorded:
+                self.device = device
                 return True
         self.add_error("token", self.INVALID_ERROR_MESSAGE)
         return False
 
 
+class HOTPForm(TOTPForm):
+    factor_type = "hotp"
+
+    def get_devices(self, repository):
+        return repository.get_hotp_devices(self.user)
+
+    def record_use(self, repository, device):
+        return repository.record_hotp_use(device)
+
+
+# Second factors that can be verified from a single token, keyed by the
+# ``type`` used by the verification views.
+TOKEN_FORM_CLASSES = {"backup": BackupCodeForm, "totp": TOTPForm, "hotp": HOTPForm}
+
+
+class HOTPDeviceForm(forms.Form):
+    MIN_SECRET_SIZE = 16
+
+    name = forms.CharField(label=_("Name"), max_length=64, required=False)
+    secret = forms.CharField(
+        label=_("Secret"),
+        help_text=_("The secret of the token, in hexadecimal or base32."),
+        widget=forms.TextInput(attrs={"autocomplete": "off"}),
+    )
+    token = forms.CharField(
+        min_length=6,
+        max_length=6,
+        label=_("Token"),
+        widget=forms.TextInput(attrs={"autocomplete": "off"}),
+    )
+
+    def clean_secret(self):
+        secret = "".join(self.cleaned_data["secret"].split())
+        try:
+            key = bytes.fromhex(secret)
+        except ValueError:
+            try:
+                key = b32decode(secret.upper() + "=" * (-len(secret) % 8))
+            except ValueError:
+                raise forms.ValidationError(
+                    _("Enter the secret in hexadecimal or base32.")
+                )
+        # RFC 4226 requires secrets of at least 128 bits.
+        if len(key) < self.MIN_SECRET_SIZE:
+            raise forms.ValidationError(_("This secret is too short."))
+        return key
+
+
 class KeyRegistrationForm(forms.Form):
     key_name = forms.CharField(label=_("Key name"))
@@ -0,0 +1,51 @@
+"""
+Caching of the rendered factor lists of the management views.
+
+When ``KAGI_FRAGMENT_CACHE`` names a Django cache, each page of a user's
+WebAuthn keys, TOTP devices or HOTP devices is rendered once, and kept for
+``KAGI_FRAGMENT_CACHE_TIMEOUT`` seconds under a key including the user's
+factor version. Adding or deleting a factor increments the version, so that
+the next request renders the list again. Recording the use of a factor does
+not, so "last used" dates can lag by up to the timeout.
+"""
+
+from django.core.cache import caches
+from django.utils.safestring import mark_safe
+
+from . import settings
+from .utils.cache import bump_counter, get_counter
+
+
+def get_factor_version(user_id):
+    return get_counter(
+        caches[settings.KAGI_FRAGMENT_CACHE], f"kagi:factor-version:{user_id}"
+    )
+
+
+def invalidate_factor_version(sender, instance, **kwargs):
+    if settings.KAGI_FRAGMENT_CACHE is None:
+        return
+    bump_counter(
+        caches[settings.KAGI_FRAGMENT_CACHE], f"kagi:factor-version:{instance.user_id}"
+    )
+
+
+def get_or_render(name, user, parts, render):
+    """
+    Returns the cached result of ``render()`` for the fragment ``name`` of
+    ``user``, varying on ``parts``. ``render()`` returns a tuple whose first
+    item is rendered HTML.
+    """
+    if settings.KAGI_FRAGMENT_CACHE is None:
+        return render()
+    cache = caches[settings.KAGI_FRAGMENT_CACHE]
+    key = ":".join(
+        ["kagi:fragment", name, str(user.pk), str(get_factor_version(user.pk))]
+        + [str(part) for part in parts]
+    )
+    result = cache.get(key)
+    if result is None:
+        result = render()
+        cache.set(key, result, settings.KAGI_FRAGMENT_CACHE_TIMEOUT)
+    html, *rest = result
+    return (mark_safe(html), *rest)
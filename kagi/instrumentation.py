@@ -0,0 +1,157 @@
+"""
+Timings of the stages of the second factor verification flows.
+
+Stages are timed with the ``stage()`` context manager, and reported to the
+sink configured with ``KAGI_INSTRUMENTATION_SINK``: the dotted path to a class
+whose instances have a ``record(stage, duration, outcome)`` method. Without a
+sink, ``stage()`` does nothing.
+
+The outcome of a stage is ``"success"``, ``"error"`` when it raises an
+exception, or whatever the code under measure sets::
+
+    with stage("totp.validate_token") as timing:
+        if not valid:
+            timing.outcome = "failure"
+"""
+
+import threading
+import time
+
+from django.utils.module_loading import import_string
+
+from . import settings
+
+STAGE_SUCCESS = "success"
+STAGE_FAILURE = "failure"
+STAGE_ERROR = "error"
+
+_UNSET = object()
+_sink = _UNSET
+
+
+def get_sink():
+    global _sink
+    if _sink is _UNSET:
+        path = settings.KAGI_INSTRUMENTATION_SINK
+        _sink = import_string(path)() if path else None
+    return _sink
+
+
+class _NoOpTiming:
+    # Shared by every stage when there is no sink, so outcomes set on it are
+    # simply ignored.
+    outcome = STAGE_SUCCESS
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+class _Timing:
+    __slots__ = ("sink", "name", "outcome", "start")
+
+    def __init__(self, sink, name):
+        self.sink = sink
+        self.name = name
+        self.outcome = STAGE_SUCCESS
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        duration = time.perf_counter() - self.start
+        outcome = STAGE_ERROR if exc_type is not None else self.outcome
+        self.sink.record(self.name, duration, outcome)
+
+
+_NO_OP_TIMING = _NoOpTiming()
+
+
+def stage(name):
+    """
+    Returns a context manager timing the stage called ``name``.
+    """
+    sink = _sink if _sink is not _UNSET else get_sink()
+    if sink is None:
+        return _NO_OP_TIMING
+    return _Timing(sink, name)
+
+
+class PrometheusSink:
+    """
+    Aggregates stage timings in the current process, as a counter of outcomes
+    and a latency histogram for every stage, which ``render()`` returns in the
+    Prometheus text exposition format.
+    """
+
+    buckets = (
+        0.0005,
+        0.001,
+        0.0025,
+        0.005,
+        0.01,
+        0.025,
+        0.05,
+        0.1,
+        0.25,
+        0.5,
+        1.0,
+        2.5,
+        5.0,
+    )
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.outcomes = {}
+        self.histograms = {}
+
+    def record(self, stage, duration, outcome):
+        with self.lock:
+            key = (stage, outcome)
+            self.outcomes[key] = self.outcomes.get(key, 0) + 1
+            # Bucket counts, then the sum of the durations.
+            histogram = self.histograms.setdefault(
+                stage, [0] * (len(self.buckets) + 1) + [0.0]
+            )
+            for i, bound in enumerate(self.buckets):
+                if duration <= bound:
+                    histogram[i] += 1
+            histogram[-2] += 1
+            histogram[-1] += duration
+
+    def render(self):
+        with self.lock:
+            outcomes = sorted(self.outcomes.items())
+            histograms = sorted(
+                (stage, list(histogram)) for stage, histogram in self.histograms.items()
+            )
+
+        lines = [
+            "# HELP kagi_stage_total Number of completed stages, by outcome.",
+            "# TYPE kagi_stage_total counter",
+        ]
+        for (stage, outcome), count in outcomes:
+            lines.append(
+                f'kagi_stage_total{{stage="{stage}",outcome="{outcome}"}} {count}'
+            )
+        lines += [
+            "# HELP kagi_stage_duration_seconds Duration of the stages.",
+            "# TYPE kagi_stage_duration_seconds histogram",
+        ]
+        for stage, histogram in histograms:
+            for bound, count in zip(self.buckets + ("+Inf",), histogram):
+                lines.append(
+                    f'kagi_stage_duration_seconds_bucket{{stage="{stage}",'
+                    f'le="{bound}"}} {count}'
+                )
+            lines.append(
+                f'kagi_stage_duration_seconds_sum{{stage="{stage}"}} {histogram[-1]}'
+            )
+            lines.append(
+                f'kagi_stage_duration_seconds_count{{stage="{stage}"}} '
+                f"{histogram[-2]}"
+            )
+        return "\n".join(lines) + "\n"
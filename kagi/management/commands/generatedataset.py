@@ -0,0 +1,286 @@
+import contextlib
+import json
+import multiprocessing
+import os
+import random
+import time
+
+from django.apps import apps
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, transaction
+
+from ...models import BackupCode, TOTPDevice, WebAuthnKey
+
+# The number of WebAuthn keys per user, and its weight: most users have none,
+# and a few carry a key ring.
+KEY_COUNT_WEIGHTS = {0: 50, 1: 30, 2: 15, 3: 4, 5: 1}
+TOTP_DEVICE_RATIO = 0.4
+BACKUP_CODE_RATIO = 0.3
+BACKUP_CODES_PER_USER = 10
+
+
+def init_worker():
+    # Processes started with "spawn" do not inherit the app registry.
+    if not apps.ready:  # pragma: no cover
+        import django
+
+        django.setup()
+
+
+def generate_key(algorithm):
+    """
+    Returns the base64url-encoded credential ID and public key of a new
+    software authenticator, and its PEM-encoded private key.
+    """
+    # The authenticator and its dependencies are only imported when the
+    # command is run.
+    from cryptography.hazmat.primitives import serialization
+    from webauthn.helpers import bytes_to_base64url
+
+    from ...utils.authenticator import SoftwareAuthenticator
+
+    authenticator = SoftwareAuthenticator(algorithm)
+    private_key = authenticator.private_key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    )
+    return (
+        bytes_to_base64url(authenticator.credential_id),
+        bytes_to_base64url(authenticator.public_key),
+        private_key.decode(),
+    )
+
+
+def plan_factors(rng, rs256_ratio):
+    """
+    Draws the factors of a user, generating their key pairs and secrets. Only
+    the key pairs are not drawn from ``rng``.
+    """
+    [key_count] = rng.choices(
+        list(KEY_COUNT_WEIGHTS), weights=KEY_COUNT_WEIGHTS.values()
+    )
+    keys = []
+    for _ in range(key_count):
+        algorithm = "RS256" if rng.random() < rs256_ratio else "ES256"
+        keys.append((algorithm, *generate_key(algorithm)))
+    totp_secret = rng.randbytes(20) if rng.random() < TOTP_DEVICE_RATIO else None
+    codes = []
+    if rng.random() < BACKUP_CODE_RATIO:
+        codes = [
+            f"{code:06d}" for code in rng.sample(range(10**6), BACKUP_CODES_PER_USER)
+        ]
+    return keys, totp_secret, codes
+
+
+def plan_chunk(task):
+    """
+    Returns the usernames of the users ``start`` to ``start + count``, and the
+    factors drawn for each of them.
+    """
+    start, count, options = task
+    rng = random.Random(f"{options['seed']}:{start}")
+    usernames = [
+        f"{options['username_prefix']}{i}" for i in range(start, start + count)
+    ]
+    plans = [plan_factors(rng, options["rs256_ratio"]) for _ in usernames]
+    return usernames, plans
+
+
+def write_chunk(usernames, plans, options):
+    """
+    Creates the users and their factors in one transaction, and returns the
+    numbers of rows created, along with the private keys when requested.
+    """
+    User = get_user_model()
+    username_field = User.USERNAME_FIELD
+    keys, devices, codes, private_keys = [], [], [], []
+    with transaction.atomic():
+        User.objects.bulk_create(
+            User(**{username_field: username, "password": options["password"]})
+            for username in usernames
+        )
+        # Not every database returns the primary keys of bulk inserts.
+        users = {
+            user.get_username(): user
+            for user in User._default_manager.filter(
+                **{f"{username_field}__in": usernames}
+            )
+        }
+        for username, (user_keys, totp_secret, user_codes) in zip(usernames, plans):
+            user = users[username]
+            for number, (
+                algorithm,
+                credential_id,
+                public_key,
+                private_key,
+            ) in enumerate(user_keys, start=1):
+                keys.append(
+                    WebAuthnKey(
+                        user=user,
+                        key_name=f"Security key {number}",
+                        credential_id=credential_id,
+                        public_key=public_key,
+                        sign_count=0,
+                    )
+                )
+                if options["private_keys"]:
+                    private_keys.append(
+                        {
+                            "username": username,
+                            "credential_id": credential_id,
+                            "algorithm": algorithm,
+                            "private_key": private_key,
+                        }
+                    )
+            if totp_secret is not None:
+                device = TOTPDevice(user=user)
+                device.set_secret(totp_secret)
+                devices.append(device)
+            codes.extend(BackupCode(user=user, code=code) for code in user_codes)
+        for model, objs in [
+            (WebAuthnKey, keys),
+            (TOTPDevice, devices),
+            (BackupCode, codes),
+        ]:
+            model.objects.bulk_create(objs, batch_size=options["batch_size"])
+
+    counts = {
+        "users": len(usernames),
+        "keys": len(keys),
+        "devices": len(devices),
+        "codes": len(codes),
+    }
+    return counts, private_keys
+
+
+def build_chunk(task):
+    return write_chunk(*plan_chunk(task), task[2])
+
+
+def open_private(path):
+    """
+    Opens ``path`` for writing, readable by its owner only.
+    """
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    # The mode only applies to new files.
+    os.fchmod(fd, 0o600)
+    return os.fdopen(fd, "w")
+
+
+class Command(BaseCommand):
+    help = (
+        "Generates users with WebAuthn keys, TOTP devices and backup codes, "
+        "for benchmarking against a production-sized database."
+    )
+    pool_class = multiprocessing.Pool
+
+    def add_arguments(self, parser):
+        parser.add_argument("users", type=int, help="The number of users to create.")
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count(),
+            help="The number of processes generating rows.",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=1000,
+            help="The number of users created per transaction.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="The number of rows per insert statement.",
+        )
+        parser.add_argument("--username-prefix", default="kagi-dataset-")
+        parser.add_argument(
+            "--password",
+            default="password",
+            help="The password of every user, hashed once.",
+        )
+        parser.add_argument(
+            "--rs256-ratio",
+            type=float,
+            default=0.01,
+            help="The share of RS256 keys, which are much slower to generate "
+            "than ES256 keys.",
+        )
+        parser.add_argument(
+            "--seed",
+            type=int,
+            default=0,
+            help="The seed of the distributions, TOTP secrets and backup codes.",
+        )
+        parser.add_argument(
+            "--private-keys",
+            help="A file to write the private keys to, as JSON lines.",
+        )
+
+    def handle(self, *args, **options):
+        counts = ["users", "workers", "chunk_size", "batch_size"]
+        if any(options[name] < 1 for name in counts):
+            raise CommandError(
+                "The numbers of users and workers, and the chunk and batch sizes "
+                "must be positive."
+            )
+        User = get_user_model()
+        prefix = options["username_prefix"]
+        if User._default_manager.filter(
+            **{f"{User.USERNAME_FIELD}__startswith": prefix}
+        ).exists():
+            raise CommandError(
+                f"Users starting with {prefix!r} exist, use another --username-prefix."
+            )
+
+        chunk_options = {
+            "seed": options["seed"],
+            "username_prefix": prefix,
+            # Hashing is slow by design, so every user shares one hash.
+            "password": make_password(options["password"]),
+            "rs256_ratio": options["rs256_ratio"],
+            "batch_size": options["batch_size"],
+            "private_keys": bool(options["private_keys"]),
+        }
+        tasks = [
+            (start, min(options["chunk_size"], options["users"] - start), chunk_options)
+            for start in range(0, options["users"], options["chunk_size"])
+        ]
+
+        totals = dict.fromkeys(["users", "keys", "devices", "codes"], 0)
+        path = options["private_keys"]
+        started = time.perf_counter()
+        with open_private(path) if path else contextlib.nullcontext() as private_keys:
+            for counts, keys in self.run_tasks(tasks, options["workers"]):
+                for name, count in counts.items():
+                    totals[name] += count
+                for key in keys:
+                    private_keys.write(json.dumps(key) + "\n")
+        elapsed = time.perf_counter() - started
+
+        rows = sum(totals.values())
+        self.stdout.write(
+            f"Created {totals['users']} users, {totals['keys']} WebAuthn keys, "
+            f"{totals['devices']} TOTP devices and {totals['codes']} backup codes "
+            f"({rows / elapsed:.0f} rows/s)."
+        )
+
+    def run_tasks(self, tasks, workers):
+        if workers == 1:
+            yield from map(build_chunk, tasks)
+            return
+        # Keys are generated before a transaction starts, so SQLite, which
+        # takes one writer at a time, is written to by this process only.
+        concurrent_writes = connection.vendor != "sqlite"
+        # Connections must not be shared with the worker processes.
+        connections.close_all()
+        with self.pool_class(workers, initializer=init_worker) as pool:
+            if concurrent_writes:
+                yield from pool.imap_unordered(build_chunk, tasks)
+                return
+            for usernames, plans in pool.imap_unordered(plan_chunk, tasks):
+                yield write_chunk(usernames, plans, tasks[0][2])
@@ -0,0 +1,291 @@
+from concurrent.futures import ThreadPoolExecutor
+import http.cookiejar
+import json
+import os
+import statistics
+import time
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode, urljoin, urlsplit
+from urllib.request import (
+    HTTPCookieProcessor,
+    HTTPRedirectHandler,
+    Request,
+    build_opener,
+)
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.urls import reverse
+from django.utils import timezone
+
+from ...models import BackupCode, TOTPDevice
+from ...oath import totp
+from ...utils.authenticator import ALGORITHMS, SoftwareAuthenticator
+
+FLOWS = ("webauthn", "totp", "backup")
+
+
+class FlowError(Exception):
+    pass
+
+
+class NoRedirectHandler(HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class SimulatedUser:
+    """
+    A browser-like HTTP client for a single user, which records the latency of
+    every request by endpoint.
+    """
+
+    def __init__(self, base_url, username, password, *, algorithm):
+        self.base_url = base_url
+        self.origin = "{0.scheme}://{0.netloc}".format(urlsplit(base_url))
+        self.username = username
+        self.password = password
+        self.authenticator = SoftwareAuthenticator(algorithm)
+        self.totp_key = os.urandom(20)
+        self.backup_codes = []
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.requests = {}
+        self.timings = {}
+        self.errors = {}
+
+    def new_session(self):
+        self.cookies = http.cookiejar.CookieJar()
+        self.opener = build_opener(HTTPCookieProcessor(self.cookies), NoRedirectHandler)
+
+    def request(self, endpoint, data=None, expected=200, csrf=False):
+        url = urljoin(self.base_url, reverse(f"kagi:{endpoint}"))
+        headers = {"Referer": url}
+        if data is not None:
+            if csrf:
+                data = dict(data, csrfmiddlewaretoken=self.get_cookie("csrftoken"))
+            data = urlencode(data).encode()
+        name = f"{endpoint} {'GET' if data is None else 'POST'}"
+        self.requests[name] = self.requests.get(name, 0) + 1
+
+        start = time.perf_counter()
+        try:
+            with self.opener.open(Request(url, data, headers)) as response:
+                status, body = response.status, response.read()
+        except HTTPError as e:
+            status, body = e.code, e.read()
+        except URLError as e:
+            self.errors[name] = self.errors.get(name, 0) + 1
+            raise FlowError(f"{name}: {e.reason}")
+        self.timings.setdefault(name, []).append(time.perf_counter() - start)
+
+        if status != expected:
+            self.errors[name] = self.errors.get(name, 0) + 1
+            raise FlowError(f"{name} returned {status}")
+        return body
+
+    def get_cookie(self, name):
+        for cookie in self.cookies:
+            if cookie.name == name:
+                return cookie.value
+
+    def login(self):
+        self.new_session()
+        self.request("login")
+        self.request(
+            "login",
+            {"username": self.username, "password": self.password},
+            expected=302,
+            csrf=True,
+        )
+
+    def register_webauthn_key(self):
+        self.login()
+        options = json.loads(self.request("begin-activate"))
+        credential = self.authenticator.make_credential(options, origin=self.origin)
+        self.request(
+            "verify-credential-info",
+            {"credentials": credential, "key_name": "Load test"},
+        )
+
+    def verify_webauthn(self):
+        options = json.loads(self.request("begin-assertion"))
+        assertion = self.authenticator.get_assertion(options, origin=self.origin)
+        self.request("verify-assertion", {"credentials": assertion})
+
+    def verify_totp(self):
+        self.request(
+            "verify-second-factor",
+            {"type": "totp", "token": totp(self.totp_key, timezone.now())},
+            expected=302,
+            csrf=True,
+        )
+
+    def verify_backup(self):
+        self.request(
+            "verify-second-factor",
+            {"type": "backup", "code": self.backup_codes.pop()},
+            expected=302,
+            csrf=True,
+        )
+
+    def run(self, flow):
+        """
+        Logs in with the password, then verifies the given second factor.
+        Returns whether the flow succeeded.
+        """
+        try:
+            self.login()
+            self.request("verify-second-factor")
+            getattr(self, f"verify_{flow}")()
+        except FlowError:
+            return False
+        return True
+
+
+def percentile(timings, n):
+    if len(timings) == 1:
+        return timings[0]
+    return statistics.quantiles(timings, n=100, method="inclusive")[n - 1]
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs simulated users through the password and second factor login "
+        "flows of a running server, and reports throughput, latency and "
+        "error rates by endpoint."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "url",
+            nargs="?",
+            default="http://localhost:8000/",
+            help="The base URL of the server, sharing this project's database.",
+        )
+        parser.add_argument(
+            "--users", type=int, default=10, help="The number of concurrent users."
+        )
+        parser.add_argument(
+            "--iterations",
+            type=int,
+            default=10,
+            help="The number of logins of each user.",
+        )
+        parser.add_argument(
+            "--flow",
+            action="append",
+            choices=FLOWS,
+            help="The second factor to use, repeat to alternate. Default: all.",
+        )
+        parser.add_argument("--algorithm", choices=ALGORITHMS, default="ES256")
+        parser.add_argument("--username-prefix", default="kagi-loadtest-")
+
+    def handle(self, *args, **options):
+        if options["users"] < 1 or options["iterations"] < 1:
+            raise CommandError("The numbers of users and iterations must be positive.")
+        prefix = options["username_prefix"]
+        # The users' passwords and factors are replaced, so existing accounts
+        # are never reused.
+        if get_user_model().objects.filter(username__startswith=prefix).exists():
+            raise CommandError(
+                f"Users starting with {prefix!r} exist, use another --username-prefix."
+            )
+        flows = options["flow"] or FLOWS
+        iterations = options["iterations"]
+        users = [self.create_user(options, i, flows) for i in range(options["users"])]
+        with ThreadPoolExecutor(max_workers=len(users)) as executor:
+            for error in executor.map(self.register, users):
+                if error:
+                    raise CommandError(f"Could not register a WebAuthn key: {error}")
+
+        # Only the logins count towards the throughput and latencies.
+        for user in users:
+            user.reset_stats()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(users)) as executor:
+            results = list(
+                executor.map(lambda user: self.run_user(user, flows, iterations), users)
+            )
+        elapsed = time.perf_counter() - start
+        self.report(users, sum(results), len(users) * iterations, elapsed)
+
+    def create_user(self, options, i, flows):
+        username = f"{options['username_prefix']}{i}"
+        password = os.urandom(16).hex()
+        user = get_user_model().objects.create_user(username, password=password)
+
+        simulated_user = SimulatedUser(
+            options["url"], username, password, algorithm=options["algorithm"]
+        )
+        simulated_user.pk = user.pk
+        simulated_user.flows = flows
+        # The TOTP device and backup codes are set up once the WebAuthn key is
+        # registered, since registering requires a login without second factor.
+        if "backup" in flows:
+            simulated_user.backup_codes = [
+                f"{n:06d}" for n in range(options["iterations"])
+            ]
+        return simulated_user
+
+    def register(self, user):
+        try:
+            if "webauthn" in user.flows:
+                user.register_webauthn_key()
+            if "totp" in user.flows:
+                device = TOTPDevice(user_id=user.pk)
+                device.set_secret(user.totp_key)
+                device.save()
+            BackupCode.objects.bulk_create(
+                BackupCode(user_id=user.pk, code=code) for code in user.backup_codes
+            )
+        except FlowError as e:
+            return str(e)
+        finally:
+            connections.close_all()
+
+    def run_user(self, user, flows, iterations):
+        succeeded = 0
+        try:
+            for i in range(iterations):
+                flow = flows[i % len(flows)]
+                if flow == "totp":
+                    # A TOTP token can only be used once, so allow the next
+                    # login to reuse the current time step. This is not timed.
+                    TOTPDevice.objects.filter(user_id=user.pk).update(last_t=None)
+                succeeded += user.run(flow)
+        finally:
+            connections.close_all()
+        return succeeded
+
+    def report(self, users, succeeded, total, elapsed):
+        requests, timings, errors = {}, {}, {}
+        for user in users:
+            for name, count in user.requests.items():
+                requests[name] = requests.get(name, 0) + count
+            for name, values in user.timings.items():
+                timings.setdefault(name, []).extend(values)
+            for name, count in user.errors.items():
+                errors[name] = errors.get(name, 0) + count
+
+        self.stdout.write(
+            f"{succeeded}/{total} logins succeeded in {elapsed:.2f}s: "
+            f"{succeeded / elapsed:.1f} logins/s, "
+            f"{sum(requests.values()) / elapsed:.1f} requests/s"
+        )
+        self.stdout.write(
+            f"{'endpoint':<30} {'requests':>8} {'errors':>7} "
+            f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+        )
+        for name in sorted(requests):
+            values = timings.get(name, [])
+            latencies = " ".join(
+                f"{percentile(values, n) * 1000:>8.1f}" for n in (50, 95, 99)
+            )
+            self.stdout.write(
+                f"{name:<30} {requests[name]:>8} "
+                f"{errors.get(name, 0) / requests[name]:>7.1%} "
+                f"{latencies if values else ''}"
+            )
@@ -0,0 +1,75 @@
+from collections import Counter
+import os
+import pstats
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ... import settings
+
+
+def parse_profile_name(name):
+    """
+    Returns the ``(endpoint, outcome)`` of a profile written by
+    ``SamplingProfilerMiddleware``.
+
+    >>> parse_profile_name("1700000000000000000-42-verify-assertion-200.prof")
+    ('verify-assertion', '200')
+    """
+    _, _, rest = name[: -len(".prof")].split("-", 2)
+    endpoint, outcome = rest.rsplit("-", 1)
+    return endpoint, outcome
+
+
+class Command(BaseCommand):
+    help = (
+        "Aggregates the profiles sampled by SamplingProfilerMiddleware into a "
+        "report of the hottest functions."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--directory", default=settings.KAGI_PROFILER_DIR)
+        parser.add_argument(
+            "--top", type=int, default=20, help="The number of functions to show."
+        )
+        parser.add_argument(
+            "--sort",
+            default="cumulative",
+            choices=["cumulative", "tottime", "ncalls"],
+        )
+        parser.add_argument("--endpoint", help="Only use profiles of this URL name.")
+        parser.add_argument("--outcome", help="Only use profiles of this status code.")
+
+    def handle(self, *args, **options):
+        try:
+            names = sorted(os.listdir(options["directory"]))
+        except FileNotFoundError:
+            names = []
+
+        profiles = []
+        for name in names:
+            if not name.endswith(".prof"):
+                continue
+            try:
+                endpoint, outcome = parse_profile_name(name)
+            except ValueError:
+                self.stderr.write(f"Skipping {name}, not written by the profiler.")
+                continue
+            if options["endpoint"] not in (None, endpoint):
+                continue
+            if options["outcome"] not in (None, outcome):
+                continue
+            profiles.append((endpoint, outcome, name))
+
+        if not profiles:
+            raise CommandError(f"No profiles found in {options['directory']}.")
+
+        counts = Counter((endpoint, outcome) for endpoint, outcome, _ in profiles)
+        self.stdout.write(f"{len(profiles)} profiles:")
+        for (endpoint, outcome), count in sorted(counts.items()):
+            self.stdout.write(f"  {endpoint} {outcome}: {count}")
+
+        stats = pstats.Stats(
+            *(os.path.join(options["directory"], name) for _, _, name in profiles),
+            stream=self.stdout,
+        )
+        stats.sort_stats(options["sort"]).print_stats(options["top"])
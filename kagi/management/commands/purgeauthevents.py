@@ -0,0 +1,45 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from ... import settings
+from ...models import AuthEvent
+
+
+class Command(BaseCommand):
+    help = "Deletes the auth events older than the retention period, in chunks."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=settings.KAGI_AUTH_EVENT_RETENTION_DAYS,
+            help="The number of days to keep events for.",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=1000,
+            help="The number of events to delete per query.",
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - datetime.timedelta(days=options["days"])
+        expired = AuthEvent.objects.filter(created_at__lt=cutoff)
+
+        total = 0
+        while True:
+            # Delete by primary key range, so that each statement only locks a
+            # bounded set of rows, and short transactions let logins proceed.
+            ids = list(
+                expired.order_by("pk").values_list("pk", flat=True)[
+                    : options["chunk_size"]
+                ]
+            )
+            if not ids:
+                break
+            deleted, _ = expired.filter(pk__gte=ids[0], pk__lte=ids[-1]).delete()
+            total += deleted
+
+        self.stdout.write(f"Deleted {total} auth events.")
@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from ... import encryption, settings
+from ...models import HOTPDevice, TOTPDevice
+
+
+class Command(BaseCommand):
+    help = (
+        "Encrypts the TOTP and HOTP secrets under the current master key, "
+        "KAGI_TOTP_ENCRYPTION_KEY_ID, in chunks."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=1000,
+            help="The number of devices to update per transaction.",
+        )
+
+    def reencrypt(self, device, key_id):
+        if device.key_id:
+            # Only the data key is re-encrypted.
+            return encryption.rewrap_secret(
+                bytes(device.key), device.user_id, device.key_id, key_id
+            )
+        return encryption.encrypt_secret(bytes(device.key), device.user_id, key_id)
+
+    def handle(self, *args, **options):
+        key_id = settings.KAGI_TOTP_ENCRYPTION_KEY_ID
+        if key_id is None:
+            raise CommandError("KAGI_TOTP_ENCRYPTION_KEY_ID is not set.")
+        # Fails before any device is updated if the key is invalid.
+        encryption.get_master_key(key_id)
+
+        for model, label in [(TOTPDevice, "TOTP"), (HOTPDevice, "HOTP")]:
+            total = self.rotate(model, key_id, options["chunk_size"])
+            self.stdout.write(f"Re-encrypted {total} {label} secrets.")
+
+    def rotate(self, model, key_id, chunk_size):
+        total, last_pk = 0, 0
+        while True:
+            # Walk the devices by primary key, so that each chunk is read from
+            # an index range and locked for a short transaction.
+            with transaction.atomic():
+                devices = list(
+                    model.objects.select_for_update()
+                    .filter(pk__gt=last_pk)
+                    .order_by("pk")
+                    .only("user", "key", "key_id")[:chunk_size]
+                )
+                if not devices:
+                    return total
+                last_pk = devices[-1].pk
+                stale = [device for device in devices if device.key_id != key_id]
+                for device in stale:
+                    device.key = self.reencrypt(device, key_id)
+                    device.key_id = key_id
+                model.objects.bulk_update(stale, ["key", "key_id"])
+                total += len(stale)
@@ -0,0 +1,46 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from ... import settings
+from ...sidecar.server import VerificationServer
+
+
+class Command(BaseCommand):
+    help = (
+        "Serves the verification of OTP tokens and backup codes to other "
+        "services over a Unix domain socket."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("socket", help="The path of the socket to listen on.")
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=settings.KAGI_SIDECAR_WORKERS,
+            help="The number of threads, and database connections, verifying tokens.",
+        )
+        parser.add_argument(
+            "--backlog",
+            type=int,
+            default=settings.KAGI_SIDECAR_BACKLOG,
+            help="The number of pending connections the socket accepts.",
+        )
+        parser.add_argument(
+            "--mode",
+            type=lambda value: int(value, 8),
+            default=0o660,
+            help="The permissions of the socket, in octal.",
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Serving verifications on {options['socket']}.")
+        server = VerificationServer(workers=options["workers"])
+        try:
+            asyncio.run(
+                server.serve(
+                    options["socket"], backlog=options["backlog"], mode=options["mode"]
+                )
+            )
+        except KeyboardInterrupt:
+            pass
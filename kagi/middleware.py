@@ -0,0 +1,110 @@
+import cProfile
+import os
+import random
+import time
+
+from django.conf import settings as django_settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from . import settings
+from .routers import track_writes
+
+
+def write_profile(profiler, directory, endpoint, outcome, max_files):
+    """
+    Saves the stats of ``profiler`` in ``directory``, then removes the oldest
+    profiles so that at most ``max_files`` are kept.
+    """
+    os.makedirs(directory, exist_ok=True)
+    # Names sort by time, and carry what the report command filters on.
+    filename = f"{time.time_ns()}-{os.getpid()}-{endpoint}-{outcome}.prof"
+    profiler.dump_stats(os.path.join(directory, filename))
+
+    profiles = sorted(name for name in os.listdir(directory) if name.endswith(".prof"))
+    for name in profiles[:-max_files]:
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:  # pragma: no cover
+            # Removed by another process.
+            pass
+
+
+class SamplingProfilerMiddleware:
+    """
+    Profiles a random sample of the requests to the kagi views with cProfile,
+    keeping the latest ``KAGI_PROFILER_MAX_FILES`` profiles in
+    ``KAGI_PROFILER_DIR``.
+
+    The sampled fraction of requests is set by ``KAGI_PROFILER_SAMPLE_RATE``.
+    When it is zero, the default, the middleware removes itself.
+    """
+
+    def __init__(self, get_response):
+        if not settings.KAGI_PROFILER_SAMPLE_RATE:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.sample_rate = settings.KAGI_PROFILER_SAMPLE_RATE
+        self.directory = settings.KAGI_PROFILER_DIR
+        self.max_files = settings.KAGI_PROFILER_MAX_FILES
+
+    def __call__(self, request):
+        response = self.get_response(request)
+
+        profiler = getattr(request, "_kagi_profiler", None)
+        if profiler is not None:
+            profiler.disable()
+            write_profile(
+                profiler,
+                self.directory,
+                request.resolver_match.url_name,
+                response.status_code,
+                self.max_files,
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if "kagi" not in request.resolver_match.app_names:
+            return None
+        if random.random() >= self.sample_rate:
+            return None
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:  # pragma: no cover
+            # Another profiler is already running in this thread.
+            return None
+        request._kagi_profiler = profiler
+        return None
+
+
+class ReplicaPinningMiddleware:
+    """
+    Sends the reads of kagi's models to the primary database for
+    ``KAGI_REPLICA_PIN_SECONDS`` seconds after a request of the same browser
+    wrote to it, so that users read their own writes despite the replication
+    lag. Requires ``kagi.routers.ReplicaRouter``.
+
+    Without ``KAGI_DATABASE_REPLICAS``, the middleware removes itself.
+    """
+
+    def __init__(self, get_response):
+        if not settings.KAGI_DATABASE_REPLICAS:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        cookie_name = settings.KAGI_REPLICA_PIN_COOKIE_NAME
+        with track_writes(pinned=cookie_name in request.COOKIES) as tracked:
+            response = self.get_response(request)
+
+        if tracked.wrote:
+            response.set_cookie(
+                cookie_name,
+                "1",
+                max_age=settings.KAGI_REPLICA_PIN_SECONDS,
+                secure=django_settings.SESSION_COOKIE_SECURE,
+                httponly=True,
+                samesite="Lax",
+            )
+        return response
@@ -0,0 +1,57 @@
+# Generated by Django 5.0.14 on 2026-10-19 12:46
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("kagi", "0002_remove_webauthnkey_ukey"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AuthEvent",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(
+                        db_index=True, default=django.utils.timezone.now
+                    ),
+                ),
+                (
+                    "action",
+                    models.CharField(
+                        choices=[("verify", "Verify"), ("register", "Register")],
+                        max_length=16,
+                    ),
+                ),
+                ("factor_type", models.CharField(max_length=16)),
+                ("factor_id", models.PositiveIntegerField(null=True)),
+                ("succeeded", models.BooleanField()),
+                ("ip_address", models.GenericIPAddressField(null=True)),
+                (
+                    "user",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="auth_events",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-19 13:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("kagi", "0003_authevent"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="webauthnkey",
+            name="key_name",
+            field=models.CharField(db_index=True, max_length=64),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-19 13:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("kagi", "0004_webauthnkey_key_name_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="totpdevice",
+            name="key_id",
+            field=models.CharField(blank=True, default="", max_length=64),
+        ),
+    ]
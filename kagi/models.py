@@ -7,7 +7,9 @@ from django.db import IntegrityError, models, transaction
 from django.utils import timezone
 from django.utils.crypto import get_random_string
 
-from .oath import T, totp
+from . import encryption, settings as kagi_settings
+from .instrumentation import STAGE_FAILURE, stage
+from .oath import T, hotp_window, totp
 
 
 class WebAuthnKey(models.Model):
@@ -17,7 +19,7 @@ class WebAuthnKey(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     last_used_at = models.DateTimeField(blank=True, null=True)
 
-    key_name = models.CharField(max_length=64)
+    key_name = models.CharField(max_length=64, db_index=True)
     public_key = models.TextField(unique=True)
     credential_id = models.TextField(unique=True)
     sign_count = models.IntegerField()
@@ -52,14 +54,43 @@ class BackupCode(models.Model):
     objects = BackupCodeManager()
 
 
-class TOTPDevice(models.Model):
-    user = models.ForeignKey(
-        settings.AUTH_USER_MODEL, related_name="totp_devices", on_delete=models.CASCADE
-    )
+class OTPDevice(models.Model):
+    """
+    The secret storage shared by TOTP and HOTP devices.
+    """
+
     created_at = models.DateTimeField(auto_now_add=True)
     last_used_at = models.DateTimeField(null=True)
 
     key = models.BinaryField()
+    # The ID of the master key encrypting ``key``, if any. See kagi.encryption.
+    key_id = models.CharField(max_length=64, blank=True, default="")
+
+    class Meta:
+        abstract = True
+
+    def set_secret(self, secret):
+        """
+        Stores ``secret``, encrypted if ``KAGI_TOTP_ENCRYPTION_KEY_ID`` is set.
+        """
+        key_id = kagi_settings.KAGI_TOTP_ENCRYPTION_KEY_ID
+        if key_id is None:
+            self.key, self.key_id = secret, ""
+        else:
+            self.key = encryption.encrypt_secret(secret, self.user_id, key_id)
+            self.key_id = key_id
+
+    def get_secret(self):
+        # BinaryField can be a MemoryView, so make sure to return bytes.
+        if not self.key_id:
+            return bytes(self.key)
+        return encryption.get_secret(self.key, self.user_id, self.key_id)
+
+
+class TOTPDevice(OTPDevice):
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, related_name="totp_devices", on_delete=models.CASCADE
+    )
     # the T value of the most recently-used token. This prevents using the same
     # token twice.
     last_t = models.PositiveIntegerField(null=True)
@@ -76,9 +107,74 @@ class TOTPDevice(models.Model):
             times_to_check = [t for t in times_to_check if T(t) > self.last_t]
 
         token = str(token)
-        for t in times_to_check:
-            # BinaryField can be a MemoryView, so make sure to send bytes to hmac.
-            if hmac.compare_digest(totp(bytes(self.key), t), token):
-                self.last_t = T(t)
+        with stage("totp.validate_token") as timing:
+            secret = self.get_secret()
+            for t in times_to_check:
+                if hmac.compare_digest(totp(secret, t), token):
+                    self.last_t = T(t)
+                    return True
+            timing.outcome = STAGE_FAILURE
+        return False
+
+
+class HOTPDevice(OTPDevice):
+    """
+    A counter-based (event) token, such as a hardware token generating a new
+    value at each press of its button.
+    """
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, related_name="hotp_devices", on_delete=models.CASCADE
+    )
+    name = models.CharField(max_length=64, blank=True)
+    # The counter of the next expected token. Tokens of lower counters were
+    # used, or skipped, and are refused.
+    counter = models.PositiveBigIntegerField(default=0)
+
+    def validate_token(self, token):
+        """
+        Checks ``token`` against the ``KAGI_HOTP_LOOK_AHEAD`` counters starting
+        at the stored one, and moves the counter past the matching one, so that
+        presses of the button that were never sent resynchronize the device.
+        """
+        token = str(token)
+        with stage("hotp.validate_token") as timing:
+            values = hotp_window(
+                self.get_secret(), self.counter, kagi_settings.KAGI_HOTP_LOOK_AHEAD
+            )
+            # Every value is compared, so that the time taken does not tell
+            # how far ahead the token was.
+            matches = [hmac.compare_digest(value, token) for value in values]
+            if any(matches):
+                self.counter += matches.index(True) + 1
                 return True
+            timing.outcome = STAGE_FAILURE
         return False
+
+
+class AuthEvent(models.Model):
+    """
+    An audit trail entry for a second factor verification or registration.
+    """
+
+    VERIFY = "verify"
+    REGISTER = "register"
+    ACTION_CHOICES = [(VERIFY, "Verify"), (REGISTER, "Register")]
+
+    # Events outlive the users, keys and devices they refer to.
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        related_name="auth_events",
+        null=True,
+        on_delete=models.SET_NULL,
+    )
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+    action = models.CharField(max_length=16, choices=ACTION_CHOICES)
+    factor_type = models.CharField(max_length=16)
+    factor_id = models.PositiveIntegerField(null=True)
+    succeeded = models.BooleanField()
+    ip_address = models.GenericIPAddressField(null=True)
+
+    def __str__(self):
+        outcome = "succeeded" if self.succeeded else "failed"
+        return f"{self.user} - {self.factor_type} {self.action} {outcome}"
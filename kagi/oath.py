@@ -25,11 +25,45 @@ def hotp(key, counter, digits=6):
 
     msg = struct.pack(">Q", counter)
     hs = hmac.new(key, msg, hashlib.sha1).digest()
+    return truncate(hs, digits)
+
+
+def truncate(hs, digits):
     offset = hs[19] & 0x0F
     val = struct.unpack(">L", hs[offset : offset + 4])[0] & 0x7FFFFFFF
     return "{val:0{digits}d}".format(val=val % 10**digits, digits=digits)
 
 
+def hotp_window(key, counter, count, digits=6):
+    """
+    Returns the HOTP values of the ``count`` counters starting at ``counter``.
+
+    The HMAC key schedule, the hashes of the padded key, is computed once and
+    copied for each counter, which halves the cost of a window.
+
+    >>> key = b'12345678901234567890'
+    >>> hotp_window(key, 3, 4) == [hotp(key, c) for c in range(3, 7)]
+    True
+    >>> hotp_window(b'k' * 65, 0, 1) == [hotp(b'k' * 65, 0)]
+    True
+    """
+    block_size = hashlib.sha1().block_size
+    if len(key) > block_size:
+        key = hashlib.sha1(key).digest()
+    key = key.ljust(block_size, b"\0")
+    inner = hashlib.sha1(bytes(b ^ 0x36 for b in key))
+    outer = hashlib.sha1(bytes(b ^ 0x5C for b in key))
+
+    values = []
+    for c in range(counter, counter + count):
+        inner_hash = inner.copy()
+        inner_hash.update(struct.pack(">Q", c))
+        outer_hash = outer.copy()
+        outer_hash.update(inner_hash.digest())
+        values.append(truncate(outer_hash.digest(), digits))
+    return values
+
+
 def T(t, step=30):
     """
     The TOTP T value (number of time steps since the epoch)
@@ -0,0 +1,213 @@
+"""
+Sliding window limits on second factor verification attempts.
+
+Every attempt counts against the user being verified, and against the client IP
+address, in fixed windows of ``KAGI_RATE_LIMIT_WINDOW`` seconds. The number of
+attempts over the sliding window is estimated as the count of the current
+window, plus the count of the previous window weighted by the part of it the
+sliding window still covers.
+
+Counters are kept in the Django cache named by ``KAGI_RATE_LIMIT_CACHE``. When
+it is ``None``, or when the cache fails, they are kept in count-min sketches in
+the current process instead, whose size does not depend on the number of users
+or addresses.
+"""
+
+import functools
+import hashlib
+import logging
+import math
+import threading
+import time
+
+from django.core.cache import caches
+from django.http import JsonResponse
+
+from . import settings
+from .instrumentation import STAGE_FAILURE, stage
+
+logger = logging.getLogger(__name__)
+
+
+class CountMinSketch:
+    """
+    Approximate counters of any number of keys, in ``width * depth`` integers.
+    A count can be overestimated when the key collides with others in every
+    row, but never underestimated.
+    """
+
+    def __init__(self, width, depth):
+        self.width = width
+        self.depth = depth
+        self.rows = [[0] * width for _ in range(depth)]
+
+    def indexes(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=4 * self.depth).digest()
+        for i in range(0, len(digest), 4):
+            yield int.from_bytes(digest[i : i + 4], "little") % self.width
+
+    def incr(self, key):
+        counts = []
+        for row, index in zip(self.rows, self.indexes(key)):
+            row[index] += 1
+            counts.append(row[index])
+        return min(counts)
+
+    def get(self, key):
+        return min(row[index] for row, index in zip(self.rows, self.indexes(key)))
+
+
+class LocalCounters:
+    """
+    Counters of the current process, with a sketch for each of the current and
+    previous windows.
+    """
+
+    def __init__(self, width, depth):
+        self.width = width
+        self.depth = depth
+        self.lock = threading.Lock()
+        self.sketches = {}
+
+    def incr(self, key, window, timeout):
+        with self.lock:
+            sketch = self.sketches.get(window)
+            if sketch is None:
+                sketch = self.sketches[window] = CountMinSketch(self.width, self.depth)
+                for expired in [w for w in self.sketches if w < window - 1]:
+                    del self.sketches[expired]
+            return sketch.incr(key)
+
+    def get(self, key, window):
+        with self.lock:
+            sketch = self.sketches.get(window)
+            return sketch.get(key) if sketch is not None else 0
+
+
+class CacheCounters:
+    """
+    Counters shared by every process using the Django cache ``alias``.
+    """
+
+    def __init__(self, alias):
+        self.alias = alias
+
+    def incr(self, key, window, timeout):
+        cache = caches[self.alias]
+        key = f"kagi:ratelimit:{key}:{window}"
+        if cache.add(key, 1, timeout):
+            return 1
+        return cache.incr(key)
+
+    def get(self, key, window):
+        return caches[self.alias].get(f"kagi:ratelimit:{key}:{window}", 0)
+
+
+local_counters = LocalCounters(
+    settings.KAGI_RATE_LIMIT_SKETCH_WIDTH, settings.KAGI_RATE_LIMIT_SKETCH_DEPTH
+)
+
+
+def get_retry_after(previous, current, elapsed, length, limit):
+    """
+    Returns the number of seconds until one more attempt fits in the limit,
+    given the counts of the previous and current windows.
+
+    >>> get_retry_after(previous=0, current=10, elapsed=100, length=300, limit=10)
+    230
+    >>> get_retry_after(previous=10, current=5, elapsed=0, length=300, limit=10)
+    180
+    """
+    room = limit - 1
+    if current <= room:
+        # The attempts of the previous window fall out of the sliding window
+        # before the current one ends.
+        wait = length * (1 - (room - current) / previous) - elapsed
+    else:
+        wait = length - elapsed + length * (1 - room / current)
+    return max(1, math.ceil(wait))
+
+
+def count_attempt(key, limit):
+    """
+    Counts an attempt for ``key``, and returns the number of seconds to wait
+    before the next one when ``limit`` is exceeded, otherwise ``None``.
+    """
+    length = settings.KAGI_RATE_LIMIT_WINDOW
+    window, elapsed = divmod(time.time(), length)
+    window = int(window)
+
+    counters = local_counters
+    if settings.KAGI_RATE_LIMIT_CACHE is not None:
+        counters = CacheCounters(settings.KAGI_RATE_LIMIT_CACHE)
+    try:
+        current = counters.incr(key, window, timeout=2 * length)
+        previous = counters.get(key, window - 1)
+    except Exception:
+        logger.warning(
+            "Could not count an attempt in the cache, counting it in the "
+            "current process.",
+            exc_info=True,
+        )
+        current = local_counters.incr(key, window, timeout=2 * length)
+        previous = local_counters.get(key, window - 1)
+
+    if previous * (1 - elapsed / length) + current <= limit:
+        return None
+    return get_retry_after(previous, current, elapsed, length, limit)
+
+
+def check_limits(user_pk=None, ip=None):
+    """
+    Counts a verification attempt against the limits of the user with the
+    primary key ``user_pk`` and of the IP address ``ip``, when given, and
+    returns the number of seconds the client has to wait when either is
+    exceeded, otherwise ``None``.
+    """
+    limits = [
+        ("user", user_pk, settings.KAGI_RATE_LIMIT_USER_ATTEMPTS),
+        ("ip", ip, settings.KAGI_RATE_LIMIT_IP_ATTEMPTS),
+    ]
+    retry_after = None
+    with stage("ratelimit.check") as timing:
+        for scope, identifier, limit in limits:
+            if identifier is None or limit is None:
+                continue
+            wait = count_attempt(f"{scope}:{identifier}", limit)
+            if wait is not None:
+                retry_after = max(wait, retry_after or 0)
+        if retry_after is not None:
+            timing.outcome = STAGE_FAILURE
+    return retry_after
+
+
+def check_attempt(request):
+    """
+    Counts a verification attempt against the limits of the pending user and of
+    the client IP address, and returns the number of seconds the client has to
+    wait when either is exceeded, otherwise ``None``.
+    """
+    return check_limits(
+        request.session.get("kagi_pre_verify_user_pk"),
+        request.META.get("REMOTE_ADDR"),
+    )
+
+
+def limit_attempts(view):
+    """
+    Answers ``429 Too Many Requests`` to the requests to ``view`` over the
+    attempt limits, before the view does any work.
+    """
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        retry_after = check_attempt(request)
+        if retry_after is not None:
+            response = JsonResponse(
+                {"fail": "Too many attempts. Try again later."}, status=429
+            )
+            response["Retry-After"] = str(retry_after)
+            return response
+        return view(request, *args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,81 @@
+"""
+Resolution of the WebAuthn relying party of each request.
+
+The WebAuthn views use the relying party returned by ``get_relying_party()``,
+which asks the resolver at the dotted path ``KAGI_RELYING_PARTY_RESOLVER``.
+The resolver is built once, when the app is ready, and its ``resolve(request)``
+method returns a ``RelyingParty``.
+"""
+
+from collections import namedtuple
+
+from django.core.exceptions import ImproperlyConfigured
+from django.http.request import split_domain_port
+from django.utils.module_loading import import_string
+
+from . import settings
+
+RelyingParty = namedtuple("RelyingParty", ["id", "name", "origins"])
+
+
+class HostRelyingPartyResolver:
+    """
+    Resolves the relying party from the host of the request, in the
+    ``KAGI_RELYING_PARTIES`` dictionary, whose keys are hosts as returned by
+    ``request.get_host()``::
+
+        KAGI_RELYING_PARTIES = {
+            "login.example.com": {
+                "id": "example.com",
+                "name": "Example",
+                "origins": ["https://login.example.com"],
+            },
+        }
+
+    ``id`` defaults to the host name, ``name`` to ``RELYING_PARTY_NAME``, and
+    ``origins`` to the HTTPS origin of the host. Hosts missing from the
+    dictionary use ``RELYING_PARTY_ID`` and ``RELYING_PARTY_NAME``, with the
+    origin of the request.
+    """
+
+    def __init__(self):
+        self.relying_parties = {}
+        for host, options in settings.KAGI_RELYING_PARTIES.items():
+            host = host.lower()
+            hostname, _ = split_domain_port(host)
+            rp_id = options.get("id", hostname)
+            # The ID must be the host name or one of its registrable suffixes.
+            if hostname != rp_id and not hostname.endswith(f".{rp_id}"):
+                raise ImproperlyConfigured(
+                    f"The relying party ID {rp_id!r} is not valid for {host!r}."
+                )
+            self.relying_parties[host] = RelyingParty(
+                id=rp_id,
+                name=options.get("name", settings.RELYING_PARTY_NAME),
+                origins=tuple(options.get("origins", [f"https://{host}"])),
+            )
+
+    def resolve(self, request):
+        host = request.get_host()
+        try:
+            return self.relying_parties[host.lower()]
+        except KeyError:
+            return RelyingParty(
+                id=settings.RELYING_PARTY_ID,
+                name=settings.RELYING_PARTY_NAME,
+                origins=(f"{request.scheme}://{host}",),
+            )
+
+
+_resolver = None
+
+
+def get_resolver():
+    global _resolver
+    if _resolver is None:
+        _resolver = import_string(settings.KAGI_RELYING_PARTY_RESOLVER)()
+    return _resolver
+
+
+def get_relying_party(request):
+    return get_resolver().resolve(request)
@@ -0,0 +1,318 @@
+"""
+Storage of the second factors checked during verification.
+
+The verification views and forms look factors up through the repository
+returned by ``get_repository()``, an instance of the class at the dotted path
+``KAGI_CREDENTIAL_REPOSITORY``. The default, ``ORMCredentialRepository``,
+queries kagi's models. Other repositories, for instance one serving factors
+from a key-value store, subclass ``CredentialRepository``, and must see the
+factors registered and removed through kagi's models.
+
+Keys, devices and codes are handed around as instances of kagi's models, which
+need not be saved in the database.
+"""
+
+import threading
+
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from . import settings
+from .models import BackupCode, HOTPDevice, TOTPDevice, WebAuthnKey
+from .routers import primary_alias
+
+
+class CredentialRepository:
+    def get_enabled_factors(self, user):
+        """
+        Returns which second factors the user has set up, as a dictionary of
+        booleans keyed by factor type.
+        """
+        raise NotImplementedError
+
+    def get_credential_ids(self, user):
+        """
+        Returns the base64url-encoded credential IDs of the user's WebAuthn
+        keys.
+        """
+        raise NotImplementedError
+
+    def get_webauthn_keys(self, user):
+        """
+        Returns the user's WebAuthn keys.
+        """
+        raise NotImplementedError
+
+    def get_webauthn_key(self, credential_id, user=None):
+        """
+        Returns the WebAuthn key with the given base64url-encoded credential ID,
+        with its ``user`` loaded, or ``None``. When ``user`` is given, only their
+        keys are looked up.
+        """
+        raise NotImplementedError
+
+    def update_sign_count(self, key, sign_count):
+        """
+        Sets the sign count of ``key`` and marks it used, unless its sign count
+        was changed since ``key`` was read. Returns whether it did.
+        """
+        raise NotImplementedError
+
+    def get_totp_devices(self, user):
+        """
+        Returns the user's TOTP devices.
+        """
+        raise NotImplementedError
+
+    def record_totp_use(self, device):
+        """
+        Saves the ``last_t`` of ``device`` and marks it used, unless a later or
+        equal time step was saved since ``device`` was read. Returns whether it
+        did.
+        """
+        raise NotImplementedError
+
+    def get_hotp_devices(self, user):
+        """
+        Returns the user's HOTP devices.
+        """
+        raise NotImplementedError
+
+    def record_hotp_use(self, device):
+        """
+        Saves the ``counter`` of ``device`` and marks it used, unless a higher
+        or equal counter was saved since ``device`` was read. Returns whether it
+        did.
+        """
+        raise NotImplementedError
+
+    def consume_backup_code(self, user, code):
+        """
+        Deletes the user's backup code ``code``. Returns whether it existed.
+        """
+        raise NotImplementedError
+
+
+class ORMCredentialRepository(CredentialRepository):
+    # Factors are read from where they are updated, so that a replica lagging
+    # behind cannot let a token be replayed or hide a cloned authenticator.
+
+    def get_enabled_factors(self, user):
+        return (
+            user._meta.model._default_manager.filter(pk=user.pk)
+            .values(
+                webauthn=Exists(WebAuthnKey.objects.filter(user=OuterRef("pk"))),
+                backup=Exists(BackupCode.objects.filter(user=OuterRef("pk"))),
+                totp=Exists(TOTPDevice.objects.filter(user=OuterRef("pk"))),
+                hotp=Exists(HOTPDevice.objects.filter(user=OuterRef("pk"))),
+            )
+            .get()
+        )
+
+    def get_credential_ids(self, user):
+        return list(user.webauthn_keys.values_list("credential_id", flat=True))
+
+    def get_webauthn_keys(self, user):
+        return list(user.webauthn_keys.using(primary_alias(WebAuthnKey)))
+
+    def get_webauthn_key(self, credential_id, user=None):
+        keys = WebAuthnKey.objects.db_manager(primary_alias(WebAuthnKey)).filter(
+            credential_id=credential_id
+        )
+        if user is not None:
+            keys = keys.filter(user_id=user.pk)
+        return keys.select_related("user").first()
+
+    def update_sign_count(self, key, sign_count):
+        now = timezone.now()
+        updated = WebAuthnKey.objects.filter(
+            pk=key.pk, sign_count=key.sign_count
+        ).update(sign_count=sign_count, last_used_at=now)
+        if updated:
+            key.sign_count = sign_count
+            key.last_used_at = now
+        return bool(updated)
+
+    def get_totp_devices(self, user):
+        return list(user.totp_devices.using(primary_alias(TOTPDevice)))
+
+    def record_totp_use(self, device):
+        now = timezone.now()
+        updated = TOTPDevice.objects.filter(
+            Q(last_t__isnull=True) | Q(last_t__lt=device.last_t), pk=device.pk
+        ).update(last_t=device.last_t, last_used_at=now)
+        if updated:
+            device.last_used_at = now
+        return bool(updated)
+
+    def get_hotp_devices(self, user):
+        return list(user.hotp_devices.using(primary_alias(HOTPDevice)))
+
+    def record_hotp_use(self, device):
+        now = timezone.now()
+        # Counters only move forward, so a token used concurrently is only
+        # accepted once.
+        updated = HOTPDevice.objects.filter(
+            pk=device.pk, counter__lt=device.counter
+        ).update(counter=device.counter, last_used_at=now)
+        if updated:
+            device.last_used_at = now
+        return bool(updated)
+
+    def consume_backup_code(self, user, code):
+        count, _ = user.backup_codes.filter(code=code).delete()
+        return count > 0
+
+
+class InMemoryCredentialRepository(CredentialRepository):
+    """
+    Keeps factors in dictionaries of the current process, and only sees the
+    factors added with its ``add_*()`` methods. Meant for tests and for
+    benchmarking against the ORM.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.webauthn_keys = {}
+        self.totp_devices = {}
+        self.hotp_devices = {}
+        self.backup_codes = {}
+
+    def add_webauthn_key(self, user, **fields):
+        with self.lock:
+            key = WebAuthnKey(
+                pk=len(self.webauthn_keys) + 1,
+                user=user,
+                last_used_at=None,
+                **fields,
+            )
+            self.webauthn_keys[key.credential_id] = key
+        return key
+
+    def add_totp_device(self, user, key):
+        with self.lock:
+            device = TOTPDevice(
+                pk=len(self.totp_devices) + 1, user=user, key=key, last_t=None
+            )
+            self.totp_devices[device.pk] = device
+        return device
+
+    def add_hotp_device(self, user, key, counter=0):
+        with self.lock:
+            device = HOTPDevice(
+                pk=len(self.hotp_devices) + 1, user=user, key=key, counter=counter
+            )
+            self.hotp_devices[device.pk] = device
+        return device
+
+    def add_backup_code(self, user, code):
+        with self.lock:
+            self.backup_codes.setdefault(user.pk, set()).add(code)
+
+    def _copy(self, obj):
+        # Callers change the factors they are handed, like unsaved instances.
+        copy = type(obj)(
+            **{field.attname: getattr(obj, field.attname) for field in obj._meta.fields}
+        )
+        copy.user = obj.user
+        return copy
+
+    def get_enabled_factors(self, user):
+        with self.lock:
+            return {
+                "webauthn": any(
+                    key.user_id == user.pk for key in self.webauthn_keys.values()
+                ),
+                "backup": bool(self.backup_codes.get(user.pk)),
+                "totp": any(
+                    device.user_id == user.pk for device in self.totp_devices.values()
+                ),
+                "hotp": any(
+                    device.user_id == user.pk for device in self.hotp_devices.values()
+                ),
+            }
+
+    def get_credential_ids(self, user):
+        return [key.credential_id for key in self.get_webauthn_keys(user)]
+
+    def get_webauthn_keys(self, user):
+        with self.lock:
+            return [
+                self._copy(key)
+                for key in self.webauthn_keys.values()
+                if key.user_id == user.pk
+            ]
+
+    def get_webauthn_key(self, credential_id, user=None):
+        with self.lock:
+            key = self.webauthn_keys.get(credential_id)
+            if key is None or (user is not None and key.user_id != user.pk):
+                return None
+            return self._copy(key)
+
+    def update_sign_count(self, key, sign_count):
+        now = timezone.now()
+        with self.lock:
+            stored = self.webauthn_keys.get(key.credential_id)
+            if stored is None or stored.sign_count != key.sign_count:
+                return False
+            stored.sign_count = key.sign_count = sign_count
+            stored.last_used_at = key.last_used_at = now
+        return True
+
+    def get_totp_devices(self, user):
+        with self.lock:
+            return [
+                self._copy(device)
+                for device in self.totp_devices.values()
+                if device.user_id == user.pk
+            ]
+
+    def record_totp_use(self, device):
+        now = timezone.now()
+        with self.lock:
+            stored = self.totp_devices.get(device.pk)
+            if stored is None:
+                return False
+            if stored.last_t is not None and stored.last_t >= device.last_t:
+                return False
+            stored.last_t = device.last_t
+            stored.last_used_at = device.last_used_at = now
+        return True
+
+    def get_hotp_devices(self, user):
+        with self.lock:
+            return [
+                self._copy(device)
+                for device in self.hotp_devices.values()
+                if device.user_id == user.pk
+            ]
+
+    def record_hotp_use(self, device):
+        now = timezone.now()
+        with self.lock:
+            stored = self.hotp_devices.get(device.pk)
+            if stored is None or stored.counter >= device.counter:
+                return False
+            stored.counter = device.counter
+            stored.last_used_at = device.last_used_at = now
+        return True
+
+    def consume_backup_code(self, user, code):
+        with self.lock:
+            codes = self.backup_codes.get(user.pk, set())
+            if code not in codes:
+                return False
+            codes.remove(code)
+        return True
+
+
+_repository = None
+
+
+def get_repository():
+    global _repository
+    if _repository is None:
+        _repository = import_string(settings.KAGI_CREDENTIAL_REPOSITORY)()
+    return _repository
@@ -0,0 +1,86 @@
+"""
+Routing of the reads of kagi's models to database replicas.
+
+``ReplicaRouter`` sends the reads of kagi's models to one of the
+``KAGI_DATABASE_REPLICAS`` aliases, and their writes to
+``KAGI_DATABASE_PRIMARY``. Models of other apps are left to the other routers.
+
+Reads go to the primary instead within a transaction on it, and within a
+``track_writes()`` block that is pinned, or in which kagi wrote to the primary.
+``ReplicaPinningMiddleware`` opens such a block for every request, pinned for a
+while after a previous request of the same browser wrote, so that users read
+their own writes despite the replication lag.
+"""
+
+import contextlib
+import contextvars
+import random
+
+from django.db import connections, router
+
+from . import settings
+
+
+class _TrackedWrites:
+    __slots__ = ("pinned", "wrote")
+
+    def __init__(self, pinned):
+        self.pinned = pinned
+        self.wrote = False
+
+
+_tracked_writes = contextvars.ContextVar("kagi_tracked_writes", default=None)
+
+
+@contextlib.contextmanager
+def track_writes(*, pinned=False):
+    """
+    Sends the reads of kagi's models to the primary database within the block
+    when ``pinned`` is true, or once kagi wrote to it. The yielded object's
+    ``wrote`` attribute tells whether kagi wrote to it.
+    """
+    tracked = _TrackedWrites(pinned)
+    token = _tracked_writes.set(tracked)
+    try:
+        yield tracked
+    finally:
+        _tracked_writes.reset(token)
+
+
+def primary_alias(model):
+    """
+    Returns the database that ``model`` is written to, for reads that must not
+    lag behind the writes. Unlike a write, this does not pin the later reads.
+    """
+    token = _tracked_writes.set(None)
+    try:
+        return router.db_for_write(model)
+    finally:
+        _tracked_writes.reset(token)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label != "kagi" or not settings.KAGI_DATABASE_REPLICAS:
+            return None
+        primary = settings.KAGI_DATABASE_PRIMARY
+        tracked = _tracked_writes.get()
+        if tracked is not None and (tracked.pinned or tracked.wrote):
+            return primary
+        if connections[primary].in_atomic_block:
+            return primary
+        return random.choice(settings.KAGI_DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label != "kagi":
+            return None
+        tracked = _tracked_writes.get()
+        if tracked is not None:
+            tracked.wrote = True
+        return settings.KAGI_DATABASE_PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = {settings.KAGI_DATABASE_PRIMARY, *settings.KAGI_DATABASE_REPLICAS}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
@@ -1,4 +1,5 @@
 import os.path
+import tempfile
 
 from django.conf import settings
 
@@ -21,3 +22,62 @@ WEBAUTHN_SELF_ATTESTATION_PERMITTED = getattr(
 WEBAUTHN_NONE_ATTESTATION_PERMITTED = getattr(
     settings, "WEBAUTHN_NONE_ATTESTATION_PERMITTED", False
 )
+KAGI_TOTP_QRCODE_CACHE_SIZE = getattr(settings, "KAGI_TOTP_QRCODE_CACHE_SIZE", 128)
+KAGI_TOTP_QRCODE_MAX_AGE = getattr(settings, "KAGI_TOTP_QRCODE_MAX_AGE", 3600)
+KAGI_INSTRUMENTATION_SINK = getattr(settings, "KAGI_INSTRUMENTATION_SINK", None)
+KAGI_PROFILER_SAMPLE_RATE = getattr(settings, "KAGI_PROFILER_SAMPLE_RATE", 0)
+KAGI_PROFILER_DIR = getattr(
+    settings,
+    "KAGI_PROFILER_DIR",
+    os.path.join(tempfile.gettempdir(), "kagi-profiles"),
+)
+KAGI_PROFILER_MAX_FILES = getattr(settings, "KAGI_PROFILER_MAX_FILES", 100)
+KAGI_AUTH_EVENT_QUEUE_SIZE = getattr(settings, "KAGI_AUTH_EVENT_QUEUE_SIZE", 10000)
+KAGI_AUTH_EVENT_QUEUE_POLICY = getattr(settings, "KAGI_AUTH_EVENT_QUEUE_POLICY", "drop")
+KAGI_AUTH_EVENT_QUEUE_TIMEOUT = getattr(settings, "KAGI_AUTH_EVENT_QUEUE_TIMEOUT", 1)
+KAGI_AUTH_EVENT_BATCH_SIZE = getattr(settings, "KAGI_AUTH_EVENT_BATCH_SIZE", 500)
+KAGI_AUTH_EVENT_FLUSH_INTERVAL = getattr(settings, "KAGI_AUTH_EVENT_FLUSH_INTERVAL", 1)
+KAGI_AUTH_EVENT_RETENTION_DAYS = getattr(settings, "KAGI_AUTH_EVENT_RETENTION_DAYS", 90)
+KAGI_RATE_LIMIT_CACHE = getattr(settings, "KAGI_RATE_LIMIT_CACHE", "default")
+KAGI_RATE_LIMIT_WINDOW = getattr(settings, "KAGI_RATE_LIMIT_WINDOW", 300)
+KAGI_RATE_LIMIT_USER_ATTEMPTS = getattr(settings, "KAGI_RATE_LIMIT_USER_ATTEMPTS", 10)
+KAGI_RATE_LIMIT_IP_ATTEMPTS = getattr(settings, "KAGI_RATE_LIMIT_IP_ATTEMPTS", 100)
+KAGI_RATE_LIMIT_SKETCH_WIDTH = getattr(settings, "KAGI_RATE_LIMIT_SKETCH_WIDTH", 4096)
+KAGI_RATE_LIMIT_SKETCH_DEPTH = getattr(settings, "KAGI_RATE_LIMIT_SKETCH_DEPTH", 4)
+KAGI_TRUSTED_DEVICE_DAYS = getattr(settings, "KAGI_TRUSTED_DEVICE_DAYS", 0)
+KAGI_TRUSTED_DEVICE_COOKIE_NAME = getattr(
+    settings, "KAGI_TRUSTED_DEVICE_COOKIE_NAME", "kagi_trusted_device"
+)
+KAGI_TRUSTED_DEVICE_CACHE = getattr(settings, "KAGI_TRUSTED_DEVICE_CACHE", "default")
+KAGI_DATABASE_PRIMARY = getattr(settings, "KAGI_DATABASE_PRIMARY", "default")
+KAGI_DATABASE_REPLICAS = getattr(settings, "KAGI_DATABASE_REPLICAS", [])
+KAGI_REPLICA_PIN_SECONDS = getattr(settings, "KAGI_REPLICA_PIN_SECONDS", 15)
+KAGI_REPLICA_PIN_COOKIE_NAME = getattr(
+    settings, "KAGI_REPLICA_PIN_COOKIE_NAME", "kagi_pin_primary"
+)
+KAGI_CREDENTIAL_REPOSITORY = getattr(
+    settings, "KAGI_CREDENTIAL_REPOSITORY", "kagi.repositories.ORMCredentialRepository"
+)
+KAGI_RELYING_PARTIES = getattr(settings, "KAGI_RELYING_PARTIES", {})
+KAGI_RELYING_PARTY_RESOLVER = getattr(
+    settings,
+    "KAGI_RELYING_PARTY_RESOLVER",
+    "kagi.relying_party.HostRelyingPartyResolver",
+)
+KAGI_SHARED_CACHE_PATH = getattr(settings, "KAGI_SHARED_CACHE_PATH", None)
+KAGI_SHARED_CACHE_SLOTS = getattr(settings, "KAGI_SHARED_CACHE_SLOTS", 4096)
+KAGI_SHARED_CACHE_SLOT_SIZE = getattr(settings, "KAGI_SHARED_CACHE_SLOT_SIZE", 1024)
+KAGI_SHARED_CACHE_VERSION_CACHE = getattr(
+    settings, "KAGI_SHARED_CACHE_VERSION_CACHE", "default"
+)
+KAGI_ADMIN_REVOKE_BATCH_SIZE = getattr(settings, "KAGI_ADMIN_REVOKE_BATCH_SIZE", 500)
+KAGI_FACTOR_PAGE_SIZE = getattr(settings, "KAGI_FACTOR_PAGE_SIZE", 50)
+KAGI_FRAGMENT_CACHE = getattr(settings, "KAGI_FRAGMENT_CACHE", None)
+KAGI_FRAGMENT_CACHE_TIMEOUT = getattr(settings, "KAGI_FRAGMENT_CACHE_TIMEOUT", 300)
+KAGI_TOTP_ENCRYPTION_KEYS = getattr(settings, "KAGI_TOTP_ENCRYPTION_KEYS", {})
+KAGI_TOTP_ENCRYPTION_KEY_ID = getattr(settings, "KAGI_TOTP_ENCRYPTION_KEY_ID", None)
+KAGI_TOTP_SECRET_CACHE_SIZE = getattr(settings, "KAGI_TOTP_SECRET_CACHE_SIZE", 1024)
+KAGI_TOTP_SECRET_CACHE_TTL = getattr(settings, "KAGI_TOTP_SECRET_CACHE_TTL", 300)
+KAGI_SIDECAR_WORKERS = getattr(settings, "KAGI_SIDECAR_WORKERS", 16)
+KAGI_SIDECAR_BACKLOG = getattr(settings, "KAGI_SIDECAR_BACKLOG", 1024)
+KAGI_HOTP_LOOK_AHEAD = getattr(settings, "KAGI_HOTP_LOOK_AHEAD", 50)
@@ -0,0 +1,145 @@
+"""
+A cache of read-mostly data shared by the worker processes of a host.
+
+When ``KAGI_SHARED_CACHE_PATH`` is set, ``get_or_set()`` keeps values in a
+file mapped in memory by every process, instead of each process warming up
+its own copy. The file is divided into ``KAGI_SHARED_CACHE_SLOTS`` slots of
+``KAGI_SHARED_CACHE_SLOT_SIZE`` bytes, and each key is hashed to one slot,
+which holds the JSON-encoded value, its version and a digest of both.
+
+The version of each key is kept in the Django cache named by
+``KAGI_SHARED_CACHE_VERSION_CACHE``, and ``invalidate()`` increments it, so
+that a change made by one worker is seen by all of them. Slots are written
+without locks: a value whose digest does not match the key, its current
+version and its bytes, because it was overwritten, torn by a concurrent write
+or stale, is a cache miss.
+"""
+
+import hashlib
+import hmac
+import json
+import mmap
+import os
+import struct
+
+from django.core.cache import caches
+
+from . import settings
+from .utils.cache import bump_counter, get_counter
+
+# The version, length and digest of the value in a slot.
+HEADER = struct.Struct("<QI16s")
+
+
+class SharedMemoryCache:
+    def __init__(self, path, slots, slot_size):
+        self.slots = slots
+        self.slot_size = slot_size
+        size = slots * slot_size
+        with open(path, "a+b") as f:
+            if os.fstat(f.fileno()).st_size < size:
+                f.truncate(size)
+            self.mmap = mmap.mmap(f.fileno(), size)
+
+    def _offset(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+        return int.from_bytes(digest, "little") % self.slots * self.slot_size
+
+    def _digest(self, key, version, data):
+        return hashlib.blake2b(
+            b"%s\0%d\0%s" % (key.encode(), version, data), digest_size=16
+        ).digest()
+
+    def get(self, key, version):
+        """
+        Returns the value of ``key`` at ``version``, or ``None``.
+        """
+        offset = self._offset(key)
+        stored_version, length, digest = HEADER.unpack_from(self.mmap, offset)
+        if stored_version != version or length > self.slot_size - HEADER.size:
+            return None
+        start = offset + HEADER.size
+        data = self.mmap[start : start + length]
+        if not hmac.compare_digest(digest, self._digest(key, version, data)):
+            return None
+        return json.loads(data)
+
+    def set(self, key, version, value):
+        """
+        Stores the value of ``key`` at ``version``, replacing the value of any
+        key in the same slot. Returns whether it fit in the slot.
+        """
+        data = json.dumps(value, separators=(",", ":")).encode()
+        if len(data) > self.slot_size - HEADER.size:
+            return False
+        offset = self._offset(key)
+        start = offset + HEADER.size
+        self.mmap[start : start + len(data)] = data
+        HEADER.pack_into(
+            self.mmap, offset, version, len(data), self._digest(key, version, data)
+        )
+        return True
+
+
+def get_version(key):
+    return get_counter(
+        caches[settings.KAGI_SHARED_CACHE_VERSION_CACHE],
+        f"kagi:shared-cache-version:{key}",
+    )
+
+
+def invalidate(key):
+    """
+    Makes every process recompute the value of ``key``.
+    """
+    if settings.KAGI_SHARED_CACHE_PATH is None:
+        return
+    bump_counter(
+        caches[settings.KAGI_SHARED_CACHE_VERSION_CACHE],
+        f"kagi:shared-cache-version:{key}",
+    )
+
+
+_cache = None
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        _cache = SharedMemoryCache(
+            settings.KAGI_SHARED_CACHE_PATH,
+            settings.KAGI_SHARED_CACHE_SLOTS,
+            settings.KAGI_SHARED_CACHE_SLOT_SIZE,
+        )
+    return _cache
+
+
+def get_or_set(key, default):
+    """
+    Returns the shared value of ``key``, computing it with ``default()`` when
+    missing. ``default()`` must return a JSON-serializable value other than
+    ``None``.
+    """
+    if settings.KAGI_SHARED_CACHE_PATH is None:
+        return default()
+    # The version is read first, so that a value computed before an
+    # invalidation is stored under the version it is valid for.
+    version = get_version(key)
+    if version is None:
+        # The version cache does not keep values, such as a DummyCache, so no
+        # stored value could ever be invalidated.
+        return default()
+    cache = get_cache()
+    value = cache.get(key, version)
+    if value is None:
+        value = default()
+        cache.set(key, version, value)
+    return value
+
+
+def credential_ids_key(user_id):
+    return f"credential-ids:{user_id}"
+
+
+def invalidate_credential_ids(sender, instance, **kwargs):
+    invalidate(credential_ids_key(instance.user_id))
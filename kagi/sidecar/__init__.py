@@ -0,0 +1,56 @@
+"""
+A verification server for the services that cannot run Django.
+
+The server, started with the ``runsidecar`` management command, verifies the
+TOTP and HOTP tokens and backup codes of kagi's users over a Unix domain socket,
+with the same replay protection and attempt limits as the verification views.
+
+Messages in both directions are JSON objects, each preceded by its length as a
+4-byte big-endian integer. A request names a user, a factor type and a token,
+and optionally the IP address of the end user, for the attempt limits::
+
+    {"username": "alice", "type": "totp", "token": "123456", "ip": "192.0.2.1"}
+
+The response tells whether the token was accepted, and when the request was
+refused, why::
+
+    {"ok": false, "retry_after": 42}
+    {"ok": false, "error": "Unknown factor type."}
+
+Requests on a connection are answered in order. This package and its client
+only use the standard library, so that they can be imported without Django.
+"""
+
+import json
+import struct
+
+HEADER = struct.Struct("!I")
+# Requests are a few dozen bytes long, so larger frames are refused before
+# being read.
+MAX_FRAME_SIZE = 4096
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def encode_frame(message):
+    data = json.dumps(message, separators=(",", ":")).encode()
+    return HEADER.pack(len(data)) + data
+
+
+def decode_length(header):
+    (length,) = HEADER.unpack(header)
+    if length > MAX_FRAME_SIZE:
+        raise ProtocolError("The message is too long.")
+    return length
+
+
+def decode_message(data):
+    try:
+        message = json.loads(data)
+    except ValueError:
+        raise ProtocolError("The message is not valid JSON.")
+    if not isinstance(message, dict):
+        raise ProtocolError("The message is not a JSON object.")
+    return message
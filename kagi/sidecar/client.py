@@ -0,0 +1,128 @@
+"""
+Clients of the verification server, for blocking and asyncio code.
+"""
+
+import asyncio
+import socket
+
+from . import HEADER, ProtocolError, decode_length, decode_message, encode_frame
+
+
+def make_request(username, factor_type, token, ip):
+    request = {"username": username, "type": factor_type, "token": token}
+    if ip is not None:
+        request["ip"] = ip
+    return request
+
+
+class Client:
+    """
+    A connection to the verification server at ``path``, opened on first use
+    and kept for the following requests. It must not be shared by threads.
+    """
+
+    def __init__(self, path, timeout=5):
+        self.path = path
+        self.timeout = timeout
+        self.sock = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def recv_exactly(self, size):
+        data = b""
+        while len(data) < size:
+            chunk = self.sock.recv(size - len(data))
+            if not chunk:
+                raise ProtocolError("The server closed the connection.")
+            data += chunk
+        return data
+
+    def request(self, message):
+        if self.sock is None:
+            self.connect()
+        try:
+            self.sock.sendall(encode_frame(message))
+            length = decode_length(self.recv_exactly(HEADER.size))
+            return decode_message(self.recv_exactly(length))
+        except (OSError, ProtocolError):
+            # The connection is in an unknown state after a failure.
+            self.close()
+            raise
+
+    def verify(self, username, factor_type, token, ip=None):
+        """
+        Returns the server's response to the verification of ``token``, a
+        dictionary whose ``ok`` item tells whether it was accepted.
+        """
+        return self.request(make_request(username, factor_type, token, ip))
+
+
+class AsyncClient:
+    """
+    The asyncio version of ``Client``. Concurrent requests wait for their turn
+    on the connection, so callers wanting parallelism open several clients.
+    """
+
+    def __init__(self, path, timeout=5):
+        self.path = path
+        self.timeout = timeout
+        self.reader = self.writer = None
+        self.lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        if self.writer is not None:
+            writer, self.reader, self.writer = self.writer, None, None
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:  # pragma: no cover
+                pass
+
+    async def exchange(self, message):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_unix_connection(self.path)
+        self.writer.write(encode_frame(message))
+        await self.writer.drain()
+        length = decode_length(await self.reader.readexactly(HEADER.size))
+        return decode_message(await self.reader.readexactly(length))
+
+    async def request(self, message):
+        async with self.lock:
+            try:
+                return await asyncio.wait_for(self.exchange(message), self.timeout)
+            except (
+                OSError,
+                ProtocolError,
+                asyncio.IncompleteReadError,
+                asyncio.TimeoutError,
+            ):
+                await self.close()
+                raise
+
+    async def verify(self, username, factor_type, token, ip=None):
+        return await self.request(make_request(username, factor_type, token, ip))
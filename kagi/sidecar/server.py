@@ -0,0 +1,177 @@
+"""
+The verification server.
+
+Connections are served by an asyncio event loop, so that thousands of idle or
+slow clients only cost a coroutine each. Verifications query the database, and
+run in a pool of ``KAGI_SIDECAR_WORKERS`` threads. As in a request, the
+database connection of a thread is closed after each verification unless
+``CONN_MAX_AGE`` keeps it open, in which case the pool holds at most one
+persistent connection per thread.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import ipaddress
+import logging
+import os
+
+from django.contrib.auth import get_user_model
+from django.db import close_old_connections
+
+from . import HEADER, ProtocolError, decode_length, decode_message, encode_frame
+from .. import settings
+from ..events import record_event
+from ..forms import TOKEN_FORM_CLASSES
+from ..ratelimit import check_limits
+
+logger = logging.getLogger(__name__)
+
+
+def verify_token(user, factor_type, token):
+    """
+    Returns whether ``token`` is valid for ``user``, and the verified device.
+    Tokens are checked, and used once, by the forms of the verification views.
+    """
+    form_class = TOKEN_FORM_CLASSES[factor_type]
+    form = form_class(
+        {form_class.token_field: token}, user=user, request=None, appId=None
+    )
+    ok = form.is_valid() and form.validate_second_factor()
+    return ok, getattr(form, "device", None)
+
+
+def verify(request):
+    username = request.get("username")
+    factor_type = request.get("type")
+    token = request.get("token")
+    ip = request.get("ip")
+    if not isinstance(factor_type, str) or factor_type not in TOKEN_FORM_CLASSES:
+        return {"ok": False, "error": "Unknown factor type."}
+    if not all(isinstance(value, str) for value in (username, token)):
+        return {"ok": False, "error": "The username and token must be strings."}
+    if ip is not None:
+        # The address is stored with the event, and keys the rate limit, in
+        # its canonical form. Integers are not taken as addresses.
+        try:
+            if not isinstance(ip, str):
+                raise ValueError(ip)
+            ip = str(ipaddress.ip_address(ip))
+        except ValueError:
+            return {"ok": False, "error": "Invalid IP address."}
+
+    # The address is limited before the user is looked up, so that clients
+    # cannot probe for usernames beyond its limit. Attempts against the limit
+    # of the user are only counted for existing users.
+    retry_after = check_limits(ip=ip)
+    if retry_after is not None:
+        return {"ok": False, "retry_after": retry_after}
+
+    User = get_user_model()
+    try:
+        user = User._default_manager.get_by_natural_key(username)
+    except User.DoesNotExist:
+        user = None
+    if user is None or not user.is_active:
+        # Unknown users are not distinguished from invalid tokens.
+        return {"ok": False}
+
+    retry_after = check_limits(user_pk=user.pk)
+    if retry_after is not None:
+        return {"ok": False, "retry_after": retry_after}
+
+    ok, device = verify_token(user, factor_type, token)
+    record_event(
+        None,
+        user,
+        factor_type,
+        succeeded=ok,
+        factor_id=device.pk if device else None,
+        ip_address=ip,
+    )
+    return {"ok": ok}
+
+
+def handle_request(request):
+    # Stale and broken connections are closed around each verification, as
+    # Django does around each request.
+    close_old_connections()
+    try:
+        return verify(request)
+    except Exception:
+        logger.exception("Could not verify a token.")
+        return {"ok": False, "error": "Internal error."}
+    finally:
+        close_old_connections()
+
+
+async def read_request(reader):
+    """
+    Returns the next request of the connection, or ``None`` once the client
+    closed it.
+    """
+    try:
+        header = await reader.readexactly(HEADER.size)
+    except asyncio.IncompleteReadError as exc:
+        if exc.partial:
+            raise ProtocolError("The message is truncated.")
+        return None
+    try:
+        data = await reader.readexactly(decode_length(header))
+    except asyncio.IncompleteReadError:
+        raise ProtocolError("The message is truncated.")
+    return decode_message(data)
+
+
+class VerificationServer:
+    def __init__(self, workers=None):
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers or settings.KAGI_SIDECAR_WORKERS,
+            thread_name_prefix="kagi-sidecar",
+        )
+
+    async def handle_connection(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                except ProtocolError as exc:
+                    writer.write(encode_frame({"ok": False, "error": str(exc)}))
+                    await writer.drain()
+                    break
+                if request is None:
+                    break
+                response = await loop.run_in_executor(
+                    self.executor, handle_request, request
+                )
+                writer.write(encode_frame(response))
+                await writer.drain()
+        except ConnectionError:  # pragma: no cover
+            # The client went away before reading its response.
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, path, backlog=None, mode=0o660):
+        """
+        Starts serving on the Unix domain socket at ``path``, replacing any
+        socket left there, and returns the ``asyncio.Server``.
+        """
+        server = await asyncio.start_unix_server(
+            self.handle_connection,
+            path=path,
+            backlog=backlog or settings.KAGI_SIDECAR_BACKLOG,
+        )
+        os.chmod(path, mode)
+        return server
+
+    async def serve(self, path, backlog=None, mode=0o660):
+        server = await self.start(path, backlog, mode)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.close()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
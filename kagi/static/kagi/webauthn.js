@@ -1,4 +1,4 @@
-/* Licensed under the Apache License, Version 2.0 (the "License");
+/*! Licensed under the Apache License, Version 2.0 (the "License");
  * you may not use this file except in compliance with the License.
  * You may obtain a copy of the License at
  *
@@ -44,92 +44,95 @@ const doWebAuthn = (formId, func) => {
   const webAuthnButton = webAuthnForm.querySelector("button[type=submit]");
   webAuthnButton.disabled = false;
 
-  webAuthnForm.addEventListener("submit", async () => {
-    func(webAuthnButton.value);
+  webAuthnForm.addEventListener("submit", async (event) => {
     event.preventDefault();
+    func(webAuthnButton.value);
   });
 };
 
-const webAuthnBtoA = (encoded) => {
-  return btoa(encoded)
-    .replace(/\+/g, "-")
-    .replace(/\//g, "_")
-    .replace(/=/g, "");
+const toBase64Url = (buffer) => {
+  return btoa(String.fromCharCode(...new Uint8Array(buffer)))
+    .replaceAll("+", "-")
+    .replaceAll("/", "_")
+    .replaceAll("=", "");
 };
 
-const webAuthnBase64Normalize = (encoded) => {
-  return encoded.replace(/_/g, "/").replace(/-/g, "+");
+const fromBase64Url = (encoded) => {
+  const decoded = atob(encoded.replaceAll("-", "+").replaceAll("_", "/"));
+  return Uint8Array.from(decoded, (c) => c.charCodeAt(0));
 };
 
-const transformAssertionOptions = (assertionOptions) => {
-  let { challenge, allowCredentials } = assertionOptions;
-
-  challenge = Uint8Array.from(challenge, (c) => c.charCodeAt(0));
-  allowCredentials = allowCredentials.map((credentialDescriptor) => {
-    let { id } = credentialDescriptor;
-    id = webAuthnBase64Normalize(id);
-    id = Uint8Array.from(atob(id), (c) => c.charCodeAt(0));
-    return Object.assign({}, credentialDescriptor, { id });
-  });
-
-  const transformedOptions = Object.assign({}, assertionOptions, {
-    challenge,
-    allowCredentials,
+const parseDescriptors = (descriptors = []) => {
+  return descriptors.map((descriptor) => {
+    return Object.assign({}, descriptor, { id: fromBase64Url(descriptor.id) });
   });
+};
 
-  return transformedOptions;
+/* NOTE: The server expects the client data to hold the challenge string
+ * itself rather than the bytes it encodes, so the challenge is encoded once
+ * more before being parsed.
+ */
+const encodeChallenge = (options) => {
+  const challenge = toBase64Url(new TextEncoder().encode(options.challenge));
+  return Object.assign({}, options, { challenge });
 };
 
-const transformAssertion = (assertion) => {
-  const authData = new Uint8Array(assertion.response.authenticatorData);
-  const clientDataJSON = new Uint8Array(assertion.response.clientDataJSON);
-  const rawId = new Uint8Array(assertion.rawId);
-  const sig = new Uint8Array(assertion.response.signature);
-  const assertionClientExtensions = assertion.getClientExtensionResults();
+/* The parse*FromJSON() and toJSON() methods of PublicKeyCredential are used
+ * where browsers provide them, and are otherwise replaced with the fallbacks
+ * below.
+ */
+const parseCreationOptions = (credentialOptions) => {
+  const options = encodeChallenge(credentialOptions);
+  if (PublicKeyCredential.parseCreationOptionsFromJSON) {
+    return PublicKeyCredential.parseCreationOptionsFromJSON(options);
+  }
 
-  return {
-    id: assertion.id,
-    rawId: webAuthnBtoA(String.fromCharCode(...rawId)),
-    response: {
-      authenticatorData: webAuthnBtoA(String.fromCharCode(...authData)),
-      clientDataJSON: webAuthnBtoA(String.fromCharCode(...clientDataJSON)),
-      signature: webAuthnBtoA(String.fromCharCode(...sig)),
-    },
-    type: assertion.type,
-    assertionClientExtensions: JSON.stringify(assertionClientExtensions),
-  };
+  /* NOTE: Unlike the challenge, the user handle is not encoded once more,
+   * since authenticators return it as-is in the assertions of passkey logins.
+   */
+  return Object.assign({}, options, {
+    challenge: fromBase64Url(options.challenge),
+    user: Object.assign({}, options.user, { id: fromBase64Url(options.user.id) }),
+    excludeCredentials: parseDescriptors(options.excludeCredentials),
+  });
 };
 
-const transformCredentialOptions = (credentialOptions) => {
-  let { challenge, user } = credentialOptions;
-  user.id = Uint8Array.from(credentialOptions.user.id, (c) => c.charCodeAt(0));
-  challenge = Uint8Array.from(credentialOptions.challenge, (c) =>
-    c.charCodeAt(0)
-  );
+const parseRequestOptions = (assertionOptions) => {
+  const options = encodeChallenge(assertionOptions);
+  if (PublicKeyCredential.parseRequestOptionsFromJSON) {
+    return PublicKeyCredential.parseRequestOptionsFromJSON(options);
+  }
 
-  const transformedOptions = Object.assign({}, credentialOptions, {
-    challenge,
-    user,
+  return Object.assign({}, options, {
+    challenge: fromBase64Url(options.challenge),
+    allowCredentials: parseDescriptors(options.allowCredentials),
   });
-
-  return transformedOptions;
 };
 
-const transformCredential = (credential) => {
-  const attObj = new Uint8Array(credential.response.attestationObject);
-  const clientDataJSON = new Uint8Array(credential.response.clientDataJSON);
-  const rawId = new Uint8Array(credential.rawId);
-  const registrationClientExtensions = credential.getClientExtensionResults();
+const credentialToJSON = (credential) => {
+  if (typeof credential.toJSON === "function") {
+    return credential.toJSON();
+  }
+
+  const response = {};
+  for (const name of [
+    "clientDataJSON",
+    "attestationObject",
+    "authenticatorData",
+    "signature",
+    "userHandle",
+  ]) {
+    if (credential.response[name]) {
+      response[name] = toBase64Url(credential.response[name]);
+    }
+  }
 
   return {
     id: credential.id,
-    rawId: webAuthnBtoA(String.fromCharCode(...rawId)),
+    rawId: toBase64Url(credential.rawId),
     type: credential.type,
-    response: {
-      attestationObject: webAuthnBtoA(String.fromCharCode(...attObj)),
-      clientDataJSON: webAuthnBtoA(String.fromCharCode(...clientDataJSON)),
-    },
-    registrationClientExtensions: JSON.stringify(registrationClientExtensions),
+    response,
+    clientExtensionResults: credential.getClientExtensionResults(),
   };
 };
 
@@ -149,12 +152,17 @@ const postCredential = async (keyName, credential, token) => {
   return await resp.json();
 };
 
-const postAssertion = async (assertion, token) => {
+const postAssertion = async (assertion, token, url = Kagi.verify_assertion) => {
   const formData = new FormData();
   formData.set("credentials", JSON.stringify(assertion));
   formData.set("csrf_token", token);
 
-  const resp = await fetch(Kagi.verify_assertion + window.location.search, {
+  const rememberDevice = document.getElementById("webauthn-remember-device");
+  if (rememberDevice !== null && rememberDevice.checked) {
+    formData.set("remember_device", "on");
+  }
+
+  const resp = await fetch(url + window.location.search, {
     method: "POST",
     cache: "no-cache",
     body: formData,
@@ -193,13 +201,13 @@ const ProvisionWebAuthn = () => {
     });
 
     const credentialOptions = await resp.json();
-    const transformedOptions = transformCredentialOptions(credentialOptions);
+    const transformedOptions = parseCreationOptions(credentialOptions);
     await navigator.credentials
       .create({
         publicKey: transformedOptions,
       })
       .then(async (credential) => {
-        const transformedCredential = transformCredential(credential);
+        const transformedCredential = credentialToJSON(credential);
 
         const status = await postCredential(
           label,
@@ -221,26 +229,42 @@ const ProvisionWebAuthn = () => {
   });
 };
 
+const popEmbeddedAssertionOptions = () => {
+  const optionsElement = document.getElementById("webauthn-assertion-options");
+  if (optionsElement === null) {
+    return null;
+  }
+
+  /* NOTE: The embedded challenge is only good for a single attempt, so we
+   * remove it and let any retry fetch a fresh one from the server.
+   */
+  optionsElement.remove();
+  return JSON.parse(optionsElement.textContent);
+};
+
 const AuthenticateWebAuthn = () => {
   doWebAuthn("webauthn-auth-form", async (csrfToken) => {
-    const resp = await fetch(Kagi.begin_assertion + window.location.search, {
-      cache: "no-cache",
-      credentials: "same-origin",
-    });
+    let assertionOptions = popEmbeddedAssertionOptions();
+    if (assertionOptions === null) {
+      const resp = await fetch(Kagi.begin_assertion + window.location.search, {
+        cache: "no-cache",
+        credentials: "same-origin",
+      });
+      assertionOptions = await resp.json();
+    }
 
-    const assertionOptions = await resp.json();
     if (assertionOptions.fail) {
       window.location.replace("/account/");
       return;
     }
 
-    const transformedOptions = transformAssertionOptions(assertionOptions);
+    const transformedOptions = parseRequestOptions(assertionOptions);
     await navigator.credentials
       .get({
         publicKey: transformedOptions,
       })
       .then(async (assertion) => {
-        const transformedAssertion = transformAssertion(assertion);
+        const transformedAssertion = credentialToJSON(assertion);
 
         const status = await postAssertion(transformedAssertion, csrfToken);
         if (status.fail) {
@@ -257,6 +281,41 @@ const AuthenticateWebAuthn = () => {
   });
 };
 
+const AuthenticatePasskey = () => {
+  doWebAuthn("webauthn-passkey-form", async (csrfToken) => {
+    const resp = await fetch(Kagi.begin_passkey_assertion, {
+      cache: "no-cache",
+      credentials: "same-origin",
+    });
+
+    const assertionOptions = await resp.json();
+    const transformedOptions = parseRequestOptions(assertionOptions);
+    await navigator.credentials
+      .get({
+        publicKey: transformedOptions,
+      })
+      .then(async (assertion) => {
+        const transformedAssertion = credentialToJSON(assertion);
+
+        const status = await postAssertion(
+          transformedAssertion,
+          csrfToken,
+          Kagi.verify_passkey_assertion
+        );
+        if (status.fail) {
+          populateWebAuthnErrorList([status.fail]);
+          return;
+        }
+
+        window.location.replace(status.redirect_to);
+      })
+      .catch((error) => {
+        populateWebAuthnErrorList([error.message]);
+        return;
+      });
+  });
+};
+
 document.addEventListener("DOMContentLoaded", (e) => {
   const registerElement = document.querySelector("#webauthn-provision-form");
   if (registerElement) {
@@ -267,6 +326,11 @@ document.addEventListener("DOMContentLoaded", (e) => {
   if (loginElement) {
     AuthenticateWebAuthn();
   }
+
+  const passkeyElement = document.querySelector("#webauthn-passkey-form");
+  if (passkeyElement) {
+    AuthenticatePasskey();
+  }
   // If browser doesn't support WebAuthn, hide related elements and show warning
   if (typeof PublicKeyCredential == "undefined") {
     var webAuthnFeature = document.getElementById("webauthn-feature");
@@ -0,0 +1,35 @@
+/*! Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ * http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ *
+ * Origin: https://github.com/pypi/warehouse
+ */
+const populateWebAuthnErrorList=(errors)=>{const errorList=document.getElementById("webauthn-errors");if(errorList===null){return;}
+errorList.setAttribute("role","alert");errors.forEach((error)=>{const errorItem=document.createElement("li");errorItem.appendChild(document.createTextNode(error));errorList.appendChild(errorItem);});};const doWebAuthn=(formId,func)=>{if(!window.PublicKeyCredential){return;}
+const webAuthnForm=document.getElementById(formId);if(webAuthnForm===null){return null;}
+const webAuthnButton=webAuthnForm.querySelector("button[type=submit]");webAuthnButton.disabled=false;webAuthnForm.addEventListener("submit",async(event)=>{event.preventDefault();func(webAuthnButton.value);});};const toBase64Url=(buffer)=>{return btoa(String.fromCharCode(...new Uint8Array(buffer))).replaceAll("+","-").replaceAll("/","_").replaceAll("=","");};const fromBase64Url=(encoded)=>{const decoded=atob(encoded.replaceAll("-","+").replaceAll("_","/"));return Uint8Array.from(decoded,(c)=>c.charCodeAt(0));};const parseDescriptors=(descriptors=[])=>{return descriptors.map((descriptor)=>{return Object.assign({},descriptor,{id:fromBase64Url(descriptor.id)});});};const encodeChallenge=(options)=>{const challenge=toBase64Url(new TextEncoder().encode(options.challenge));return Object.assign({},options,{challenge});};const parseCreationOptions=(credentialOptions)=>{const options=encodeChallenge(credentialOptions);if(PublicKeyCredential.parseCreationOptionsFromJSON){return PublicKeyCredential.parseCreationOptionsFromJSON(options);}
+return Object.assign({},options,{challenge:fromBase64Url(options.challenge),user:Object.assign({},options.user,{id:fromBase64Url(options.user.id)}),excludeCredentials:parseDescriptors(options.excludeCredentials),});};const parseRequestOptions=(assertionOptions)=>{const options=encodeChallenge(assertionOptions);if(PublicKeyCredential.parseRequestOptionsFromJSON){return PublicKeyCredential.parseRequestOptionsFromJSON(options);}
+return Object.assign({},options,{challenge:fromBase64Url(options.challenge),allowCredentials:parseDescriptors(options.allowCredentials),});};const credentialToJSON=(credential)=>{if(typeof credential.toJSON==="function"){return credential.toJSON();}
+const response={};for(const name of["clientDataJSON","attestationObject","authenticatorData","signature","userHandle",]){if(credential.response[name]){response[name]=toBase64Url(credential.response[name]);}}
+return{id:credential.id,rawId:toBase64Url(credential.rawId),type:credential.type,response,clientExtensionResults:credential.getClientExtensionResults(),};};const postCredential=async(keyName,credential,token)=>{const formData=new FormData();formData.set("key_name",keyName);formData.set("credentials",JSON.stringify(credential));formData.set("csrf_token",token);const resp=await fetch(Kagi.verify_credential_info,{method:"POST",cache:"no-cache",body:formData,credentials:"same-origin",});return await resp.json();};const postAssertion=async(assertion,token,url=Kagi.verify_assertion)=>{const formData=new FormData();formData.set("credentials",JSON.stringify(assertion));formData.set("csrf_token",token);const rememberDevice=document.getElementById("webauthn-remember-device");if(rememberDevice!==null&&rememberDevice.checked){formData.set("remember_device","on");}
+const resp=await fetch(url + window.location.search,{method:"POST",cache:"no-cache",body:formData,credentials:"same-origin",});return await resp.json();};const GuardWebAuthn=()=>{if(!window.PublicKeyCredential){let webauthn_button=document.getElementById("webauthn-button");if(webauthn_button){webauthn_button.className +=" button--disabled";}
+let webauthn_error=document.getElementById("webauthn-browser-support");if(webauthn_error){webauthn_error.style.display="block";}
+let webauthn_label=document.getElementById("webauthn-provision-label");if(webauthn_label){webauthn_label.disabled=true;}}};const ProvisionWebAuthn=()=>{doWebAuthn("webauthn-provision-form",async(csrfToken)=>{const label=document.getElementById("id_key_name").value;const resp=await fetch(Kagi.begin_activate,{cache:"no-cache",credentials:"same-origin",});const credentialOptions=await resp.json();const transformedOptions=parseCreationOptions(credentialOptions);await navigator.credentials.create({publicKey:transformedOptions,}).then(async(credential)=>{const transformedCredential=credentialToJSON(credential);const status=await postCredential(label,transformedCredential,csrfToken);if(status.fail){populateWebAuthnErrorList(status.fail.errors);return;}
+window.location.replace(Kagi.keys_list);}).catch((error)=>{console.log(error);populateWebAuthnErrorList([error.message]);return;});});};const popEmbeddedAssertionOptions=()=>{const optionsElement=document.getElementById("webauthn-assertion-options");if(optionsElement===null){return null;}
+optionsElement.remove();return JSON.parse(optionsElement.textContent);};const AuthenticateWebAuthn=()=>{doWebAuthn("webauthn-auth-form",async(csrfToken)=>{let assertionOptions=popEmbeddedAssertionOptions();if(assertionOptions===null){const resp=await fetch(Kagi.begin_assertion + window.location.search,{cache:"no-cache",credentials:"same-origin",});assertionOptions=await resp.json();}
+if(assertionOptions.fail){window.location.replace("/account/");return;}
+const transformedOptions=parseRequestOptions(assertionOptions);await navigator.credentials.get({publicKey:transformedOptions,}).then(async(assertion)=>{const transformedAssertion=credentialToJSON(assertion);const status=await postAssertion(transformedAssertion,csrfToken);if(status.fail){populateWebAuthnErrorList(status.fail.errors);return;}
+window.location.replace(status.redirect_to);}).catch((error)=>{populateWebAuthnErrorList([error.message]);return;});});};const AuthenticatePasskey=()=>{doWebAuthn("webauthn-passkey-form",async(csrfToken)=>{const resp=await fetch(Kagi.begin_passkey_assertion,{cache:"no-cache",credentials:"same-origin",});const assertionOptions=await resp.json();const transformedOptions=parseRequestOptions(assertionOptions);await navigator.credentials.get({publicKey:transformedOptions,}).then(async(assertion)=>{const transformedAssertion=credentialToJSON(assertion);const status=await postAssertion(transformedAssertion,csrfToken,Kagi.verify_passkey_assertion);if(status.fail){populateWebAuthnErrorList([status.fail]);return;}
+window.location.replace(status.redirect_to);}).catch((error)=>{populateWebAuthnErrorList([error.message]);return;});});};document.addEventListener("DOMContentLoaded",(e)=>{const registerElement=document.querySelector("#webauthn-provision-form");if(registerElement){ProvisionWebAuthn();}
+const loginElement=document.querySelector("#webauthn-auth-form");if(loginElement){AuthenticateWebAuthn();}
+const passkeyElement=document.querySelector("#webauthn-passkey-form");if(passkeyElement){AuthenticatePasskey();}
+if(typeof PublicKeyCredential=="undefined"){var webAuthnFeature=document.getElementById("webauthn-feature");if(webAuthnFeature){webAuthnFeature.style.display="none";}
+var webAuthnUndefinedError=document.getElementById("webauthn-undefined-error");if(webAuthnUndefinedError){webAuthnUndefinedError.style.display="block";}}});
@@ -0,0 +1,46 @@
+"""
+Static files storage writing compressed copies of the hashed files.
+
+With ``PrecompressedManifestStaticFilesStorage`` as the ``staticfiles``
+storage, ``collectstatic`` writes a gzip copy, and a Brotli copy when the
+``brotli`` package is installed, next to each content-hashed text file, for
+web servers serving precompressed files such as nginx with ``gzip_static``.
+"""
+
+import gzip
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.base import ContentFile
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class PrecompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    compressed_extensions = (".css", ".js", ".json", ".map", ".svg", ".txt")
+
+    def compress(self, content):
+        yield ".gz", gzip.compress(content, compresslevel=9, mtime=0)
+        if brotli is not None:
+            yield ".br", brotli.compress(content)
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+
+        for name in set(self.hashed_files.values()):
+            if not name.endswith(self.compressed_extensions):
+                continue
+            with self.open(name) as f:
+                content = f.read()
+            for suffix, compressed in self.compress(content):
+                # Compression is useless for files too small to shrink.
+                if len(compressed) >= len(content):
+                    continue
+                if self.exists(name + suffix):
+                    self.delete(name + suffix)
+                self._save(name + suffix, ContentFile(compressed))
+                yield name, name + suffix, True
@@ -0,0 +1,33 @@
+from django.core.cache import caches
+
+import pytest
+
+from .. import events, ratelimit
+
+
+@pytest.fixture(autouse=True)
+def event_queue(monkeypatch):
+    """
+    Keeps auth events in the queue until the test flushes them, instead of
+    writing them from a background thread outside of the test transaction.
+    """
+    event_queue = events.EventQueue(
+        maxsize=100,
+        policy=events.DROP,
+        batch_size=10,
+        flush_interval=1,
+        background=False,
+    )
+    monkeypatch.setattr(events, "event_queue", event_queue)
+    return event_queue
+
+
+@pytest.fixture(autouse=True)
+def rate_limit_counters(monkeypatch):
+    """
+    Starts every test with no attempts counted.
+    """
+    caches["default"].clear()
+    local_counters = ratelimit.LocalCounters(width=64, depth=2)
+    monkeypatch.setattr(ratelimit, "local_counters", local_counters)
+    return local_counters
@@ -1,7 +1,16 @@
+from django.contrib.auth.models import Permission
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
+import pytest
+
 import kagi.views
 
+from .. import settings as kagi_settings
+from ..models import BackupCode, HOTPDevice, TOTPDevice, WebAuthnKey
+from ..trusted_devices import get_generation
+
 
 def test_get_admin_login_loads_the_form(client):
     response = client.get(reverse("admin:login"))
@@ -12,3 +21,159 @@ def test_get_admin_login_redirects_to_admin_index_if_already_logged_in(admin_cli
     response = admin_client.get(reverse("admin:login"))
     assert response.status_code == 302
     assert response.url == reverse("admin:index")
+
+
+@pytest.fixture
+def other_user(django_user_model):
+    return django_user_model.objects.create_user("other", password="password")
+
+
+def add_factors(user):
+    user.webauthn_keys.create(
+        key_name="Key",
+        credential_id=f"{user.username}-credential",
+        public_key=f"{user.username}-public-key",
+        sign_count=0,
+    )
+    user.totp_devices.create(key=b"12345678901234567890")
+    user.backup_codes.create_backup_code(code="123456")
+
+
+@pytest.mark.parametrize("model", [WebAuthnKey, TOTPDevice, BackupCode])
+def test_changelists_search_usernames(admin_client, admin_user, other_user, model):
+    add_factors(admin_user)
+    add_factors(other_user)
+    url = reverse(f"admin:kagi_{model._meta.model_name}_changelist")
+
+    response = admin_client.get(url, {"q": "oth"})
+
+    assert response.status_code == 200
+    assert [obj.user for obj in response.context["cl"].result_list] == [other_user]
+
+
+def test_changelists_search_the_username_field_of_the_user_model(
+    admin_client, admin_user, other_user, django_user_model, monkeypatch
+):
+    monkeypatch.setattr(django_user_model, "USERNAME_FIELD", "email")
+    other_user.email = "john.doe@kagi.com"
+    other_user.save()
+    add_factors(admin_user)
+    add_factors(other_user)
+
+    response = admin_client.get(
+        reverse("admin:kagi_webauthnkey_changelist"), {"q": "john"}
+    )
+
+    assert [key.user for key in response.context["cl"].result_list] == [other_user]
+
+
+def test_webauthn_keys_are_searched_by_name(admin_client, admin_user, other_user):
+    add_factors(admin_user)
+    add_factors(other_user)
+    admin_user.webauthn_keys.update(key_name="Yubikey")
+    url = reverse("admin:kagi_webauthnkey_changelist")
+
+    with CaptureQueriesContext(connection) as context:
+        response = admin_client.get(url, {"q": "Yubi"})
+
+    [key] = response.context["cl"].result_list
+    assert key.user == admin_user
+    assert not any("public_key" in query["sql"] for query in context.captured_queries)
+
+
+def test_totp_device_secrets_are_not_shown(admin_client, admin_user):
+    add_factors(admin_user)
+    device = admin_user.totp_devices.get()
+
+    response = admin_client.get(
+        reverse("admin:kagi_totpdevice_change", args=[device.pk])
+    )
+
+    assert "key" not in response.context["adminform"].form.fields
+    response = admin_client.get(reverse("admin:kagi_totpdevice_add"))
+    assert response.status_code == 403
+
+
+def test_backup_codes_are_not_shown(admin_client, admin_user):
+    add_factors(admin_user)
+    code = admin_user.backup_codes.get()
+
+    response = admin_client.get(reverse("admin:kagi_backupcode_change", args=[code.pk]))
+
+    assert "code" not in response.context["adminform"].form.fields
+    assert "123456" not in response.content.decode()
+    response = admin_client.get(reverse("admin:kagi_backupcode_add"))
+    assert response.status_code == 403
+
+
+@pytest.mark.parametrize("model", [TOTPDevice, HOTPDevice])
+def test_devices_cannot_be_moved_to_another_user(
+    admin_client, admin_user, other_user, model
+):
+    device = model.objects.create(user=admin_user, key=b"12345678901234567890")
+    url = reverse(f"admin:kagi_{model._meta.model_name}_change", args=[device.pk])
+
+    response = admin_client.get(url)
+    assert "user" not in response.context["adminform"].form.fields
+    admin_client.post(url, {"user": other_user.pk, "name": "", "counter": 0})
+
+    device.refresh_from_db()
+    assert device.user == admin_user
+
+
+def test_second_factors_of_selected_users_are_revoked(
+    admin_client, admin_user, other_user, django_user_model, monkeypatch
+):
+    monkeypatch.setattr(kagi_settings, "KAGI_ADMIN_REVOKE_BATCH_SIZE", 1)
+    third_user = django_user_model.objects.create_user("third", password="password")
+    for user in [admin_user, other_user, third_user]:
+        add_factors(user)
+    # Users with several selected factors are only counted once.
+    other_user.backup_codes.create_backup_code(code="654321")
+    generation = get_generation(other_user)
+
+    response = admin_client.post(
+        reverse("admin:kagi_backupcode_changelist"),
+        {
+            "action": "revoke_all_second_factors",
+            "_selected_action": list(
+                BackupCode.objects.exclude(user=third_user).values_list("pk", flat=True)
+            ),
+        },
+        follow=True,
+    )
+
+    assert [str(message) for message in response.context["messages"]] == [
+        "Revoked the second factors of 2 users."
+    ]
+    for model in [WebAuthnKey, TOTPDevice, BackupCode]:
+        assert list(model.objects.values_list("user", flat=True)) == [third_user.pk]
+    assert get_generation(other_user) != generation
+
+
+def test_second_factors_are_only_revoked_by_users_who_can_delete_them_all(
+    client, other_user, django_user_model
+):
+    staff = django_user_model.objects.create_user(
+        "staff", password="password", is_staff=True
+    )
+    staff.user_permissions.set(
+        Permission.objects.filter(codename__in=["view_backupcode", "delete_backupcode"])
+    )
+    add_factors(other_user)
+    client.force_login(staff)
+    url = reverse("admin:kagi_backupcode_changelist")
+
+    response = client.get(url)
+    actions = response.context["action_form"].fields["action"].choices
+    assert "revoke_all_second_factors" not in [name for name, label in actions]
+    client.post(
+        url,
+        {
+            "action": "revoke_all_second_factors",
+            "_selected_action": list(BackupCode.objects.values_list("pk", flat=True)),
+        },
+    )
+
+    for model in [WebAuthnKey, TOTPDevice, BackupCode]:
+        assert list(model.objects.values_list("user", flat=True)) == [other_user.pk]
@@ -0,0 +1,135 @@
+import json
+
+from django.urls import reverse
+
+import pytest
+from webauthn.helpers import bytes_to_base64url
+
+from ..utils.authenticator import ALGORITHMS, SoftwareAuthenticator
+
+
+def register(user, authenticator):
+    return user.webauthn_keys.create(
+        key_name=authenticator.algorithm.__class__.__name__,
+        sign_count=0,
+        credential_id=bytes_to_base64url(authenticator.credential_id),
+        public_key=bytes_to_base64url(authenticator.public_key),
+    )
+
+
+@pytest.mark.parametrize("algorithm", ALGORITHMS)
+def test_software_authenticator_assertions_are_verified(client, admin_user, algorithm):
+    authenticator = SoftwareAuthenticator(algorithm)
+    key = register(admin_user, authenticator)
+    client.post(reverse("kagi:login"), {"username": "admin", "password": "password"})
+
+    options = client.get(reverse("kagi:begin-assertion")).json()
+    response = client.post(
+        reverse("kagi:verify-assertion"),
+        {
+            "credentials": authenticator.get_assertion(
+                options, origin="http://testserver"
+            )
+        },
+    )
+
+    assert response.status_code == 200, response.json()
+    key.refresh_from_db()
+    assert key.sign_count == authenticator.sign_count == 1
+
+
+def test_assertions_must_carry_the_credential_id_of_the_signing_key(
+    client, admin_user, django_user_model
+):
+    authenticator = SoftwareAuthenticator()
+    register(admin_user, authenticator)
+    other_user = django_user_model.objects.create_user("other")
+    other_key = register(other_user, SoftwareAuthenticator())
+    client.post(reverse("kagi:login"), {"username": "admin", "password": "password"})
+    options = client.get(reverse("kagi:begin-assertion")).json()
+    assertion = json.loads(
+        authenticator.get_assertion(options, origin="http://testserver")
+    )
+    assertion["id"] = assertion["rawId"] = other_key.credential_id
+
+    response = client.post(
+        reverse("kagi:verify-assertion"), {"credentials": json.dumps(assertion)}
+    )
+
+    assert response.status_code == 400
+    assert "_auth_user_id" not in client.session
+    other_key.refresh_from_db()
+    assert other_key.sign_count == 0
+
+
+def test_software_authenticator_passkey_assertions_are_verified(client, admin_user):
+    authenticator = SoftwareAuthenticator(user_handle=str(admin_user.pk).encode())
+    register(admin_user, authenticator)
+
+    options = client.get(reverse("kagi:begin-passkey-assertion")).json()
+    assertion = authenticator.get_assertion(
+        options, origin="http://testserver", user_verified=True
+    )
+    response = client.post(
+        reverse("kagi:verify-passkey-assertion"), {"credentials": assertion}
+    )
+
+    assert response.status_code == 200, response.json()
+    assert json.loads(assertion)["response"]["userHandle"] == bytes_to_base64url(
+        str(admin_user.pk).encode()
+    )
+
+
+def test_software_authenticator_refuses_credentials_that_are_not_allowed():
+    authenticator = SoftwareAuthenticator()
+    options = {
+        "challenge": "abc",
+        "rpId": "localhost",
+        "allowCredentials": [{"id": "other", "type": "public-key"}],
+    }
+
+    with pytest.raises(ValueError):
+        authenticator.get_assertion(options, origin="http://localhost")
+
+
+@pytest.mark.parametrize("algorithm", ALGORITHMS)
+def test_software_authenticator_credentials_are_registered(
+    client, admin_user, algorithm
+):
+    authenticator = SoftwareAuthenticator(algorithm)
+    client.force_login(admin_user)
+
+    options = client.get(reverse("kagi:begin-activate")).json()
+    response = client.post(
+        reverse("kagi:verify-credential-info"),
+        {
+            "credentials": authenticator.make_credential(
+                options, origin="http://testserver"
+            ),
+            "key_name": "Software",
+        },
+    )
+
+    assert response.status_code == 200, response.json()
+    key = admin_user.webauthn_keys.get()
+    assert key.credential_id == bytes_to_base64url(authenticator.credential_id)
+    assert key.public_key == bytes_to_base64url(authenticator.public_key)
+    assert authenticator.user_handle == str(admin_user.pk).encode()
+
+
+def test_software_authenticator_refuses_excluded_credentials():
+    authenticator = SoftwareAuthenticator()
+    options = {
+        "excludeCredentials": [{"id": bytes_to_base64url(authenticator.credential_id)}],
+    }
+
+    with pytest.raises(ValueError):
+        authenticator.make_credential(options, origin="http://localhost")
+
+
+def test_software_authenticator_refuses_unsupported_algorithms():
+    authenticator = SoftwareAuthenticator("EdDSA")
+    options = {"pubKeyCredParams": [{"alg": -7, "type": "public-key"}]}
+
+    with pytest.raises(ValueError):
+        authenticator.make_credential(options, origin="http://localhost")
@@ -0,0 +1,160 @@
+import base64
+import io
+import os
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.urls import reverse
+from django.utils import timezone
+
+from cryptography.exceptions import InvalidTag
+import pretend
+import pytest
+
+from .. import encryption, settings as kagi_settings
+from ..encryption import SecretCache
+from ..models import HOTPDevice, TOTPDevice
+from ..oath import totp
+from .test_totp import add_new_totp_device
+
+SECRET = b"12345678901234567890"
+
+
+def make_key():
+    return base64.urlsafe_b64encode(os.urandom(32)).decode()
+
+
+@pytest.fixture
+def encrypted(monkeypatch):
+    monkeypatch.setattr(
+        kagi_settings, "KAGI_TOTP_ENCRYPTION_KEYS", {"1": make_key(), "2": make_key()}
+    )
+    monkeypatch.setattr(kagi_settings, "KAGI_TOTP_ENCRYPTION_KEY_ID", "1")
+    encryption.secret_cache.clear()
+
+
+def test_secrets_are_encrypted_for_their_user(encrypted):
+    ciphertext = encryption.encrypt_secret(SECRET, 1, "1")
+
+    assert SECRET not in ciphertext
+    assert encryption.decrypt_secret(ciphertext, 1, "1") == SECRET
+    with pytest.raises(InvalidTag):
+        encryption.decrypt_secret(ciphertext, 2, "1")
+    with pytest.raises(InvalidTag):
+        encryption.decrypt_secret(ciphertext, 1, "2")
+
+
+def test_data_keys_are_rewrapped(encrypted):
+    ciphertext = encryption.encrypt_secret(SECRET, 1, "1")
+
+    rewrapped = encryption.rewrap_secret(ciphertext, 1, "1", "2")
+
+    assert rewrapped[encryption.WRAPPED_KEY_SIZE :] == (
+        ciphertext[encryption.WRAPPED_KEY_SIZE :]
+    )
+    assert encryption.decrypt_secret(rewrapped, 1, "2") == SECRET
+
+
+def test_master_keys_must_be_valid(encrypted, monkeypatch):
+    with pytest.raises(ImproperlyConfigured):
+        encryption.get_master_key("3")
+
+    monkeypatch.setitem(kagi_settings.KAGI_TOTP_ENCRYPTION_KEYS, "3", "c2hvcnQ=")
+    with pytest.raises(ImproperlyConfigured):
+        encryption.get_master_key("3")
+
+    monkeypatch.setitem(kagi_settings.KAGI_TOTP_ENCRYPTION_KEYS, "3", "not base64")
+    with pytest.raises(ImproperlyConfigured):
+        encryption.get_master_key("3")
+
+
+def test_secret_cache_is_bounded(monkeypatch):
+    now = [0]
+    monkeypatch.setattr(encryption.time, "monotonic", lambda: now[0])
+    cache = SecretCache(size=2, ttl=10)
+
+    assert cache.get_or_set("a", lambda: 1) == 1
+    assert cache.get_or_set("b", lambda: 2) == 2
+    assert cache.get_or_set("a", lambda: 3) == 1
+    assert cache.get_or_set("c", lambda: 4) == 4
+    assert cache.get_or_set("b", lambda: 5) == 5
+    now[0] = 10
+    assert cache.get_or_set("c", lambda: 6) == 6
+
+
+def test_plain_secrets_are_stored_without_encryption_keys(admin_user):
+    device = TOTPDevice(user=admin_user)
+
+    device.set_secret(SECRET)
+
+    assert (device.key, device.key_id) == (SECRET, "")
+    assert device.validate_token(totp(SECRET, timezone.now()))
+
+
+def test_encrypted_secrets_are_decrypted_once(encrypted, admin_user, monkeypatch):
+    decrypt_secret = pretend.call_recorder(encryption.decrypt_secret)
+    monkeypatch.setattr(encryption, "decrypt_secret", decrypt_secret)
+    device = TOTPDevice(user=admin_user)
+    device.set_secret(SECRET)
+    device.save()
+
+    assert device.key_id == "1"
+    for _ in range(2):
+        device = TOTPDevice.objects.get()
+        assert not device.validate_token("000000")
+    assert len(decrypt_secret.calls) == 1
+
+
+def test_new_devices_are_encrypted(encrypted, admin_client):
+    response = add_new_totp_device(admin_client)
+
+    assert response.status_code == 302
+    device = TOTPDevice.objects.get()
+    assert device.key_id == "1"
+    assert len(device.key) > len(SECRET)
+
+
+def test_totp_keys_are_rotated(encrypted, admin_user, django_user_model, monkeypatch):
+    other_user = django_user_model.objects.create_user("other", password="password")
+    admin_user.totp_devices.create(key=SECRET)
+    device = TOTPDevice(user=other_user)
+    device.set_secret(SECRET)
+    device.save()
+    hotp_device = HOTPDevice(user=other_user)
+    hotp_device.set_secret(SECRET)
+    hotp_device.save()
+    monkeypatch.setattr(kagi_settings, "KAGI_TOTP_ENCRYPTION_KEY_ID", "2")
+
+    stdout = io.StringIO()
+    call_command("rotatetotpkeys", "--chunk-size", "1", stdout=stdout)
+
+    assert stdout.getvalue() == (
+        "Re-encrypted 2 TOTP secrets.\nRe-encrypted 1 HOTP secrets.\n"
+    )
+    for device in [*TOTPDevice.objects.all(), *HOTPDevice.objects.all()]:
+        assert device.key_id == "2"
+        assert device.get_secret() == SECRET
+    stdout = io.StringIO()
+    call_command("rotatetotpkeys", stdout=stdout)
+    assert stdout.getvalue() == (
+        "Re-encrypted 0 TOTP secrets.\nRe-encrypted 0 HOTP secrets.\n"
+    )
+
+
+def test_rotation_requires_a_key(admin_user):
+    with pytest.raises(CommandError):
+        call_command("rotatetotpkeys")
+
+
+def test_login_with_an_encrypted_secret(encrypted, client, admin_user):
+    device = TOTPDevice(user=admin_user)
+    device.set_secret(SECRET)
+    device.save()
+    client.post(reverse("kagi:login"), {"username": "admin", "password": "password"})
+
+    response = client.post(
+        reverse("kagi:verify-second-factor"),
+        {"type": "totp", "token": totp(SECRET, timezone.now())},
+    )
+
+    assert response.status_code == 302
@@ -0,0 +1,309 @@
+import datetime
+from io import StringIO
+import threading
+
+from django.core.management import call_command
+from django.urls import reverse
+from django.utils import timezone
+
+import pytest
+
+from .. import events
+from ..models import AuthEvent
+from ..oath import totp
+from ..utils.authenticator import SoftwareAuthenticator
+from .test_authenticator import register
+from .test_totp import add_new_totp_device
+
+TOTP_KEY = b"12345678901234567890"
+
+
+def recorded_events(event_queue):
+    event_queue.flush()
+    return list(
+        AuthEvent.objects.order_by("pk").values_list(
+            "user__username", "action", "factor_type", "succeeded", "ip_address"
+        )
+    )
+
+
+def login(client):
+    response = client.post(
+        reverse("kagi:login"), {"username": "admin", "password": "password"}
+    )
+    assert response.url == reverse("kagi:verify-second-factor")
+
+
+def test_totp_verifications_are_recorded(client, admin_user, event_queue):
+    device = admin_user.totp_devices.create(key=TOTP_KEY)
+    login(client)
+
+    client.post(
+        reverse("kagi:verify-second-factor"), {"type": "totp", "token": "abcdef"}
+    )
+    client.post(
+        reverse("kagi:verify-second-factor"),
+        {"type": "totp", "token": totp(TOTP_KEY, timezone.now())},
+    )
+
+    assert recorded_events(event_queue) == [
+        ("admin", "verify", "totp", False, "127.0.0.1"),
+        ("admin", "verify", "totp", True, "127.0.0.1"),
+    ]
+    assert AuthEvent.objects.last().factor_id == device.pk
+
+
+def test_webauthn_events_are_recorded(client, admin_user, event_queue):
+    authenticator = SoftwareAuthenticator()
+    client.force_login(admin_user)
+    options = client.get(reverse("kagi:begin-activate")).json()
+    client.post(
+        reverse("kagi:verify-credential-info"),
+        {
+            "credentials": authenticator.make_credential(
+                options, origin="http://testserver"
+            ),
+            "key_name": "Software",
+        },
+    )
+    client.logout()
+    login(client)
+
+    options = client.get(reverse("kagi:begin-assertion")).json()
+    assertion = authenticator.get_assertion(options, origin="http://testserver")
+    client.post(reverse("kagi:verify-assertion"), {"credentials": assertion})
+
+    assert recorded_events(event_queue) == [
+        ("admin", "register", "webauthn", True, "127.0.0.1"),
+        ("admin", "verify", "webauthn", True, "127.0.0.1"),
+    ]
+    key = admin_user.webauthn_keys.get()
+    assert AuthEvent.objects.filter(factor_id=key.pk).count() == 2
+
+
+def test_failed_webauthn_assertions_are_recorded(client, admin_user, event_queue):
+    authenticator = SoftwareAuthenticator()
+    register(admin_user, authenticator)
+    login(client)
+
+    options = client.get(reverse("kagi:begin-assertion")).json()
+    assertion = authenticator.get_assertion(options, origin="http://evil.example")
+    client.post(reverse("kagi:verify-assertion"), {"credentials": assertion})
+
+    assert recorded_events(event_queue) == [
+        ("admin", "verify", "webauthn", False, "127.0.0.1"),
+    ]
+
+
+def test_passkey_events_are_recorded(client, admin_user, event_queue):
+    authenticator = SoftwareAuthenticator(user_handle=str(admin_user.pk).encode())
+    register(admin_user, authenticator)
+    stranger = SoftwareAuthenticator()
+
+    for user_verified, origin in [
+        (True, "http://testserver"),
+        (False, "http://testserver"),
+    ]:
+        options = client.get(reverse("kagi:begin-passkey-assertion")).json()
+        assertion = authenticator.get_assertion(
+            options, origin=origin, user_verified=user_verified
+        )
+        client.post(
+            reverse("kagi:verify-passkey-assertion"), {"credentials": assertion}
+        )
+    options = client.get(reverse("kagi:begin-passkey-assertion")).json()
+    client.post(
+        reverse("kagi:verify-passkey-assertion"),
+        {"credentials": stranger.get_assertion(options, origin="http://testserver")},
+    )
+
+    assert recorded_events(event_queue) == [
+        ("admin", "verify", "passkey", True, "127.0.0.1"),
+        ("admin", "verify", "passkey", False, "127.0.0.1"),
+        (None, "verify", "passkey", False, "127.0.0.1"),
+    ]
+
+
+def test_totp_registrations_are_recorded(admin_client, event_queue):
+    add_new_totp_device(admin_client, now=timezone.now() - datetime.timedelta(hours=1))
+    add_new_totp_device(admin_client)
+
+    assert recorded_events(event_queue) == [
+        ("admin", "register", "totp", False, "127.0.0.1"),
+        ("admin", "register", "totp", True, "127.0.0.1"),
+    ]
+
+
+def test_token_verifications_are_recorded(client, admin_user, event_queue):
+    admin_user.totp_devices.create(key=TOTP_KEY)
+    admin_user.backup_codes.create_backup_code(code="123456")
+    login(client)
+
+    client.post(reverse("kagi:verify-token"), {"type": "backup", "token": "123456"})
+
+    assert recorded_events(event_queue) == [
+        ("admin", "verify", "backup", True, "127.0.0.1"),
+    ]
+
+
+@pytest.mark.parametrize("payload", [{"token": "123456"}, {"type": "x" * 17}])
+def test_unexpected_factor_types_are_recorded_as_unknown(
+    client, admin_user, event_queue, payload
+):
+    admin_user.totp_devices.create(key=TOTP_KEY)
+    login(client)
+
+    client.post(reverse("kagi:verify-token"), payload)
+
+    assert recorded_events(event_queue) == [
+        ("admin", "verify", "unknown", False, "127.0.0.1"),
+    ]
+
+
+def make_queue(**kwargs):
+    options = dict(
+        maxsize=2, policy=events.DROP, batch_size=2, flush_interval=1, background=False
+    )
+    return events.EventQueue(**dict(options, **kwargs))
+
+
+def make_event(user=None):
+    return AuthEvent(user=user, factor_type="totp", succeeded=True)
+
+
+def test_event_queue_policy_must_be_known():
+    with pytest.raises(ValueError):
+        make_queue(policy="ignore")
+
+
+@pytest.mark.django_db
+def test_event_queue_drops_events_when_full():
+    event_queue = make_queue()
+
+    for _ in range(3):
+        event_queue.put(make_event())
+    event_queue.flush()
+
+    assert event_queue.dropped == 1
+    assert AuthEvent.objects.count() == 2
+
+
+@pytest.mark.django_db
+def test_event_queue_can_block_until_there_is_room():
+    event_queue = make_queue(maxsize=1, policy=events.BLOCK)
+    event_queue.put(make_event())
+    producer = threading.Thread(target=event_queue.put, args=(make_event(),))
+    producer.start()
+
+    assert event_queue.get_batch(timeout=1)
+    producer.join(timeout=1)
+    event_queue.flush()
+
+    assert event_queue.dropped == 0
+    assert AuthEvent.objects.count() == 1
+
+
+@pytest.mark.django_db
+def test_event_queue_gives_up_blocking_after_its_timeout():
+    event_queue = make_queue(maxsize=1, policy=events.BLOCK, timeout=0.01)
+
+    event_queue.put(make_event())
+    event_queue.put(make_event())
+    event_queue.flush()
+
+    assert event_queue.dropped == 1
+    assert AuthEvent.objects.count() == 1
+
+
+@pytest.mark.django_db
+def test_event_queue_logs_write_failures(monkeypatch, caplog):
+    def bulk_create(events):
+        raise RuntimeError("database is down")
+
+    monkeypatch.setattr(AuthEvent.objects, "bulk_create", bulk_create)
+    event_queue = make_queue()
+    event_queue.put(make_event())
+
+    event_queue.flush()
+
+    assert "Could not write 1 auth events." in caplog.text
+    assert "Dropped an auth event that could not be written." in caplog.text
+    assert event_queue.dropped == 1
+
+
+@pytest.mark.django_db
+def test_event_queue_retries_failed_batches_one_by_one(monkeypatch):
+    bulk_create = AuthEvent.objects.bulk_create
+
+    def failing_bulk_create(events):
+        if any(event.factor_type == "invalid" for event in events):
+            raise RuntimeError("value too long")
+        return bulk_create(events)
+
+    monkeypatch.setattr(AuthEvent.objects, "bulk_create", failing_bulk_create)
+    event_queue = make_queue()
+    event_queue.put(make_event())
+    event_queue.put(AuthEvent(factor_type="invalid", succeeded=True))
+
+    event_queue.flush()
+
+    assert event_queue.dropped == 1
+    assert list(AuthEvent.objects.values_list("factor_type", flat=True)) == ["totp"]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_event_queue_writes_events_from_a_background_thread():
+    event_queue = make_queue(maxsize=100, batch_size=10, background=True)
+
+    for _ in range(25):
+        event_queue.put(make_event())
+    event_queue.close()
+
+    assert not event_queue.thread.is_alive()
+    assert AuthEvent.objects.count() == 25
+
+
+@pytest.mark.django_db
+def test_event_queue_close_flushes_without_a_background_thread():
+    event_queue = make_queue()
+    event_queue.put(make_event())
+
+    event_queue.close()
+
+    assert AuthEvent.objects.count() == 1
+
+
+def test_auth_event_str(admin_user):
+    assert (
+        str(
+            AuthEvent(
+                user=admin_user, factor_type="totp", action="verify", succeeded=False
+            )
+        )
+        == "admin - totp verify failed"
+    )
+
+
+@pytest.mark.django_db
+def test_purgeauthevents_command_deletes_expired_events_in_chunks(
+    django_assert_max_num_queries,
+):
+    now = timezone.now()
+    AuthEvent.objects.bulk_create(
+        AuthEvent(
+            factor_type="totp",
+            succeeded=True,
+            created_at=now - datetime.timedelta(days=days),
+        )
+        for days in [1, 100, 100, 200, 300, 1]
+    )
+    stdout = StringIO()
+
+    # Two chunks of two events, and one query to find out there is nothing left.
+    with django_assert_max_num_queries(5):
+        call_command(
+            "purgeauthevents", "--days", "90", "--chunk-size", "2", stdout=stdout
+        )
+
+    assert stdout.getvalue() == "Deleted 4 auth events.\n"
+    assert AuthEvent.objects.count() == 2
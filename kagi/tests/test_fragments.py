@@ -0,0 +1,117 @@
+from django.core.cache import caches
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+import pretend
+import pytest
+
+from .. import fragments, settings as kagi_settings
+from ..views.mixin import FactorListMixin
+
+
+@pytest.fixture
+def fragment_cache(monkeypatch):
+    monkeypatch.setattr(kagi_settings, "KAGI_FRAGMENT_CACHE", "default")
+
+
+def add_keys(user, count, start=0):
+    for i in range(start, start + count):
+        user.webauthn_keys.create(
+            key_name=f"Key {i}",
+            credential_id=f"credential-{i}",
+            public_key=f"public-key-{i}",
+            sign_count=0,
+        )
+
+
+def key_names(response):
+    return [
+        line.strip()[len("<td>") : -len("</td>")]
+        for line in str(response.context["rows"]).splitlines()
+        if line.strip().startswith("<td>Key ")
+    ]
+
+
+def test_keys_are_paginated_by_primary_key(admin_client, admin_user, monkeypatch):
+    monkeypatch.setattr(kagi_settings, "KAGI_FACTOR_PAGE_SIZE", 2)
+    add_keys(admin_user, 5)
+    url = reverse("kagi:webauthn-keys")
+
+    response = admin_client.get(url, {"after": "invalid"})
+    assert key_names(response) == ["Key 0", "Key 1"]
+    assert response.context["first_page_url"] is None
+    response = admin_client.get(response.context["next_page_url"])
+    assert key_names(response) == ["Key 2", "Key 3"]
+    response = admin_client.get(response.context["next_page_url"])
+    assert key_names(response) == ["Key 4"]
+    assert response.context["next_page_url"] is None
+    assert response.context["first_page_url"] == url
+
+
+def test_lists_only_load_displayed_columns(admin_client, admin_user):
+    add_keys(admin_user, 1)
+    admin_user.totp_devices.create(key=b"12345678901234567890")
+
+    with CaptureQueriesContext(connection) as context:
+        admin_client.get(reverse("kagi:webauthn-keys"))
+        admin_client.get(reverse("kagi:totp-devices"))
+
+    sql = " ".join(query["sql"] for query in context.captured_queries)
+    assert "public_key" not in sql
+    assert '"kagi_totpdevice"."key"' not in sql
+
+
+def test_rendered_lists_are_cached_until_factors_change(
+    admin_client, admin_user, fragment_cache
+):
+    add_keys(admin_user, 1)
+    url = reverse("kagi:webauthn-keys")
+    admin_client.get(url)
+    # Updates of the factors in use are not seen until the cache expires.
+    admin_user.webauthn_keys.update(key_name="Key renamed")
+
+    with CaptureQueriesContext(connection) as context:
+        response = admin_client.get(url)
+    assert key_names(response) == ["Key 0"]
+    assert not any("kagi_webauthnkey" in q["sql"] for q in context.captured_queries)
+
+    add_keys(admin_user, 1, start=1)
+    assert key_names(admin_client.get(url)) == ["Key renamed", "Key 1"]
+
+    key = admin_user.webauthn_keys.get(key_name="Key 1")
+    admin_client.post(url, {"delete": "X", "key_id": key.pk})
+    assert key_names(admin_client.get(url)) == ["Key renamed"]
+
+
+def test_totp_device_lists_are_invalidated(admin_client, admin_user, fragment_cache):
+    url = reverse("kagi:totp-devices")
+    assert "<button" not in admin_client.get(url).context["rows"]
+
+    admin_user.totp_devices.create(key=b"12345678901234567890")
+
+    assert "<button" in admin_client.get(url).context["rows"]
+
+
+def test_backup_codes_are_not_cached(admin_client, admin_user, fragment_cache):
+    url = reverse("kagi:backup-codes")
+    admin_client.get(url)
+    admin_user.backup_codes.create_backup_code(code="123456")
+
+    assert "123456" in admin_client.get(url).context["rows"]
+    assert not any(
+        key.startswith(":1:kagi:fragment") for key in caches["default"]._cache
+    )
+
+
+def test_unknown_factor_versions_are_not_invalidated(fragment_cache):
+    instance = pretend.stub(user_id=42)
+
+    fragments.invalidate_factor_version(None, instance)
+
+    assert caches["default"].get("kagi:factor-version:42") is None
+
+
+def test_factor_lists_must_define_their_factors():
+    with pytest.raises(NotImplementedError):
+        FactorListMixin().get_factors()
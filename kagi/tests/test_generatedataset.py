@@ -0,0 +1,135 @@
+import io
+import json
+from multiprocessing.pool import ThreadPool
+import stat
+
+from django.core.management import CommandError, call_command
+from django.urls import reverse
+from django.utils import timezone
+
+from cryptography.hazmat.primitives import serialization
+import pytest
+from webauthn.helpers import base64url_to_bytes
+
+from ..management.commands import generatedataset
+from ..models import BackupCode, TOTPDevice, WebAuthnKey
+from ..oath import totp
+from ..utils.authenticator import SoftwareAuthenticator
+
+
+def generate(*args):
+    stdout = io.StringIO()
+    call_command("generatedataset", *args, stdout=stdout)
+    return stdout.getvalue()
+
+
+def test_users_are_generated_with_their_factors(django_user_model, tmp_path):
+    path = tmp_path / "keys.jsonl"
+    # Existing files are made private as well.
+    path.touch()
+    path.chmod(0o644)
+
+    output = generate(
+        "40", "--workers", "1", "--chunk-size", "15", "--rs256-ratio", "0.5",
+        "--private-keys", str(path),
+    )  # fmt: skip
+
+    users = django_user_model.objects.filter(username__startswith="kagi-dataset-")
+    assert users.count() == 40
+    assert output.startswith(
+        f"Created 40 users, {WebAuthnKey.objects.count()} WebAuthn keys, "
+        f"{TOTPDevice.objects.count()} TOTP devices and "
+        f"{BackupCode.objects.count()} backup codes ("
+    )
+    assert users[0].check_password("password")
+    device = TOTPDevice.objects.first()
+    assert device.validate_token(totp(device.get_secret(), timezone.now()))
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    assert len(records) == WebAuthnKey.objects.count()
+    assert {record["algorithm"] for record in records} == {"ES256", "RS256"}
+    assert stat.S_IMODE(path.stat().st_mode) == 0o600
+
+
+def test_generated_keys_can_be_verified(db, client, tmp_path):
+    path = tmp_path / "keys.jsonl"
+    generate("20", "--workers", "1", "--private-keys", str(path))
+    record = json.loads(path.read_text().splitlines()[0])
+    authenticator = SoftwareAuthenticator(
+        record["algorithm"],
+        credential_id=base64url_to_bytes(record["credential_id"]),
+        private_key=serialization.load_pem_private_key(
+            record["private_key"].encode(), password=None
+        ),
+    )
+    client.post(
+        reverse("kagi:login"),
+        {"username": record["username"], "password": "password"},
+    )
+    options = client.get(reverse("kagi:begin-assertion")).json()
+
+    response = client.post(
+        reverse("kagi:verify-assertion"),
+        {
+            "credentials": authenticator.get_assertion(
+                options, origin="http://testserver"
+            )
+        },
+    )
+
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize("vendor", ["sqlite", "postgresql"])
+def test_chunks_are_generated_by_worker_processes(
+    transactional_db, monkeypatch, vendor
+):
+    # Workers only write to databases taking concurrent writes.
+    monkeypatch.setattr(generatedataset.connection, "vendor", vendor)
+    pools = []
+
+    def pool_class(workers, initializer):
+        # A single thread, since SQLite's in-memory test database does not
+        # take concurrent writes.
+        pools.append(workers)
+        return ThreadPool(1, initializer)
+
+    monkeypatch.setattr(generatedataset.Command, "pool_class", staticmethod(pool_class))
+
+    output = generate("30", "--workers", "3", "--chunk-size", "10")
+
+    assert pools == [3]
+    assert output.startswith("Created 30 users, ")
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ["0"],
+        ["10", "--workers", "0"],
+        ["10", "--chunk-size", "0"],
+        ["10", "--batch-size", "-1"],
+    ],
+)
+def test_counts_must_be_positive(db, args):
+    with pytest.raises(CommandError):
+        generate(*args)
+
+
+def test_existing_users_are_not_overwritten(django_user_model):
+    django_user_model.objects.create_user("kagi-dataset-0")
+
+    with pytest.raises(CommandError):
+        generate("10", "--workers", "1")
+
+
+def test_secrets_are_seeded():
+    task = (0, 20, {"seed": 1, "username_prefix": "user-", "rs256_ratio": 0})
+
+    def secrets(plans):
+        return [(totp_secret, codes) for _, totp_secret, codes in plans]
+
+    _, plans = generatedataset.plan_chunk(task)
+    _, other_plans = generatedataset.plan_chunk(task)
+
+    assert secrets(plans) == secrets(other_plans)
+    assert any(totp_secret for _, totp_secret, _ in plans)
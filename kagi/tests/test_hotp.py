@@ -0,0 +1,135 @@
+from base64 import b32encode
+
+from django.urls import reverse
+
+import pytest
+
+from .. import settings as kagi_settings
+from ..admin import revoke_second_factors
+from ..models import AuthEvent, HOTPDevice
+from ..oath import hotp
+
+KEY = b"12345678901234567890"
+
+
+def add_new_hotp_device(client, token, secret=KEY.hex(), name="Field token"):
+    return client.post(
+        reverse("kagi:add-hotp"), {"name": name, "secret": secret, "token": token}
+    )
+
+
+def login(client):
+    response = client.post(
+        reverse("kagi:login"), {"username": "admin", "password": "password"}
+    )
+    assert response.url == reverse("kagi:verify-second-factor")
+
+
+def verify(client, token):
+    return client.post(
+        reverse("kagi:verify-second-factor"), {"type": "hotp", "token": token}
+    )
+
+
+def test_add_an_hotp_device(admin_client, admin_user, event_queue):
+    assert admin_client.get(reverse("kagi:add-hotp")).status_code == 200
+
+    response = add_new_hotp_device(admin_client, hotp(KEY, 0))
+
+    assert response.url == reverse("kagi:hotp-devices")
+    device = admin_user.hotp_devices.get()
+    assert (device.name, device.get_secret(), device.counter) == ("Field token", KEY, 1)
+    event_queue.flush()
+    assert admin_user.auth_events.get().action == AuthEvent.REGISTER
+
+
+def test_add_an_hotp_device_with_a_base32_secret(admin_client, admin_user):
+    secret = b32encode(KEY).decode().lower().rstrip("=")
+
+    # Tokens pressed before enrollment are found in the look-ahead window.
+    add_new_hotp_device(admin_client, hotp(KEY, 7), secret=secret)
+
+    assert admin_user.hotp_devices.get().counter == 8
+
+
+@pytest.mark.parametrize(
+    "secret, token, field",
+    [
+        (KEY.hex(), "000000", "token"),
+        ("not a secret!", hotp(KEY, 0), "secret"),
+        ("0011", hotp(KEY, 0), "secret"),
+    ],
+)
+def test_invalid_hotp_devices_are_not_added(
+    admin_client, admin_user, secret, token, field
+):
+    response = add_new_hotp_device(admin_client, token, secret=secret)
+
+    assert response.status_code == 200
+    assert field in response.context_data["form"].errors
+    assert not admin_user.hotp_devices.exists()
+
+
+def test_list_and_delete_hotp_devices(admin_client, admin_user):
+    device = admin_user.hotp_devices.create(key=KEY, name="Field token")
+    url = reverse("kagi:hotp-devices")
+
+    response = admin_client.get(url)
+    assert "Field token" in response.context["rows"]
+
+    response = admin_client.post(url, {"delete": "X", "device_id": device.pk})
+    assert response.url == url
+    assert not admin_user.hotp_devices.exists()
+
+
+def test_login_with_an_hotp_token(client, admin_user):
+    admin_user.hotp_devices.create(key=KEY, counter=5)
+    login(client)
+
+    response = client.get(reverse("kagi:verify-second-factor"))
+    assert "hotp" in response.context_data["forms"]
+    response = verify(client, hotp(KEY, 4))
+    assert response.status_code == 200
+    response = verify(client, hotp(KEY, 9))
+    assert response.status_code == 302
+    assert admin_user.hotp_devices.get().counter == 10
+
+
+def test_hotp_tokens_are_used_once(client, admin_user):
+    admin_user.hotp_devices.create(key=KEY)
+    login(client)
+    token = hotp(KEY, 0)
+    verify(client, token)
+    client.logout()
+    login(client)
+
+    response = verify(client, token)
+
+    assert response.status_code == 200
+    assert response.context["forms"]["hotp"].errors
+
+
+def test_tokens_beyond_the_look_ahead_window_are_rejected(admin_user, monkeypatch):
+    monkeypatch.setattr(kagi_settings, "KAGI_HOTP_LOOK_AHEAD", 3)
+    device = HOTPDevice(user=admin_user, key=KEY)
+
+    assert not device.validate_token(hotp(KEY, 3))
+    assert device.validate_token(hotp(KEY, 2))
+    assert device.counter == 3
+
+
+def test_two_factor_settings_show_hotp_devices(admin_client, admin_user):
+    url = reverse("kagi:two-factor-settings")
+    assert not admin_client.get(url).context_data["hotp_enabled"]
+
+    admin_user.hotp_devices.create(key=KEY)
+
+    assert admin_client.get(url).context_data["hotp_enabled"]
+
+
+def test_revoked_second_factors_include_hotp_devices(admin_user):
+    admin_user.hotp_devices.create(key=KEY)
+
+    revoke_second_factors([admin_user.pk])
+
+    assert not admin_user.hotp_devices.exists()
@@ -0,0 +1,69 @@
+import json
+import os
+import re
+import subprocess
+import sys
+
+import pytest
+
+import kagi
+
+# Packages that must only be imported when a view needs them.
+LAZY_DEPENDENCIES = ("qrcode", "webauthn", "cryptography", "pydantic")
+
+IMPORT_TIME_RE = re.compile(r"^import time:\s+\d+ \|\s+(\d+) \| +(\S+)$", re.M)
+
+SCRIPT = """
+import json, sys
+import django
+django.setup()
+import kagi.urls
+print(json.dumps(sorted(sys.modules)))
+"""
+
+
+def import_kagi_urls():
+    root_dir = os.path.dirname(os.path.dirname(os.path.abspath(kagi.__file__)))
+    env = dict(
+        os.environ,
+        DJANGO_SETTINGS_MODULE="testproj.settings",
+        PYTHONPATH=os.pathsep.join([root_dir, os.path.join(root_dir, "testproj")]),
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", SCRIPT],
+        env=env,
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+
+    import_times = {
+        name: int(cumulative)
+        for cumulative, name in IMPORT_TIME_RE.findall(result.stderr)
+    }
+    return import_times, json.loads(result.stdout)
+
+
+def test_kagi_urls_does_not_import_view_dependencies():
+    _, modules = import_kagi_urls()
+
+    loaded = [
+        module
+        for module in modules
+        if module.split(".")[0] in LAZY_DEPENDENCIES or module == "kagi.views.api"
+    ]
+    assert loaded == []
+
+
+# Wall-clock budgets fail on loaded machines, so the cumulative import time of
+# ``kagi.urls`` is only checked against KAGI_IMPORT_TIME_BUDGET, in microseconds,
+# when it is set. It used to be around 280ms when the views eagerly imported
+# qrcode and webauthn, and is now under 50ms.
+@pytest.mark.skipif(
+    "KAGI_IMPORT_TIME_BUDGET" not in os.environ,
+    reason="KAGI_IMPORT_TIME_BUDGET is not set",
+)
+def test_kagi_urls_import_time_stays_within_budget():  # pragma: no cover
+    # Keep the best of a few runs, since a single measurement can be noisy.
+    best = min(import_kagi_urls()[0]["kagi.urls"] for _ in range(3))
+    assert best <= int(os.environ["KAGI_IMPORT_TIME_BUDGET"])
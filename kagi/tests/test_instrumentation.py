@@ -0,0 +1,138 @@
+from django.http import Http404
+from django.urls import reverse
+
+import pytest
+
+from .. import instrumentation, settings
+from ..instrumentation import PrometheusSink, stage
+from ..models import TOTPDevice
+from ..utils.authenticator import SoftwareAuthenticator
+from ..views import metrics
+from .test_authenticator import register
+
+
+@pytest.fixture
+def sink(monkeypatch):
+    sink = PrometheusSink()
+    monkeypatch.setattr(instrumentation, "_sink", sink)
+    return sink
+
+
+def test_stage_does_nothing_without_a_sink(monkeypatch):
+    monkeypatch.setattr(instrumentation, "_sink", instrumentation._UNSET)
+    monkeypatch.setattr(settings, "KAGI_INSTRUMENTATION_SINK", None)
+
+    with stage("nothing") as timing:
+        timing.outcome = instrumentation.STAGE_FAILURE
+
+    assert instrumentation.get_sink() is None
+    assert stage("nothing") is timing
+
+
+def test_sink_is_loaded_from_the_settings(monkeypatch):
+    monkeypatch.setattr(instrumentation, "_sink", instrumentation._UNSET)
+    monkeypatch.setattr(
+        settings,
+        "KAGI_INSTRUMENTATION_SINK",
+        "kagi.instrumentation.PrometheusSink",
+    )
+
+    with stage("something"):
+        pass
+
+    assert instrumentation.get_sink().outcomes == {("something", "success"): 1}
+
+
+def test_stage_records_outcomes(sink):
+    with stage("ok"):
+        pass
+    with stage("invalid") as timing:
+        timing.outcome = instrumentation.STAGE_FAILURE
+    with pytest.raises(ZeroDivisionError):
+        with stage("broken"):
+            1 / 0
+
+    assert sink.outcomes == {
+        ("ok", "success"): 1,
+        ("invalid", "failure"): 1,
+        ("broken", "error"): 1,
+    }
+
+
+def test_totp_validation_is_timed(sink):
+    device = TOTPDevice(key=b"12345678901234567890")
+
+    assert device.validate_token("000000") is False
+    assert sink.outcomes == {("totp.validate_token", "failure"): 1}
+
+
+def test_webauthn_assertion_stages_are_timed(client, admin_user, sink):
+    authenticator = SoftwareAuthenticator()
+    register(admin_user, authenticator)
+    client.post(reverse("kagi:login"), {"username": "admin", "password": "password"})
+    options = client.get(reverse("kagi:begin-assertion")).json()
+
+    response = client.post(
+        reverse("kagi:verify-assertion"),
+        {
+            "credentials": authenticator.get_assertion(
+                options, origin="http://testserver"
+            )
+        },
+    )
+
+    assert response.status_code == 200
+    assert {name for name, _ in sink.outcomes} == {
+        "ratelimit.check",
+        "session.load",
+        "session.user_lookup",
+        "webauthn.assertion.query_keys",
+        "webauthn.assertion.parse",
+        "webauthn.assertion.verify_signature",
+        "webauthn.assertion.update_key",
+    }
+
+
+def test_prometheus_sink_renders_histograms():
+    sink = PrometheusSink()
+    sink.record("totp.validate_token", 0.002, "success")
+    sink.record("totp.validate_token", 10, "failure")
+
+    lines = sink.render().splitlines()
+
+    assert 'kagi_stage_total{stage="totp.validate_token",outcome="failure"} 1' in lines
+    assert (
+        'kagi_stage_duration_seconds_bucket{stage="totp.validate_token",le="0.001"} 0'
+        in lines
+    )
+    assert (
+        'kagi_stage_duration_seconds_bucket{stage="totp.validate_token",le="0.0025"} 1'
+        in lines
+    )
+    assert (
+        'kagi_stage_duration_seconds_bucket{stage="totp.validate_token",le="+Inf"} 2'
+        in lines
+    )
+    assert (
+        'kagi_stage_duration_seconds_sum{stage="totp.validate_token"} 10.002' in lines
+    )
+    assert 'kagi_stage_duration_seconds_count{stage="totp.validate_token"} 2' in lines
+
+
+def test_metrics_view(rf, sink):
+    sink.record("session.load", 0.001, "success")
+
+    response = metrics(rf.get("/metrics"))
+
+    assert response.status_code == 200
+    assert response["Content-Type"].startswith("text/plain; version=0.0.4")
+    assert b'kagi_stage_total{stage="session.load",outcome="success"} 1' in (
+        response.content
+    )
+
+
+def test_metrics_view_requires_the_prometheus_sink(rf, monkeypatch):
+    monkeypatch.setattr(instrumentation, "_sink", None)
+
+    with pytest.raises(Http404):
+        metrics(rf.get("/metrics"))
@@ -0,0 +1,80 @@
+from io import StringIO
+
+from django.core.management import CommandError, call_command
+
+import pytest
+
+from ..management.commands import loadtest
+from ..management.commands.loadtest import SimulatedUser
+
+
+@pytest.mark.parametrize("flows", [[], ["--flow", "totp"]])
+def test_loadtest_command(live_server, flows):
+    # The in-memory test database cannot be written by concurrent users.
+    stdout = StringIO()
+    call_command(
+        "loadtest",
+        live_server.url,
+        "--users",
+        "1",
+        "--iterations",
+        "3",
+        *flows,
+        stdout=stdout,
+    )
+
+    output = stdout.getvalue()
+    assert "3/3 logins succeeded" in output
+    assert "verify-second-factor GET              3 " in output
+    # Registering the WebAuthn keys is not timed.
+    assert "begin-activate" not in output
+    assert " 0.0% " in output
+
+
+def test_loadtest_command_reports_errors(live_server, monkeypatch):
+    monkeypatch.setattr(loadtest, "totp", lambda key, t: "000000")
+    stdout = StringIO()
+    call_command(
+        "loadtest",
+        live_server.url,
+        "--users",
+        "1",
+        "--iterations",
+        "2",
+        "--flow",
+        "totp",
+        stdout=stdout,
+    )
+
+    output = stdout.getvalue()
+    assert "0/2 logins succeeded" in output
+    assert "verify-second-factor POST             2  100.0%" in output
+
+
+def test_loadtest_command_fails_when_the_server_is_unreachable(transactional_db):
+    with pytest.raises(CommandError):
+        call_command("loadtest", "http://localhost:1/", "--users", "1")
+
+
+def test_simulated_user_reports_failed_logins(live_server, admin_user):
+    user = SimulatedUser(live_server.url, "admin", "wrong", algorithm="ES256")
+
+    assert user.run("totp") is False
+    assert user.requests == {"login GET": 1, "login POST": 1}
+    assert user.errors == {"login POST": 1}
+    assert len(user.timings["login POST"]) == 1
+
+
+@pytest.mark.parametrize("args", [["--users", "0"], ["--iterations", "0"]])
+def test_loadtest_command_counts_must_be_positive(db, args):
+    with pytest.raises(CommandError):
+        call_command("loadtest", "http://localhost:1/", *args)
+
+
+def test_loadtest_command_does_not_reuse_existing_users(django_user_model):
+    django_user_model.objects.create_user("kagi-loadtest-0", password="password")
+
+    with pytest.raises(CommandError):
+        call_command("loadtest", "http://localhost:1/", "--users", "1")
+
+    assert django_user_model.objects.get().check_password("password")
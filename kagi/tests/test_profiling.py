@@ -0,0 +1,107 @@
+from io import StringIO
+import os
+
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.management import CommandError, call_command
+from django.urls import reverse
+
+import pytest
+
+from .. import settings as kagi_settings
+from ..middleware import SamplingProfilerMiddleware
+
+
+@pytest.fixture
+def profiler(settings, monkeypatch, tmp_path):
+    monkeypatch.setattr(kagi_settings, "KAGI_PROFILER_SAMPLE_RATE", 1)
+    monkeypatch.setattr(kagi_settings, "KAGI_PROFILER_DIR", str(tmp_path))
+    monkeypatch.setattr(kagi_settings, "KAGI_PROFILER_MAX_FILES", 3)
+    settings.MIDDLEWARE = settings.MIDDLEWARE + [
+        "kagi.middleware.SamplingProfilerMiddleware"
+    ]
+    return tmp_path
+
+
+def test_profiler_is_disabled_by_default():
+    with pytest.raises(MiddlewareNotUsed):
+        SamplingProfilerMiddleware(lambda request: None)
+
+
+def test_profiler_samples_kagi_views(client, profiler):
+    client.get(reverse("kagi:login"))
+    client.get("/admin/login/")
+
+    assert [name.split("-", 2)[2] for name in os.listdir(profiler)] == [
+        "login-200.prof"
+    ]
+
+
+def test_profiler_skips_unsampled_requests(client, profiler, monkeypatch):
+    monkeypatch.setattr(kagi_settings, "KAGI_PROFILER_SAMPLE_RATE", 0.5)
+    monkeypatch.setattr("random.random", lambda: 0.5)
+
+    client.get(reverse("kagi:login"))
+
+    assert os.listdir(profiler) == []
+
+
+def test_profiler_keeps_the_latest_profiles(client, profiler):
+    for _ in range(4):
+        client.get(reverse("kagi:login"))
+    client.get(reverse("kagi:verify-second-factor"))
+
+    names = sorted(os.listdir(profiler))
+    assert len(names) == 3
+    assert names[-1].endswith("-verify-second-factor-302.prof")
+
+
+def test_profilereport_command(client, profiler):
+    client.get(reverse("kagi:login"))
+    client.get(reverse("kagi:verify-second-factor"))
+    (profiler / "other.prof").write_bytes(b"")
+    stdout, stderr = StringIO(), StringIO()
+
+    call_command(
+        "profilereport", "--directory", str(profiler), stdout=stdout, stderr=stderr
+    )
+
+    output = stdout.getvalue()
+    assert stderr.getvalue() == "Skipping other.prof, not written by the profiler.\n"
+    assert "2 profiles:" in output
+    assert "  login 200: 1" in output
+    assert "  verify-second-factor 302: 1" in output
+    assert "cumulative" in output
+
+
+def test_profilereport_command_filters_profiles(client, profiler):
+    client.get(reverse("kagi:login"))
+    client.get(reverse("kagi:verify-second-factor"))
+    (profiler / "README").write_text("")
+    stdout = StringIO()
+
+    call_command(
+        "profilereport",
+        "--directory",
+        str(profiler),
+        "--endpoint",
+        "verify-second-factor",
+        "--outcome",
+        "302",
+        "--sort",
+        "tottime",
+        "--top",
+        "5",
+        stdout=stdout,
+    )
+
+    output = stdout.getvalue()
+    assert "1 profiles:" in output
+    assert "login 200" not in output
+
+    with pytest.raises(CommandError):
+        call_command("profilereport", "--directory", str(profiler), "--outcome", "500")
+
+
+def test_profilereport_command_without_profiles(tmp_path):
+    with pytest.raises(CommandError):
+        call_command("profilereport", "--directory", str(tmp_path / "missing"))
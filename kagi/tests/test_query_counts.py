@@ -0,0 +1,367 @@
+"""
+Query budgets for every URL of ``kagi.urls``.
+
+Each scenario is run for users with 0, 1 and 20 WebAuthn keys, TOTP and HOTP
+devices and backup codes, and must run the same number of queries in every case.
+Scenarios that need a second factor to be set up are not run for 0 factors.
+"""
+
+import base64
+import json
+from unittest import mock
+
+from django.urls import reverse
+from django.utils import timezone
+
+import pytest
+from webauthn.authentication.verify_authentication_response import (
+    VerifiedAuthentication,
+)
+from webauthn.helpers import bytes_to_base64url
+from webauthn.helpers.structs import AttestationFormat, PublicKeyCredentialType
+from webauthn.registration.verify_registration_response import VerifiedRegistration
+
+from ..oath import hotp, totp
+
+TOTP_KEY = base64.b32decode("7AQ6YRY4OEL7IEHQ6FUWSBRX6W4ZYURF")
+
+# Number of queries per request. Keep this table in sync with performance
+# changes, so that they show up in review.
+QUERY_BUDGETS = {
+    "login GET": 0,
+    "login POST": 6,
+    "login POST without second factor": 10,
+    "verify-second-factor GET": 7,
+    "verify-second-factor POST totp": 15,
+    "verify-second-factor POST hotp": 15,
+    "verify-second-factor POST backup": 14,
+    "verify-second-factor POST invalid": 8,
+    "two-factor-settings GET": 4,
+    "webauthn-keys GET": 3,
+    "webauthn-keys POST": 4,
+    "add-webauthn-key GET": 0,
+    "backup-codes GET": 3,
+    "backup-codes POST": 32,
+    "add-totp GET": 5,
+    "add-totp POST": 2,
+    "totp-qrcode GET": 2,
+    "totp-devices GET": 3,
+    "totp-devices POST": 4,
+    "add-hotp GET": 2,
+    "add-hotp POST": 2,
+    "hotp-devices GET": 3,
+    "hotp-devices POST": 4,
+    "begin-activate GET": 6,
+    "verify-credential-info POST": 7,
+    "begin-assertion GET": 6,
+    "verify-assertion POST": 15,
+    "begin-passkey-assertion GET": 4,
+    "verify-passkey-assertion POST": 13,
+    "verify-token POST": 13,
+}
+
+FACTOR_COUNTS = [0, 1, 20]
+
+
+def verified_authentication(credential_id):
+    return VerifiedAuthentication(
+        credential_id=credential_id,
+        new_sign_count=1,
+        credential_device_type="single_device",
+        credential_backed_up=False,
+    )
+
+
+def verified_registration():
+    return VerifiedRegistration(
+        credential_id=b"new-credential-id",
+        credential_public_key=b"new-pubkey",
+        sign_count=0,
+        aaguid="wutang",
+        fmt=AttestationFormat.NONE,
+        credential_type=PublicKeyCredentialType.PUBLIC_KEY,
+        user_verified=False,
+        attestation_object=b"foobar",
+        credential_device_type="single_device",
+        credential_backed_up=False,
+    )
+
+
+@pytest.fixture
+def user(django_user_model, settings, request):
+    settings.PASSWORD_HASHERS = ["django.contrib.auth.hashers.MD5PasswordHasher"]
+    user = django_user_model.objects.create_user("admin", "admin@kagi.com", "admin")
+    factors = request.param
+    for i in range(factors):
+        user.webauthn_keys.create(
+            key_name=f"Key {i}",
+            sign_count=0,
+            credential_id=bytes_to_base64url(f"credential-id-{i}".encode()),
+            public_key=bytes_to_base64url(f"pubkey-{i}".encode()),
+        )
+        # Only the last device matches the token, so that all are checked.
+        key = TOTP_KEY if i == factors - 1 else bytes([i]) * 20
+        user.totp_devices.create(key=key)
+        user.hotp_devices.create(key=key)
+        user.backup_codes.create_backup_code(code=f"{i:06d}")
+    user.factors = factors
+    return user
+
+
+def login(client, user):
+    response = client.post(
+        reverse("kagi:login"), {"username": "admin", "password": "admin"}
+    )
+    assert response.status_code == 302
+    return response
+
+
+def pre_verify(client, user):
+    if not user.factors:
+        pytest.skip("Requires a second factor")
+    login(client, user)
+
+
+def scenario_login_get(client, user):
+    return lambda: client.get(reverse("kagi:login"))
+
+
+def scenario_login_post(client, user):
+    if not user.factors:
+        pytest.skip("Requires a second factor")
+    return lambda: login(client, user)
+
+
+def scenario_login_post_without_second_factor(client, user):
+    if user.factors:
+        pytest.skip("Requires no second factor")
+    return lambda: login(client, user)
+
+
+def scenario_verify_second_factor_get(client, user):
+    pre_verify(client, user)
+    return lambda: client.get(reverse("kagi:verify-second-factor"))
+
+
+def scenario_verify_second_factor_post_totp(client, user):
+    pre_verify(client, user)
+    token = totp(TOTP_KEY, timezone.now())
+    return lambda: client.post(
+        reverse("kagi:verify-second-factor"), {"type": "totp", "token": token}
+    )
+
+
+def scenario_verify_second_factor_post_hotp(client, user):
+    pre_verify(client, user)
+    return lambda: client.post(
+        reverse("kagi:verify-second-factor"),
+        {"type": "hotp", "token": hotp(TOTP_KEY, 0)},
+    )
+
+
+def scenario_verify_second_factor_post_backup(client, user):
+    pre_verify(client, user)
+    return lambda: client.post(
+        reverse("kagi:verify-second-factor"), {"type": "backup", "code": "000000"}
+    )
+
+
+def scenario_verify_second_factor_post_invalid(client, user):
+    pre_verify(client, user)
+    return lambda: client.post(
+        reverse("kagi:verify-second-factor"), {"type": "backup", "code": "abcdef"}
+    )
+
+
+def logged_in(url_name, method="GET", data=None):
+    def scenario(client, user):
+        client.force_login(user)
+        return lambda: getattr(client, method.lower())(reverse(url_name), data)
+
+    return scenario
+
+
+def scenario_webauthn_keys_post(client, user):
+    if not user.factors:
+        pytest.skip("Requires a WebAuthn key")
+    client.force_login(user)
+    key = user.webauthn_keys.first()
+    return lambda: client.post(
+        reverse("kagi:webauthn-keys"), {"delete": "checked", "key_id": key.pk}
+    )
+
+
+def scenario_add_totp_post(client, user):
+    client.force_login(user)
+    client.get(reverse("kagi:add-totp"))
+    return lambda: client.post(reverse("kagi:add-totp"), {"token": "abcdef"})
+
+
+def scenario_totp_qrcode_get(client, user):
+    client.force_login(user)
+    response = client.get(reverse("kagi:add-totp"))
+    return lambda: client.get(response.context_data["qr_url"])
+
+
+def scenario_totp_devices_post(client, user):
+    if not user.factors:
+        pytest.skip("Requires a TOTP device")
+    client.force_login(user)
+    device = user.totp_devices.first()
+    return lambda: client.post(
+        reverse("kagi:totp-devices"), {"delete": "checked", "device_id": device.pk}
+    )
+
+
+def scenario_add_hotp_post(client, user):
+    client.force_login(user)
+    data = {"secret": TOTP_KEY.hex(), "token": "abcdef"}
+    return lambda: client.post(reverse("kagi:add-hotp"), data)
+
+
+def scenario_hotp_devices_post(client, user):
+    if not user.factors:
+        pytest.skip("Requires an HOTP device")
+    client.force_login(user)
+    device = user.hotp_devices.first()
+    return lambda: client.post(
+        reverse("kagi:hotp-devices"), {"delete": "checked", "device_id": device.pk}
+    )
+
+
+def scenario_verify_credential_info_post(client, user):
+    client.force_login(user)
+    client.get(reverse("kagi:begin-activate"))
+
+    def request():
+        with mock.patch(
+            "kagi.views.api.webauthn.verify_registration_response",
+            return_value=verified_registration(),
+        ):
+            return client.post(
+                reverse("kagi:verify-credential-info"),
+                {"credentials": "fake_payload", "key_name": "SoloKey"},
+            )
+
+    return request
+
+
+def scenario_begin_assertion_get(client, user):
+    pre_verify(client, user)
+    return lambda: client.get(reverse("kagi:begin-assertion"))
+
+
+def scenario_verify_assertion_post(client, user):
+    pre_verify(client, user)
+    client.get(reverse("kagi:begin-assertion"))
+
+    def request():
+        # The signature check itself is mocked, but still needs the public
+        # keys of the user.
+        def verify_assertion_response(assertion, *, user, **kwargs):
+            list(user.webauthn_keys.values_list("public_key", "sign_count"))
+            return verified_authentication(b"credential-id-0")
+
+        with mock.patch(
+            "kagi.views.api.webauthn.verify_assertion_response",
+            side_effect=verify_assertion_response,
+        ):
+            return client.post(
+                reverse("kagi:verify-assertion"),
+                {"credentials": json.dumps({"fake": "payload"})},
+            )
+
+    return request
+
+
+def scenario_verify_passkey_assertion_post(client, user):
+    if not user.factors:
+        pytest.skip("Requires a WebAuthn key")
+    client.get(reverse("kagi:begin-passkey-assertion"))
+    credential_id = bytes_to_base64url(b"credential-id-0")
+    assertion = json.dumps(
+        {
+            "id": credential_id,
+            "rawId": credential_id,
+            "response": {
+                "authenticatorData": "AA",
+                "clientDataJSON": "AA",
+                "signature": "AA",
+                "userHandle": bytes_to_base64url(str(user.pk).encode()),
+            },
+            "type": "public-key",
+        }
+    )
+
+    def request():
+        with mock.patch(
+            "kagi.views.api.webauthn.verify_passkey_assertion_response",
+            return_value=verified_authentication(b"credential-id-0"),
+        ):
+            return client.post(
+                reverse("kagi:verify-passkey-assertion"), {"credentials": assertion}
+            )
+
+    return request
+
+
+def scenario_verify_token_post(client, user):
+    pre_verify(client, user)
+    return lambda: client.post(
+        reverse("kagi:verify-token"), {"type": "backup", "token": "000000"}
+    )
+
+
+SCENARIOS = {
+    "login GET": scenario_login_get,
+    "login POST": scenario_login_post,
+    "login POST without second factor": scenario_login_post_without_second_factor,
+    "verify-second-factor GET": scenario_verify_second_factor_get,
+    "verify-second-factor POST totp": scenario_verify_second_factor_post_totp,
+    "verify-second-factor POST hotp": scenario_verify_second_factor_post_hotp,
+    "verify-second-factor POST backup": scenario_verify_second_factor_post_backup,
+    "verify-second-factor POST invalid": scenario_verify_second_factor_post_invalid,
+    "two-factor-settings GET": logged_in("kagi:two-factor-settings"),
+    "webauthn-keys GET": logged_in("kagi:webauthn-keys"),
+    "webauthn-keys POST": scenario_webauthn_keys_post,
+    "add-webauthn-key GET": logged_in("kagi:add-webauthn-key"),
+    "backup-codes GET": logged_in("kagi:backup-codes"),
+    "backup-codes POST": logged_in("kagi:backup-codes", "POST"),
+    "add-totp GET": logged_in("kagi:add-totp"),
+    "add-totp POST": scenario_add_totp_post,
+    "totp-qrcode GET": scenario_totp_qrcode_get,
+    "totp-devices GET": logged_in("kagi:totp-devices"),
+    "totp-devices POST": scenario_totp_devices_post,
+    "add-hotp GET": logged_in("kagi:add-hotp"),
+    "add-hotp POST": scenario_add_hotp_post,
+    "hotp-devices GET": logged_in("kagi:hotp-devices"),
+    "hotp-devices POST": scenario_hotp_devices_post,
+    "begin-activate GET": logged_in("kagi:begin-activate"),
+    "verify-credential-info POST": scenario_verify_credential_info_post,
+    "begin-assertion GET": scenario_begin_assertion_get,
+    "verify-assertion POST": scenario_verify_assertion_post,
+    "begin-passkey-assertion GET": lambda client, user: (
+        lambda: client.get(reverse("kagi:begin-passkey-assertion"))
+    ),
+    "verify-passkey-assertion POST": scenario_verify_passkey_assertion_post,
+    "verify-token POST": scenario_verify_token_post,
+}
+
+
+def test_every_url_has_a_query_budget():
+    from ..urls import urlpatterns
+
+    covered = {name.split()[0] for name in SCENARIOS}
+    assert covered == {pattern.name for pattern in urlpatterns}
+    assert SCENARIOS.keys() == QUERY_BUDGETS.keys()
+
+
+@pytest.mark.parametrize("user", FACTOR_COUNTS, indirect=True)
+@pytest.mark.parametrize("scenario", SCENARIOS)
+def test_query_budget(client, user, scenario, django_assert_num_queries):
+    request = SCENARIOS[scenario](client, user)
+
+    with django_assert_num_queries(QUERY_BUDGETS[scenario]):
+        response = request()
+
+    assert response.status_code < 500
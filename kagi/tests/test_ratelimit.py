@@ -0,0 +1,123 @@
+from django.urls import reverse
+
+import pretend
+import pytest
+
+from .. import ratelimit, settings as kagi_settings
+
+WINDOW = kagi_settings.KAGI_RATE_LIMIT_WINDOW
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = pretend.stub(now=1000 * WINDOW)
+    monkeypatch.setattr(ratelimit.time, "time", lambda: clock.now)
+    return clock
+
+
+def login(client, username="admin"):
+    response = client.post(
+        reverse("kagi:login"), {"username": username, "password": "password"}
+    )
+    assert response.url == reverse("kagi:verify-second-factor")
+
+
+def test_verify_second_factor_is_limited_per_user(
+    client, admin_user, clock, django_assert_num_queries
+):
+    admin_user.totp_devices.create(key=b"12345678901234567890")
+    login(client)
+    for _ in range(kagi_settings.KAGI_RATE_LIMIT_USER_ATTEMPTS):
+        response = client.post(
+            reverse("kagi:verify-second-factor"), {"type": "totp", "token": "000000"}
+        )
+        assert response.status_code == 200
+
+    # Only the session is loaded.
+    with django_assert_num_queries(1):
+        response = client.post(
+            reverse("kagi:verify-second-factor"), {"type": "totp", "token": "000000"}
+        )
+
+    assert response.status_code == 429
+    # Rejected attempts count too.
+    assert response["Retry-After"] == str(
+        ratelimit.get_retry_after(
+            previous=0, current=11, elapsed=0, length=WINDOW, limit=10
+        )
+    )
+
+
+@pytest.mark.django_db
+def test_verify_assertion_is_limited_per_ip(client, monkeypatch):
+    monkeypatch.setattr(kagi_settings, "KAGI_RATE_LIMIT_IP_ATTEMPTS", 1)
+
+    response = client.post(reverse("kagi:verify-token"), REMOTE_ADDR="10.0.0.1")
+    assert response.status_code == 400
+    response = client.post(reverse("kagi:verify-assertion"), REMOTE_ADDR="10.0.0.1")
+
+    assert response.status_code == 429
+    assert response.json() == {"fail": "Too many attempts. Try again later."}
+    assert int(response["Retry-After"]) > 0
+    response = client.post(reverse("kagi:verify-token"), REMOTE_ADDR="10.0.0.2")
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("url_name", ["verify-passkey-assertion", "verify-token"])
+def test_api_views_are_limited(client, monkeypatch, url_name):
+    monkeypatch.setattr(kagi_settings, "KAGI_RATE_LIMIT_IP_ATTEMPTS", 0)
+
+    response = client.post(reverse(f"kagi:{url_name}"))
+
+    assert response.status_code == 429
+
+
+def test_previous_window_attempts_count_for_part_of_the_window(monkeypatch, clock):
+    monkeypatch.setattr(kagi_settings, "KAGI_RATE_LIMIT_CACHE", None)
+    for _ in range(10):
+        assert ratelimit.count_attempt("user:1", limit=10) is None
+
+    clock.now += WINDOW + WINDOW // 2
+    # Half of the attempts of the previous window still count.
+    for _ in range(5):
+        assert ratelimit.count_attempt("user:1", limit=10) is None
+    assert ratelimit.count_attempt("user:1", limit=10) == WINDOW // 5
+
+    clock.now += WINDOW
+    assert ratelimit.count_attempt("user:1", limit=10) is None
+
+
+def test_cache_failures_fall_back_to_local_counters(
+    monkeypatch, caplog, rate_limit_counters
+):
+    monkeypatch.setattr(kagi_settings, "KAGI_RATE_LIMIT_CACHE", "missing")
+
+    assert ratelimit.count_attempt("ip:10.0.0.1", limit=1) is None
+    assert ratelimit.count_attempt("ip:10.0.0.1", limit=1) is not None
+
+    assert "Could not count an attempt in the cache" in caplog.text
+    assert rate_limit_counters.sketches
+
+
+def test_local_counters_only_keep_two_windows():
+    counters = ratelimit.LocalCounters(width=8, depth=2)
+
+    for window in range(4):
+        counters.incr("user:1", window, timeout=2 * WINDOW)
+
+    assert sorted(counters.sketches) == [2, 3]
+    assert counters.get("user:1", 3) == 1
+    assert counters.get("user:1", 1) == 0
+
+
+def test_count_min_sketch_never_underestimates():
+    sketch = ratelimit.CountMinSketch(width=4, depth=2)
+    counts = {f"ip:10.0.0.{i}": i for i in range(20)}
+
+    for key, count in counts.items():
+        for _ in range(count):
+            sketch.incr(key)
+
+    for key, count in counts.items():
+        assert sketch.get(key) >= count
+    assert sum(sum(row) for row in sketch.rows) == 2 * sum(counts.values())
@@ -0,0 +1,116 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.urls import reverse
+
+import pytest
+
+from .. import relying_party, settings as kagi_settings
+from ..relying_party import HostRelyingPartyResolver, RelyingParty
+from ..utils.authenticator import SoftwareAuthenticator
+
+TENANTS = {
+    "login.tenant-a.test": {
+        "id": "tenant-a.test",
+        "name": "Tenant A",
+        "origins": ["https://login.tenant-a.test"],
+    },
+    "Tenant-B.test:8443": {},
+}
+
+
+@pytest.fixture
+def resolver(monkeypatch, settings):
+    settings.ALLOWED_HOSTS = ["*"]
+    monkeypatch.setattr(kagi_settings, "KAGI_RELYING_PARTIES", TENANTS)
+    resolver = HostRelyingPartyResolver()
+    monkeypatch.setattr(relying_party, "_resolver", resolver)
+    return resolver
+
+
+def test_relying_parties_are_resolved_from_the_host(resolver, rf):
+    assert resolver.resolve(rf.get("/", HTTP_HOST="login.tenant-a.test")) == (
+        RelyingParty(
+            id="tenant-a.test",
+            name="Tenant A",
+            origins=("https://login.tenant-a.test",),
+        )
+    )
+    assert resolver.resolve(rf.get("/", HTTP_HOST="tenant-b.test:8443")) == (
+        RelyingParty(
+            id="tenant-b.test",
+            name=kagi_settings.RELYING_PARTY_NAME,
+            origins=("https://tenant-b.test:8443",),
+        )
+    )
+
+
+def test_unknown_hosts_use_the_default_relying_party(resolver, rf):
+    assert resolver.resolve(rf.get("/", HTTP_HOST="example.test")) == (
+        RelyingParty(
+            id=kagi_settings.RELYING_PARTY_ID,
+            name=kagi_settings.RELYING_PARTY_NAME,
+            origins=("http://example.test",),
+        )
+    )
+
+
+def test_relying_party_ids_must_match_the_host(monkeypatch):
+    monkeypatch.setattr(
+        kagi_settings,
+        "KAGI_RELYING_PARTIES",
+        {"login.tenant-a.test": {"id": "tenant-b.test"}},
+    )
+
+    with pytest.raises(ImproperlyConfigured):
+        HostRelyingPartyResolver()
+
+
+def test_resolver_is_loaded_from_the_settings(monkeypatch):
+    monkeypatch.setattr(relying_party, "_resolver", None)
+
+    resolver = relying_party.get_resolver()
+
+    assert isinstance(resolver, HostRelyingPartyResolver)
+    assert relying_party.get_resolver() is resolver
+
+
+def test_keys_are_registered_and_used_per_tenant(resolver, client, admin_user):
+    authenticator = SoftwareAuthenticator()
+    client.force_login(admin_user)
+    options = client.get(
+        reverse("kagi:begin-activate"), HTTP_HOST="login.tenant-a.test"
+    ).json()
+    assert options["rp"] == {"id": "tenant-a.test", "name": "Tenant A"}
+    response = client.post(
+        reverse("kagi:verify-credential-info"),
+        {
+            "credentials": authenticator.make_credential(
+                options, origin="https://login.tenant-a.test"
+            ),
+            "key_name": "Tenant A",
+        },
+        HTTP_HOST="login.tenant-a.test",
+    )
+    assert response.status_code == 200
+    client.logout()
+
+    # A tenant A assertion is replayed to tenant B, then sent to tenant A.
+    for host, status_code in [
+        ("tenant-b.test:8443", 400),
+        ("login.tenant-a.test", 200),
+    ]:
+        client.post(
+            reverse("kagi:login"),
+            {"username": "admin", "password": "password"},
+            HTTP_HOST=host,
+        )
+        options = client.get(reverse("kagi:begin-assertion"), HTTP_HOST=host).json()
+        assert options["rpId"] == resolver.relying_parties[host.lower()].id
+        options["rpId"] = "tenant-a.test"
+        assertion = authenticator.get_assertion(
+            options, origin="https://login.tenant-a.test"
+        )
+        response = client.post(
+            reverse("kagi:verify-assertion"), {"credentials": assertion}, HTTP_HOST=host
+        )
+
+        assert response.status_code == status_code
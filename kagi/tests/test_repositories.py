@@ -0,0 +1,327 @@
+from django.urls import reverse
+from django.utils import timezone
+
+import pytest
+from webauthn.helpers import bytes_to_base64url
+
+from .. import repositories, settings as kagi_settings
+from ..oath import T, hotp, totp
+from ..repositories import (
+    CredentialRepository,
+    InMemoryCredentialRepository,
+    ORMCredentialRepository,
+)
+from ..utils.authenticator import SoftwareAuthenticator
+
+TOTP_KEY = b"12345678901234567890"
+
+
+class ORMRepository(ORMCredentialRepository):
+    # Adds factors the way the registration views do.
+
+    def add_webauthn_key(self, user, **fields):
+        return user.webauthn_keys.create(**fields)
+
+    def add_totp_device(self, user, key):
+        return user.totp_devices.create(key=key)
+
+    def add_hotp_device(self, user, key, counter=0):
+        return user.hotp_devices.create(key=key, counter=counter)
+
+    def add_backup_code(self, user, code):
+        user.backup_codes.create_backup_code(code=code)
+
+
+@pytest.fixture(params=[ORMRepository, InMemoryCredentialRepository])
+def repository(request):
+    return request.param()
+
+
+@pytest.fixture
+def other_user(django_user_model):
+    return django_user_model.objects.create_user("other", password="password")
+
+
+def add_key(repository, user, credential_id="credential", sign_count=0):
+    return repository.add_webauthn_key(
+        user,
+        key_name="Key",
+        credential_id=credential_id,
+        public_key=f"{credential_id}-public-key",
+        sign_count=sign_count,
+    )
+
+
+def test_enabled_factors(repository, admin_user, other_user):
+    add_key(repository, other_user)
+    repository.add_totp_device(other_user, TOTP_KEY)
+    repository.add_hotp_device(other_user, TOTP_KEY)
+    repository.add_backup_code(other_user, "123456")
+    assert repository.get_enabled_factors(admin_user) == {
+        "webauthn": False,
+        "backup": False,
+        "totp": False,
+        "hotp": False,
+    }
+
+    add_key(repository, admin_user, credential_id="mine")
+    repository.add_totp_device(admin_user, TOTP_KEY)
+    repository.add_hotp_device(admin_user, TOTP_KEY)
+    repository.add_backup_code(admin_user, "654321")
+
+    assert repository.get_enabled_factors(admin_user) == {
+        "webauthn": True,
+        "backup": True,
+        "totp": True,
+        "hotp": True,
+    }
+
+
+def test_webauthn_keys(repository, admin_user, other_user):
+    add_key(repository, admin_user, credential_id="a")
+    add_key(repository, admin_user, credential_id="b")
+    add_key(repository, other_user, credential_id="c")
+
+    assert sorted(repository.get_credential_ids(admin_user)) == ["a", "b"]
+    keys = repository.get_webauthn_keys(admin_user)
+    assert sorted(key.credential_id for key in keys) == ["a", "b"]
+    key = repository.get_webauthn_key("c")
+    assert key.user == other_user
+    assert repository.get_webauthn_key("d") is None
+    assert repository.get_webauthn_key("c", user=other_user).credential_id == "c"
+    assert repository.get_webauthn_key("c", user=admin_user) is None
+
+
+def test_sign_counts_are_compared_and_set(repository, admin_user):
+    add_key(repository, admin_user, sign_count=1)
+    key = repository.get_webauthn_key("credential")
+    stale = repository.get_webauthn_key("credential")
+
+    assert repository.update_sign_count(key, 2)
+    assert key.sign_count == 2
+    assert key.last_used_at is not None
+    assert not repository.update_sign_count(stale, 3)
+    assert repository.get_webauthn_key("credential").sign_count == 2
+
+
+def test_totp_uses_are_only_recorded_once(repository, admin_user, other_user):
+    repository.add_totp_device(admin_user, TOTP_KEY)
+    repository.add_totp_device(other_user, TOTP_KEY)
+    [device] = repository.get_totp_devices(admin_user)
+    [concurrent] = repository.get_totp_devices(admin_user)
+    now = timezone.now()
+
+    assert device.validate_token(totp(TOTP_KEY, now))
+    assert concurrent.validate_token(totp(TOTP_KEY, now))
+    assert repository.record_totp_use(device)
+    assert device.last_used_at is not None
+    assert not repository.record_totp_use(concurrent)
+    [device] = repository.get_totp_devices(admin_user)
+    assert device.last_t == T(now)
+    assert not device.validate_token(totp(TOTP_KEY, now))
+
+
+def test_hotp_uses_are_only_recorded_once(repository, admin_user, other_user):
+    repository.add_hotp_device(admin_user, TOTP_KEY, counter=3)
+    repository.add_hotp_device(other_user, TOTP_KEY)
+    [device] = repository.get_hotp_devices(admin_user)
+    [concurrent] = repository.get_hotp_devices(admin_user)
+
+    assert device.validate_token(hotp(TOTP_KEY, 5))
+    assert concurrent.validate_token(hotp(TOTP_KEY, 5))
+    assert repository.record_hotp_use(device)
+    assert device.last_used_at is not None
+    assert not repository.record_hotp_use(concurrent)
+    [device] = repository.get_hotp_devices(admin_user)
+    assert device.counter == 6
+    assert not device.validate_token(hotp(TOTP_KEY, 5))
+
+
+def test_backup_codes_are_consumed_once(repository, admin_user, other_user):
+    repository.add_backup_code(admin_user, "123456")
+    repository.add_backup_code(other_user, "654321")
+
+    assert not repository.consume_backup_code(admin_user, "654321")
+    assert repository.consume_backup_code(admin_user, "123456")
+    assert not repository.consume_backup_code(admin_user, "123456")
+
+
+def test_in_memory_repository_ignores_unknown_factors(admin_user):
+    repository = InMemoryCredentialRepository()
+    key = ORMRepository().add_webauthn_key(
+        admin_user, key_name="Key", credential_id="a", public_key="b", sign_count=0
+    )
+    device = admin_user.totp_devices.create(key=TOTP_KEY, last_t=1)
+    hotp_device = admin_user.hotp_devices.create(key=TOTP_KEY, counter=1)
+
+    assert not repository.update_sign_count(key, 1)
+    assert not repository.record_totp_use(device)
+    assert not repository.record_hotp_use(hotp_device)
+
+
+@pytest.mark.parametrize(
+    "method, args",
+    [
+        ("get_enabled_factors", [None]),
+        ("get_credential_ids", [None]),
+        ("get_webauthn_keys", [None]),
+        ("get_webauthn_key", ["credential"]),
+        ("update_sign_count", [None, 1]),
+        ("get_totp_devices", [None]),
+        ("record_totp_use", [None]),
+        ("get_hotp_devices", [None]),
+        ("record_hotp_use", [None]),
+        ("consume_backup_code", [None, "123456"]),
+    ],
+)
+def test_repositories_must_implement_every_method(method, args):
+    with pytest.raises(NotImplementedError):
+        getattr(CredentialRepository(), method)(*args)
+
+
+def test_repository_is_loaded_from_the_settings(monkeypatch):
+    monkeypatch.setattr(repositories, "_repository", None)
+    monkeypatch.setattr(
+        kagi_settings,
+        "KAGI_CREDENTIAL_REPOSITORY",
+        "kagi.repositories.InMemoryCredentialRepository",
+    )
+
+    repository = repositories.get_repository()
+
+    assert isinstance(repository, InMemoryCredentialRepository)
+    assert repositories.get_repository() is repository
+
+
+# The verification views, against the in-memory repository.
+
+
+@pytest.fixture
+def memory_repository(monkeypatch):
+    repository = InMemoryCredentialRepository()
+    monkeypatch.setattr(repositories, "_repository", repository)
+    return repository
+
+
+def login(client):
+    response = client.post(
+        reverse("kagi:login"), {"username": "admin", "password": "password"}
+    )
+    assert response.url == reverse("kagi:verify-second-factor")
+
+
+def add_authenticator(repository, user, **kwargs):
+    authenticator = SoftwareAuthenticator(**kwargs)
+    repository.add_webauthn_key(
+        user,
+        key_name="Software",
+        credential_id=bytes_to_base64url(authenticator.credential_id),
+        public_key=bytes_to_base64url(authenticator.public_key),
+        sign_count=0,
+    )
+    return authenticator
+
+
+def test_totp_verification_with_another_repository(
+    client, admin_user, memory_repository
+):
+    memory_repository.add_totp_device(admin_user, TOTP_KEY)
+    login(client)
+    assert not admin_user.totp_devices.exists()
+
+    response = client.post(
+        reverse("kagi:verify-second-factor"),
+        {"type": "totp", "token": totp(TOTP_KEY, timezone.now())},
+    )
+
+    assert response.status_code == 302
+    [device] = memory_repository.get_totp_devices(admin_user)
+    assert device.last_used_at is not None
+
+
+def test_totp_tokens_used_concurrently_are_rejected(
+    client, admin_user, memory_repository, monkeypatch
+):
+    memory_repository.add_totp_device(admin_user, TOTP_KEY)
+    login(client)
+    monkeypatch.setattr(memory_repository, "record_totp_use", lambda device: False)
+
+    response = client.post(
+        reverse("kagi:verify-second-factor"),
+        {"type": "totp", "token": totp(TOTP_KEY, timezone.now())},
+    )
+
+    assert response.status_code == 200
+    assert response.context["forms"]["totp"].errors
+
+
+def test_backup_code_verification_with_another_repository(
+    client, admin_user, memory_repository
+):
+    memory_repository.add_totp_device(admin_user, TOTP_KEY)
+    memory_repository.add_backup_code(admin_user, "123456")
+    login(client)
+
+    response = client.post(
+        reverse("kagi:verify-second-factor"), {"type": "backup", "code": "123456"}
+    )
+
+    assert response.status_code == 302
+    assert not memory_repository.get_enabled_factors(admin_user)["backup"]
+
+
+@pytest.mark.parametrize("concurrent", [False, True])
+def test_webauthn_verification_with_another_repository(
+    client, admin_user, memory_repository, monkeypatch, concurrent
+):
+    authenticator = add_authenticator(memory_repository, admin_user)
+    login(client)
+    if concurrent:
+        monkeypatch.setattr(
+            memory_repository, "update_sign_count", lambda key, sign_count: False
+        )
+    options = client.get(reverse("kagi:begin-assertion")).json()
+
+    response = client.post(
+        reverse("kagi:verify-assertion"),
+        {
+            "credentials": authenticator.get_assertion(
+                options, origin="http://testserver"
+            )
+        },
+    )
+
+    if concurrent:
+        assert response.status_code == 400
+        assert response.json() == {
+            "fail": "Assertion failed. Error: Concurrent use of the key"
+        }
+    else:
+        assert response.status_code == 200
+        [key] = memory_repository.get_webauthn_keys(admin_user)
+        assert key.sign_count == 1
+
+
+@pytest.mark.parametrize("concurrent", [False, True])
+def test_passkey_verification_with_another_repository(
+    client, admin_user, memory_repository, monkeypatch, concurrent
+):
+    authenticator = add_authenticator(
+        memory_repository, admin_user, user_handle=str(admin_user.pk).encode()
+    )
+    if concurrent:
+        monkeypatch.setattr(
+            memory_repository, "update_sign_count", lambda key, sign_count: False
+        )
+    options = client.get(reverse("kagi:begin-passkey-assertion")).json()
+
+    response = client.post(
+        reverse("kagi:verify-passkey-assertion"),
+        {
+            "credentials": authenticator.get_assertion(
+                options, origin="http://testserver", user_verified=True
+            )
+        },
+    )
+
+    assert response.status_code == (400 if concurrent else 200)
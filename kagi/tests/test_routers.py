@@ -0,0 +1,139 @@
+from django.contrib.auth.models import User
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import transaction
+from django.urls import reverse
+from django.utils import timezone
+
+import pytest
+
+from .. import settings as kagi_settings
+from ..middleware import ReplicaPinningMiddleware
+from ..models import WebAuthnKey
+from ..oath import totp
+from ..repositories import get_repository
+from ..routers import ReplicaRouter, primary_alias, track_writes
+from ..utils.authenticator import SoftwareAuthenticator
+
+# The test database of the "replica" alias is never written to, like a replica
+# lagging far behind the primary.
+pytestmark = pytest.mark.django_db(transaction=True, databases=["default", "replica"])
+
+PIN_COOKIE_NAME = kagi_settings.KAGI_REPLICA_PIN_COOKIE_NAME
+
+
+@pytest.fixture(autouse=True)
+def replicas(settings, monkeypatch):
+    monkeypatch.setattr(kagi_settings, "KAGI_DATABASE_REPLICAS", ["replica"])
+    settings.DATABASE_ROUTERS = ["kagi.routers.ReplicaRouter"]
+    settings.MIDDLEWARE = settings.MIDDLEWARE + [
+        "kagi.middleware.ReplicaPinningMiddleware"
+    ]
+
+
+def test_reads_go_to_the_replicas():
+    router = ReplicaRouter()
+
+    assert router.db_for_read(WebAuthnKey) == "replica"
+    assert router.db_for_read(User) is None
+    assert router.db_for_write(WebAuthnKey) == "default"
+    assert router.db_for_write(User) is None
+
+
+def test_reads_go_to_the_primary_after_a_write():
+    router = ReplicaRouter()
+
+    with track_writes() as tracked:
+        assert router.db_for_read(WebAuthnKey) == "replica"
+        router.db_for_write(WebAuthnKey)
+        assert router.db_for_read(WebAuthnKey) == "default"
+    assert tracked.wrote
+    with track_writes(pinned=True) as tracked:
+        assert router.db_for_read(WebAuthnKey) == "default"
+    assert not tracked.wrote
+    assert router.db_for_read(WebAuthnKey) == "replica"
+
+
+def test_verification_reads_do_not_count_as_writes(admin_user):
+    admin_user.totp_devices.create(key=b"12345678901234567890")
+
+    with track_writes() as tracked:
+        assert primary_alias(WebAuthnKey) == "default"
+        assert get_repository().get_webauthn_keys(admin_user) == []
+        assert len(get_repository().get_totp_devices(admin_user)) == 1
+        assert ReplicaRouter().db_for_read(WebAuthnKey) == "replica"
+    assert not tracked.wrote
+
+
+def test_failed_verifications_do_not_pin_the_reads(client, admin_user):
+    admin_user.totp_devices.create(key=b"12345678901234567890")
+    client.post(reverse("kagi:login"), {"username": "admin", "password": "password"})
+
+    response = client.post(
+        reverse("kagi:verify-second-factor"), {"type": "totp", "token": "000000"}
+    )
+
+    assert response.status_code == 200
+    assert PIN_COOKIE_NAME not in response.cookies
+
+
+def test_reads_go_to_the_primary_in_transactions():
+    with transaction.atomic():
+        assert ReplicaRouter().db_for_read(WebAuthnKey) == "default"
+
+
+def test_relations_between_primary_and_replicas_are_allowed(admin_user):
+    router = ReplicaRouter()
+    key = WebAuthnKey(user=admin_user)
+    key._state.db = "replica"
+    other = User(username="other")
+    other._state.db = "elsewhere"
+
+    assert router.allow_relation(key, admin_user) is True
+    assert router.allow_relation(key, other) is None
+
+
+def test_pinning_middleware_requires_replicas(monkeypatch):
+    monkeypatch.setattr(kagi_settings, "KAGI_DATABASE_REPLICAS", [])
+
+    with pytest.raises(MiddlewareNotUsed):
+        ReplicaPinningMiddleware(lambda request: None)
+
+
+def test_sessions_read_their_own_writes(client, admin_user):
+    client.force_login(admin_user)
+    authenticator = SoftwareAuthenticator()
+    options = client.get(reverse("kagi:begin-activate")).json()
+
+    response = client.post(
+        reverse("kagi:verify-credential-info"),
+        {
+            "credentials": authenticator.make_credential(
+                options, origin="http://testserver"
+            ),
+            "key_name": "Software",
+        },
+    )
+
+    cookie = response.cookies[PIN_COOKIE_NAME]
+    assert cookie["max-age"] == kagi_settings.KAGI_REPLICA_PIN_SECONDS
+    response = client.get(reverse("kagi:webauthn-keys"))
+    assert [key.key_name for key in response.context["object_list"]] == ["Software"]
+    assert PIN_COOKIE_NAME not in response.cookies
+
+    del client.cookies[PIN_COOKIE_NAME]
+    response = client.get(reverse("kagi:webauthn-keys"))
+    assert list(response.context["object_list"]) == []
+
+
+def test_totp_devices_are_verified_against_the_primary(client, admin_user):
+    key = b"12345678901234567890"
+    admin_user.totp_devices.create(key=key)
+    client.post(reverse("kagi:login"), {"username": "admin", "password": "password"})
+
+    response = client.post(
+        reverse("kagi:verify-second-factor"),
+        {"type": "totp", "token": totp(key, timezone.now())},
+    )
+
+    assert response.status_code == 302
+    assert response.cookies[PIN_COOKIE_NAME]
@@ -0,0 +1,147 @@
+import multiprocessing
+
+from django.core.cache import caches
+from django.urls import reverse
+
+import pretend
+import pytest
+
+from .. import settings as kagi_settings, shared_cache
+from ..shared_cache import HEADER, SharedMemoryCache
+from ..utils.authenticator import SoftwareAuthenticator
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "kagi-cache")
+
+
+@pytest.fixture
+def enabled(monkeypatch, path):
+    monkeypatch.setattr(kagi_settings, "KAGI_SHARED_CACHE_PATH", path)
+    monkeypatch.setattr(shared_cache, "_cache", None)
+
+
+def test_values_are_versioned(path):
+    cache = SharedMemoryCache(path, slots=16, slot_size=128)
+
+    assert cache.get("key", 1) is None
+    assert cache.set("key", 1, ["a", "b"])
+    assert cache.get("key", 1) == ["a", "b"]
+    assert cache.get("key", 2) is None
+    assert cache.get("other", 1) is None
+
+
+def test_values_are_shared_between_mappings(path):
+    SharedMemoryCache(path, slots=16, slot_size=128).set("key", 1, {"a": 1})
+
+    assert SharedMemoryCache(path, slots=16, slot_size=128).get("key", 1) == {"a": 1}
+
+
+def set_in_another_process(path):  # pragma: no cover
+    # Runs in the child process, unseen by coverage.
+    SharedMemoryCache(path, slots=16, slot_size=128).set("key", 1, "child")
+
+
+def test_values_are_shared_between_processes(path):
+    cache = SharedMemoryCache(path, slots=16, slot_size=128)
+    process = multiprocessing.get_context("fork").Process(
+        target=set_in_another_process, args=(path,)
+    )
+    process.start()
+    process.join()
+
+    assert cache.get("key", 1) == "child"
+
+
+def test_values_replace_the_values_in_their_slot(path):
+    cache = SharedMemoryCache(path, slots=1, slot_size=128)
+    cache.set("key", 1, "a")
+    cache.set("other", 1, "b")
+
+    assert cache.get("key", 1) is None
+    assert cache.get("other", 1) == "b"
+
+
+def test_values_larger_than_a_slot_are_not_stored(path):
+    cache = SharedMemoryCache(path, slots=1, slot_size=HEADER.size + 8)
+
+    assert not cache.set("key", 1, "a" * 8)
+    assert cache.get("key", 1) is None
+
+
+def test_corrupted_values_are_misses(path):
+    cache = SharedMemoryCache(path, slots=1, slot_size=128)
+    cache.set("key", 1, "value")
+
+    cache.mmap[HEADER.size + 1] ^= 1
+    assert cache.get("key", 1) is None
+
+    HEADER.pack_into(cache.mmap, 0, 1, 1000, bytes(16))
+    assert cache.get("key", 1) is None
+
+
+def test_values_are_computed_when_disabled():
+    default = pretend.call_recorder(lambda: ["a"])
+
+    assert shared_cache.get_or_set("key", default) == ["a"]
+    assert shared_cache.get_or_set("key", default) == ["a"]
+    assert len(default.calls) == 2
+    shared_cache.invalidate("key")
+    assert caches["default"].get("kagi:shared-cache-version:key") is None
+
+
+def test_values_are_computed_once_per_version(enabled):
+    default = pretend.call_recorder(lambda: ["a"])
+
+    assert shared_cache.get_or_set("key", default) == ["a"]
+    assert shared_cache.get_or_set("key", default) == ["a"]
+    assert len(default.calls) == 1
+    shared_cache.invalidate("key")
+    assert shared_cache.get_or_set("key", default) == ["a"]
+    assert len(default.calls) == 2
+
+
+def test_values_are_computed_without_a_version_cache(enabled, settings, monkeypatch):
+    settings.CACHES = {
+        **settings.CACHES,
+        "dummy": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"},
+    }
+    monkeypatch.setattr(kagi_settings, "KAGI_SHARED_CACHE_VERSION_CACHE", "dummy")
+    default = pretend.call_recorder(lambda: ["a"])
+
+    assert shared_cache.get_or_set("key", default) == ["a"]
+    assert shared_cache.get_or_set("key", default) == ["a"]
+    assert len(default.calls) == 2
+
+
+def test_invalidating_unknown_keys(enabled):
+    shared_cache.invalidate("key")
+
+    assert caches["default"].get("kagi:shared-cache-version:key") is None
+
+
+def test_credential_descriptors_follow_key_changes(enabled, client, admin_user):
+    client.force_login(admin_user)
+    options = client.get(reverse("kagi:begin-activate")).json()
+    assert options["excludeCredentials"] == []
+    authenticator = SoftwareAuthenticator()
+    client.post(
+        reverse("kagi:verify-credential-info"),
+        {
+            "credentials": authenticator.make_credential(
+                options, origin="http://testserver"
+            ),
+            "key_name": "Software",
+        },
+    )
+
+    options = client.get(reverse("kagi:begin-activate")).json()
+    [key] = admin_user.webauthn_keys.all()
+    assert [credential["id"] for credential in options["excludeCredentials"]] == [
+        key.credential_id
+    ]
+
+    key.delete()
+    options = client.get(reverse("kagi:begin-activate")).json()
+    assert options["excludeCredentials"] == []
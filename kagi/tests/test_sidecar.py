@@ -0,0 +1,280 @@
+import asyncio
+import os
+import socket
+import stat
+import struct
+import threading
+
+from django.core.management import call_command
+from django.utils import timezone
+
+import pretend
+import pytest
+
+from .. import settings as kagi_settings
+from ..management.commands import runsidecar
+from ..models import AuthEvent
+from ..oath import totp
+from ..sidecar import ProtocolError, encode_frame, server as sidecar_server
+from ..sidecar.client import AsyncClient, Client
+from ..sidecar.server import VerificationServer
+
+TOTP_KEY = b"12345678901234567890"
+
+
+@pytest.fixture
+def socket_path(tmp_path):
+    return str(tmp_path / "kagi.sock")
+
+
+@pytest.fixture
+def running_server(transactional_db, socket_path):
+    """
+    Serves verifications from an event loop in a background thread.
+    """
+    loop = asyncio.new_event_loop()
+    verification_server = VerificationServer(workers=2)
+    server = loop.run_until_complete(verification_server.start(socket_path))
+    thread = threading.Thread(target=loop.run_forever)
+    thread.start()
+    yield server
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    server.close()
+    loop.run_until_complete(server.wait_closed())
+    loop.close()
+    verification_server.close()
+
+
+def exchange(path, data):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(5)
+        sock.connect(path)
+        sock.sendall(data)
+        sock.shutdown(socket.SHUT_WR)
+        response = b""
+        while chunk := sock.recv(4096):
+            response += chunk
+    return response
+
+
+def test_totp_tokens_are_verified_once(running_server, socket_path, admin_user):
+    device = admin_user.totp_devices.create(key=TOTP_KEY)
+    token = totp(TOTP_KEY, timezone.now())
+
+    with Client(socket_path) as client:
+        assert client.verify("admin", "totp", "000000") == {"ok": False}
+        assert client.verify("admin", "totp", token, ip="192.0.2.1") == {"ok": True}
+        assert client.verify("admin", "totp", token) == {"ok": False}
+
+    device.refresh_from_db()
+    assert device.last_used_at is not None
+
+
+def test_backup_codes_are_consumed(running_server, socket_path, admin_user):
+    admin_user.backup_codes.create_backup_code(code="123456")
+
+    async def verify():
+        async with AsyncClient(socket_path) as client:
+            return [await client.verify("admin", "backup", "123456") for _ in range(2)]
+
+    assert asyncio.run(verify()) == [{"ok": True}, {"ok": False}]
+    assert not admin_user.backup_codes.exists()
+
+
+def test_verifications_are_recorded(
+    running_server, socket_path, admin_user, event_queue
+):
+    device = admin_user.totp_devices.create(key=TOTP_KEY)
+
+    with Client(socket_path) as client:
+        client.verify("admin", "totp", totp(TOTP_KEY, timezone.now()), ip="192.0.2.1")
+    event_queue.flush()
+
+    event = AuthEvent.objects.get()
+    assert (event.user, event.factor_type, event.factor_id) == (
+        admin_user,
+        "totp",
+        device.pk,
+    )
+    assert (event.succeeded, event.ip_address) == (True, "192.0.2.1")
+
+
+def test_unknown_and_inactive_users_are_rejected(
+    running_server, socket_path, django_user_model
+):
+    django_user_model.objects.create_user("inactive", is_active=False)
+
+    with Client(socket_path) as client:
+        assert client.verify("unknown", "backup", "123456") == {"ok": False}
+        assert client.verify("inactive", "backup", "123456") == {"ok": False}
+
+
+def test_invalid_requests_are_rejected(running_server, socket_path, admin_user):
+    with Client(socket_path) as client:
+        assert client.verify("admin", "webauthn", "123456") == {
+            "ok": False,
+            "error": "Unknown factor type.",
+        }
+        assert client.request({"type": "totp", "token": 123456}) == {
+            "ok": False,
+            "error": "The username and token must be strings.",
+        }
+        assert client.request({"type": ["totp"]}) == {
+            "ok": False,
+            "error": "Unknown factor type.",
+        }
+        for ip in ["192.0.2", "not an address", 3221225985, ["192.0.2.1"]]:
+            assert client.verify("admin", "totp", "123456", ip=ip) == {
+                "ok": False,
+                "error": "Invalid IP address.",
+            }
+
+
+def test_ip_addresses_are_normalized(
+    running_server, socket_path, admin_user, event_queue, monkeypatch
+):
+    monkeypatch.setattr(kagi_settings, "KAGI_RATE_LIMIT_IP_ATTEMPTS", 1)
+
+    with Client(socket_path) as client:
+        assert client.verify("admin", "totp", "000000", ip="2001:DB8:0::1") == {
+            "ok": False
+        }
+        response = client.verify("admin", "totp", "000000", ip="2001:db8::1")
+    event_queue.flush()
+
+    assert response["retry_after"] > 0
+    assert AuthEvent.objects.get().ip_address == "2001:db8::1"
+
+
+def test_attempts_for_unknown_users_are_limited(
+    running_server, socket_path, monkeypatch
+):
+    monkeypatch.setattr(kagi_settings, "KAGI_RATE_LIMIT_IP_ATTEMPTS", 1)
+
+    with Client(socket_path) as client:
+        assert client.verify("unknown", "totp", "000000", ip="192.0.2.1") == {
+            "ok": False
+        }
+        response = client.verify("other", "totp", "000000", ip="192.0.2.1")
+
+    assert response["retry_after"] > 0
+
+
+def test_attempts_are_limited(running_server, socket_path, admin_user, monkeypatch):
+    monkeypatch.setattr(kagi_settings, "KAGI_RATE_LIMIT_USER_ATTEMPTS", 1)
+
+    with Client(socket_path) as client:
+        assert client.verify("admin", "totp", "000000") == {"ok": False}
+        response = client.verify("admin", "totp", "000000")
+
+    assert response["retry_after"] > 0
+
+
+def test_errors_are_reported(running_server, socket_path, monkeypatch):
+    monkeypatch.setattr(sidecar_server, "verify", pretend.raiser(RuntimeError))
+
+    with Client(socket_path) as client:
+        assert client.verify("admin", "totp", "000000") == {
+            "ok": False,
+            "error": "Internal error.",
+        }
+
+
+@pytest.mark.parametrize(
+    "data, error",
+    [
+        (struct.pack("!I", 5000), "The message is too long."),
+        (encode_frame([]), "The message is not a JSON object."),
+        (struct.pack("!I", 1) + b"{", "The message is not valid JSON."),
+        (struct.pack("!I", 10) + b"{}", "The message is truncated."),
+        (b"\0", "The message is truncated."),
+    ],
+)
+def test_malformed_messages_close_the_connection(
+    running_server, socket_path, data, error
+):
+    assert exchange(socket_path, data) == encode_frame({"ok": False, "error": error})
+
+
+def test_closed_connections_are_reported(running_server, socket_path):
+    with Client(socket_path) as client:
+        # The server answers malformed requests, then closes the connection.
+        response = client.request({"token": "0" * 5000})
+        assert response == {"ok": False, "error": "The message is too long."}
+        with pytest.raises((OSError, ProtocolError)):
+            client.verify("admin", "totp", "000000")
+        assert client.sock is None
+
+
+def test_unreachable_servers_are_reported(socket_path):
+    client = Client(socket_path)
+
+    with pytest.raises(OSError):
+        client.verify("admin", "totp", "000000")
+    assert client.sock is None
+
+
+def test_clients_report_closed_connections():
+    client = Client("unused")
+    client.sock, server_sock = socket.socketpair()
+    server_sock.close()
+
+    with pytest.raises(ProtocolError):
+        client.recv_exactly(1)
+
+
+def test_async_clients_reconnect_after_errors(running_server, socket_path):
+    async def verify():
+        async with AsyncClient(socket_path) as client:
+            await client.request({"token": "0" * 5000})
+            with pytest.raises((OSError, asyncio.IncompleteReadError)):
+                await client.verify("admin", "totp", "000000")
+            assert client.writer is None
+            return await client.verify("unknown", "totp", "000000")
+
+    assert asyncio.run(verify()) == {"ok": False}
+
+
+def test_serve_until_cancelled(socket_path):
+    verification_server = VerificationServer(workers=1)
+
+    async def serve():
+        task = asyncio.create_task(verification_server.serve(socket_path, mode=0o600))
+        while not os.path.exists(socket_path):
+            await asyncio.sleep(0.01)
+        async with AsyncClient(socket_path) as client:
+            response = await client.verify("admin", "sms", "000000")
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return response
+
+    assert asyncio.run(serve()) == {"ok": False, "error": "Unknown factor type."}
+    assert stat.S_IMODE(os.stat(socket_path).st_mode) == 0o600
+    assert verification_server.executor._shutdown
+
+
+def test_runsidecar_command(socket_path, monkeypatch):
+    serve = pretend.call_recorder(lambda *args, **kwargs: asyncio.sleep(0))
+    monkeypatch.setattr(VerificationServer, "serve", serve)
+
+    call_command("runsidecar", socket_path, "--workers", "4", "--mode", "600")
+
+    (call,) = serve.calls
+    assert call.args[0].executor._max_workers == 4
+    assert call.args[1:] == (socket_path,)
+    assert call.kwargs == {
+        "backlog": kagi_settings.KAGI_SIDECAR_BACKLOG,
+        "mode": 0o600,
+    }
+
+
+def test_runsidecar_command_stops_on_interrupt(socket_path, monkeypatch):
+    def run(coroutine):
+        coroutine.close()
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(runsidecar.asyncio, "run", run)
+
+    call_command("runsidecar", socket_path)
@@ -0,0 +1,98 @@
+import gzip
+import os
+
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.templatetags.static import static
+from django.urls import reverse
+
+import pretend
+import pytest
+
+from .. import storage
+
+
+@pytest.fixture
+def static_root(settings, tmp_path):
+    settings.STATIC_ROOT = str(tmp_path)
+    settings.STORAGES = {
+        **settings.STORAGES,
+        "staticfiles": {
+            "BACKEND": "kagi.storage.PrecompressedManifestStaticFilesStorage"
+        },
+    }
+    return tmp_path
+
+
+def hashed_name(name):
+    return static(name)[len("/static/") :]
+
+
+def collectstatic():
+    call_command("collectstatic", interactive=False, verbosity=0)
+
+
+@pytest.mark.parametrize("with_brotli", [False, True])
+def test_hashed_files_are_compressed(static_root, monkeypatch, with_brotli):
+    compress = pretend.call_recorder(lambda content: b"br")
+    monkeypatch.setattr(
+        storage, "brotli", pretend.stub(compress=compress) if with_brotli else None
+    )
+
+    collectstatic()
+
+    name = hashed_name("kagi/webauthn.min.js")
+    assert name != "kagi/webauthn.min.js"
+    with open(static_root / name, "rb") as f:
+        content = f.read()
+    with gzip.open(static_root / f"{name}.gz") as f:
+        assert f.read() == content
+    assert os.path.exists(static_root / f"{name}.br") == with_brotli
+    assert not os.path.exists(static_root / "kagi/webauthn.min.js.gz")
+
+
+def test_compressed_files_are_replaced(static_root):
+    collectstatic()
+    collectstatic()
+
+    name = hashed_name("kagi/webauthn.min.js")
+    with gzip.open(static_root / f"{name}.gz") as f:
+        assert f.read().startswith(b"/*!")
+
+
+def test_small_files_are_not_compressed(static_root):
+    static_storage = storage.PrecompressedManifestStaticFilesStorage()
+    static_storage.save("small.js", ContentFile(b"a"))
+    static_storage.save("large.js", ContentFile(b"a" * 100))
+    static_storage.save("image.png", ContentFile(b"a" * 100))
+
+    processed = list(
+        static_storage.post_process(
+            {
+                name: (static_storage, name)
+                for name in ["small.js", "large.js", "image.png"]
+            }
+        )
+    )
+
+    compressed = [name for _, name, _ in processed if name.endswith(".gz")]
+    assert len(compressed) == 1
+    assert compressed[0].startswith("large.")
+
+
+def test_dry_runs_do_not_compress(static_root):
+    call_command("collectstatic", interactive=False, verbosity=0, dry_run=True)
+
+    assert not list(static_root.rglob("*.gz"))
+
+
+def test_pages_load_the_module(client):
+    response = client.get(reverse("kagi:login"))
+
+    assert b'<link rel="modulepreload" href="/static/kagi/webauthn.min.js">' in (
+        response.content
+    )
+    assert (
+        b'<script type="module" src="/static/kagi/webauthn.min.js"></script>'
+        in response.content
+    )
@@ -10,6 +10,7 @@ import pytest
 
 from ..models import TOTPDevice
 from ..oath import totp
+from ..views.totp_devices import render_qrcode
 
 base32_regexp = re.compile(
     r"^(?:[A-Z2-7]{8})*(?:[A-Z2-7]{2}={6}|[A-Z2-7]{4}={4}|[A-Z2-7]{5}={3}|[A-Z2-7]{7}=)?$"
@@ -43,12 +44,79 @@ def test_list_totp_devices(admin_client):
 def test_add_a_new_totp_device_shows_a_qrcode(admin_client):
     response = admin_client.get(reverse("kagi:add-totp"))
     assert response.status_code == 200
+    qr_url = response.context_data["qr_url"]
+    assert qr_url.startswith(reverse("kagi:totp-qrcode") + "?v=")
+    assert f'<img src="{qr_url}"' in response.content.decode()
+
+    response = admin_client.get(qr_url)
+    assert response.status_code == 200
+    assert response["Content-Type"] == "image/svg+xml"
     assert re.match(
         r"<\?xml version='1\.0' encoding='UTF-8'\?>\n<svg (width|height)=\"49mm\" ",
-        response.context_data["qr_svg"],
+        response.content.decode(),
     )
 
 
+def test_add_a_new_totp_device_keeps_the_deprecated_inline_qrcode(admin_client):
+    response = admin_client.get(reverse("kagi:add-totp"))
+
+    with pytest.deprecated_call():
+        qr_svg = response.context_data["qr_svg"]()
+    assert qr_svg.startswith("<?xml")
+
+
+def test_totp_qrcode_is_privately_cacheable(admin_client):
+    response = admin_client.get(reverse("kagi:add-totp"))
+    qr_url = response.context_data["qr_url"]
+
+    response = admin_client.get(qr_url)
+    assert response.status_code == 200
+    assert "private" in response["Cache-Control"]
+    assert "max-age=3600" in response["Cache-Control"]
+    etag = response["ETag"]
+
+    response = admin_client.get(qr_url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304
+    assert response["ETag"] == etag
+    assert "private" in response["Cache-Control"]
+
+    # A new secret gets a new version and ETag.
+    response = admin_client.get(reverse("kagi:add-totp"))
+    assert response.context_data["qr_url"] != qr_url
+    response = admin_client.get(qr_url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response["ETag"] != etag
+
+
+def test_totp_qrcode_can_be_rendered_as_png(admin_client):
+    admin_client.get(reverse("kagi:add-totp"))
+
+    response = admin_client.get(reverse("kagi:totp-qrcode"), {"format": "png"})
+    assert response.status_code == 200
+    assert response["Content-Type"] == "image/png"
+    assert response.content.startswith(b"\x89PNG")
+
+
+def test_totp_qrcode_rendering_is_cached(admin_client):
+    render_qrcode.cache_clear()
+    response = admin_client.get(reverse("kagi:add-totp"))
+    admin_client.get(response.context_data["qr_url"])
+    admin_client.post(reverse("kagi:add-totp"), {"token": "123456"})
+    admin_client.get(response.context_data["qr_url"])
+
+    assert render_qrcode.cache_info().misses == 1
+    assert render_qrcode.cache_info().hits == 1
+
+
+def test_totp_qrcode_requires_a_pending_secret(admin_client):
+    response = admin_client.get(reverse("kagi:totp-qrcode"))
+    assert response.status_code == 404
+
+    admin_client.get(reverse("kagi:add-totp"))
+    response = admin_client.get(reverse("kagi:totp-qrcode"), {"format": "gif"})
+    assert response.status_code == 404
+
+
 def test_add_a_new_totp_device_context_data_contains_the_base32_key_and_otpauth_link(
     admin_client,
 ):
@@ -0,0 +1,200 @@
+import json
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+from django.shortcuts import resolve_url
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+import pytest
+
+from .. import settings as kagi_settings
+from ..models import AuthEvent
+from ..oath import totp
+from ..trusted_devices import revoke_trusted_devices
+from ..utils.authenticator import SoftwareAuthenticator
+from .test_authenticator import register
+
+TOTP_KEY = b"12345678901234567890"
+COOKIE_NAME = kagi_settings.KAGI_TRUSTED_DEVICE_COOKIE_NAME
+
+
+@pytest.fixture(autouse=True)
+def trusted_device_days(monkeypatch):
+    monkeypatch.setattr(kagi_settings, "KAGI_TRUSTED_DEVICE_DAYS", 30)
+
+
+@pytest.fixture
+def totp_user(admin_user):
+    admin_user.totp_devices.create(key=TOTP_KEY)
+    return admin_user
+
+
+def login(client):
+    return client.post(
+        reverse("kagi:login"), {"username": "admin", "password": "password"}
+    )
+
+
+def logout(client):
+    # Client.logout() would clear the trusted device cookie as well.
+    del client.cookies[settings.SESSION_COOKIE_NAME]
+
+
+def verify_totp(client, **data):
+    login(client)
+    return client.post(
+        reverse("kagi:verify-second-factor"),
+        {"type": "totp", "token": totp(TOTP_KEY, timezone.now()), **data},
+    )
+
+
+def test_remembered_devices_skip_the_second_factor(client, totp_user, event_queue):
+    response = verify_totp(client, remember_device="on")
+    cookie = response.cookies[COOKIE_NAME]
+    assert cookie["max-age"] == 30 * 24 * 60 * 60
+    assert cookie["httponly"]
+    logout(client)
+
+    with CaptureQueriesContext(connection) as queries:
+        response = login(client)
+
+    assert response.url == resolve_url(settings.LOGIN_REDIRECT_URL)
+    assert not [query for query in queries if "kagi_" in query["sql"]]
+    event_queue.flush()
+    assert AuthEvent.objects.filter(
+        factor_type="trusted_device", succeeded=True
+    ).exists()
+
+
+def test_devices_are_only_remembered_on_request(client, totp_user):
+    response = verify_totp(client)
+
+    assert COOKIE_NAME not in response.cookies
+
+
+def test_devices_are_not_remembered_when_disabled(client, totp_user, monkeypatch):
+    verify_totp(client, remember_device="on")
+    logout(client)
+    monkeypatch.setattr(kagi_settings, "KAGI_TRUSTED_DEVICE_DAYS", 0)
+
+    assert login(client).url == reverse("kagi:verify-second-factor")
+    totp_user.backup_codes.create_backup_code(code="123456")
+    response = client.post(
+        reverse("kagi:verify-second-factor"),
+        {"type": "backup", "code": "123456", "remember_device": "on"},
+    )
+    assert response.status_code == 302
+    assert COOKIE_NAME not in response.cookies
+
+
+def test_verify_assertion_remembers_the_device(client, admin_user):
+    authenticator = SoftwareAuthenticator()
+    register(admin_user, authenticator)
+    login(client)
+    options = client.get(reverse("kagi:begin-assertion")).json()
+
+    response = client.post(
+        reverse("kagi:verify-assertion"),
+        {
+            "credentials": authenticator.get_assertion(
+                options, origin="http://testserver"
+            ),
+            "remember_device": "on",
+        },
+    )
+
+    assert response.status_code == 200
+    assert response.cookies[COOKIE_NAME]
+
+
+def test_verify_token_remembers_the_device(client, totp_user):
+    login(client)
+
+    response = client.post(
+        reverse("kagi:verify-token"),
+        json.dumps(
+            {
+                "type": "totp",
+                "token": totp(TOTP_KEY, timezone.now()),
+                "remember_device": True,
+            }
+        ),
+        content_type="application/json",
+    )
+
+    assert response.status_code == 200
+    assert response.cookies[COOKIE_NAME]
+
+
+def test_cookies_are_bound_to_the_user(client, totp_user, django_user_model):
+    verify_totp(client, remember_device="on")
+    logout(client)
+    other = django_user_model.objects.create_user("other", password="password")
+    other.totp_devices.create(key=TOTP_KEY)
+
+    response = client.post(
+        reverse("kagi:login"), {"username": "other", "password": "password"}
+    )
+
+    assert response.url == reverse("kagi:verify-second-factor")
+
+
+def test_password_changes_invalidate_cookies(client, totp_user):
+    verify_totp(client, remember_device="on")
+    logout(client)
+    totp_user.set_password("password")
+    totp_user.save()
+
+    assert login(client).url == reverse("kagi:verify-second-factor")
+
+
+def test_tampered_cookies_are_rejected(client, totp_user):
+    verify_totp(client, remember_device="on")
+    logout(client)
+    client.cookies[COOKIE_NAME] = client.cookies[COOKIE_NAME].value + "x"
+
+    assert login(client).url == reverse("kagi:verify-second-factor")
+
+
+def test_forgetting_trusted_devices(client, totp_user):
+    verify_totp(client, remember_device="on")
+
+    response = client.get(reverse("kagi:two-factor-settings"))
+    assert b"Forget all trusted devices" in response.content
+    response = client.post(reverse("kagi:two-factor-settings"), {"forget_devices": "1"})
+    assert response.url == reverse("kagi:two-factor-settings")
+    logout(client)
+
+    assert login(client).url == reverse("kagi:verify-second-factor")
+
+
+def test_removing_a_factor_forgets_trusted_devices(client, totp_user):
+    totp_user.totp_devices.create(key=b"abcdefghijklmnopqrst")
+    verify_totp(client, remember_device="on")
+
+    client.post(
+        reverse("kagi:totp-devices"),
+        {"delete": "1", "device_id": totp_user.totp_devices.last().pk},
+    )
+    logout(client)
+
+    assert login(client).url == reverse("kagi:verify-second-factor")
+
+
+def test_evicted_generations_invalidate_cookies(client, totp_user):
+    verify_totp(client, remember_device="on")
+    logout(client)
+    caches["default"].clear()
+
+    assert login(client).url == reverse("kagi:verify-second-factor")
+
+
+def test_revoking_without_a_generation(admin_user):
+    revoke_trusted_devices(admin_user)
+
+    assert (
+        caches["default"].get(f"kagi:trusted-device-generation:{admin_user.pk}") is None
+    )
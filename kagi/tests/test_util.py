@@ -1,7 +1,21 @@
+from django.core.cache.backends.locmem import LocMemCache
+
 from ..utils import get_origin
+from ..utils.cache import bump_counter, get_counter
 
 
 def test_get_origin(rf):
     request = rf.get("/")
     origin = get_origin(request)
     assert origin == "http://testserver", "Origin should be 'testserver' over HTTP"
+
+
+def test_counters_are_only_bumped_once_started():
+    cache = LocMemCache("counters", {})
+    bump_counter(cache, "counter")
+    assert cache.get("counter") is None
+
+    value = get_counter(cache, "counter")
+    assert get_counter(cache, "counter") == value
+    bump_counter(cache, "counter")
+    assert get_counter(cache, "counter") == value + 1
@@ -0,0 +1,140 @@
+import base64
+import json
+
+from django.contrib.auth.models import User
+from django.urls import reverse
+from django.utils import timezone
+
+from asgiref.sync import async_to_sync
+import pytest
+
+from ..models import BackupCode
+from ..oath import totp
+from ..utils import averify_second_factor_token
+
+TOTP_KEY = base64.b32decode("7AQ6YRY4OEL7IEHQ6FUWSBRX6W4ZYURF")
+
+
+@pytest.fixture
+def pre_verified_client(client, django_user_model):
+    user = django_user_model.objects.create_user("admin", "john.doe@kagi.com", "admin")
+    user.totp_devices.create(key=TOTP_KEY)
+    user.backup_codes.create_backup_code(code="123456")
+    response = client.post(
+        reverse("kagi:login"), {"username": "admin", "password": "admin"}
+    )
+    assert response.url == reverse("kagi:verify-second-factor")
+    return client
+
+
+def post_json(client, data, **kwargs):
+    return client.post(
+        reverse("kagi:verify-token"),
+        json.dumps(data),
+        content_type="application/json",
+        **kwargs,
+    )
+
+
+def test_verify_token_accepts_a_valid_totp_token(pre_verified_client):
+    token = totp(TOTP_KEY, timezone.now())
+    response = post_json(pre_verified_client, {"type": "totp", "token": token})
+
+    assert response.status_code == 200
+    assert response.json() == {
+        "success": "Successfully authenticated as admin",
+        "redirect_to": reverse("kagi:two-factor-settings"),
+    }
+    assert "kagi_pre_verify_user_pk" not in pre_verified_client.session
+
+    # Are we truly logged in?
+    response = pre_verified_client.get(reverse("kagi:two-factor-settings"))
+    assert response.status_code == 200
+
+
+def test_verify_token_accepts_a_form_encoded_backup_code(pre_verified_client):
+    response = pre_verified_client.post(
+        reverse("kagi:verify-token"), {"type": "backup", "token": "123456"}
+    )
+
+    assert response.status_code == 200
+    assert BackupCode.objects.count() == 0
+
+
+def test_verify_token_honors_the_next_parameter(pre_verified_client):
+    next_url = reverse("kagi:add-webauthn-key")
+    response = pre_verified_client.post(
+        f"{reverse('kagi:verify-token')}?next={next_url}",
+        json.dumps({"type": "backup", "token": "123456"}),
+        content_type="application/json",
+    )
+
+    assert response.status_code == 200
+    assert response.json()["redirect_to"] == next_url
+
+
+def test_verify_token_rejects_an_invalid_token(pre_verified_client):
+    response = post_json(pre_verified_client, {"type": "totp", "token": "12345"})
+
+    assert response.status_code == 400
+    assert response.json() == {
+        "fail": "Verification failed.",
+        "errors": {
+            "token": ["Ensure this value has at least 6 characters (it has 5)."]
+        },
+    }
+
+    response = post_json(pre_verified_client, {"type": "backup", "token": "654321"})
+    assert response.status_code == 400
+    assert response.json()["errors"] == {"code": ["That is not a valid backup code."]}
+    assert "kagi_pre_verify_user_pk" in pre_verified_client.session
+
+
+def test_verify_token_rejects_an_unknown_factor_type(pre_verified_client):
+    response = post_json(pre_verified_client, {"type": "webauthn", "token": "1"})
+
+    assert response.status_code == 400
+    assert response.json()["errors"] == {
+        "type": ["Unsupported second factor type: 'webauthn'"]
+    }
+
+
+@pytest.mark.parametrize(
+    "payload",
+    [
+        "not json",
+        "[]",
+        '{"type": "totp"}',
+        '{"type": ["x"], "token": "1"}',
+        '{"type": "totp", "token": 123456}',
+    ],
+)
+def test_verify_token_rejects_a_malformed_payload(pre_verified_client, payload):
+    response = pre_verified_client.post(
+        reverse("kagi:verify-token"), payload, content_type="application/json"
+    )
+
+    assert response.status_code == 400
+    assert response.json() == {"fail": "Invalid request payload."}
+
+
+@pytest.mark.django_db
+def test_verify_token_requires_a_pending_verification(client):
+    response = post_json(client, {"type": "backup", "token": "123456"})
+
+    assert response.status_code == 400
+    assert response.json() == {"fail": "No second factor verification pending."}
+
+
+@pytest.mark.django_db(transaction=True)
+def test_verify_second_factor_token_can_be_awaited(rf):
+    user = User.objects.create_user("admin", "john.doe@kagi.com", "admin")
+    user.backup_codes.create_backup_code(code="123456")
+    request = rf.post("/")
+
+    verified, errors = async_to_sync(averify_second_factor_token)(
+        request, user, "backup", "123456"
+    )
+
+    assert verified is True
+    assert errors == {}
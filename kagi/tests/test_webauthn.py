@@ -126,10 +126,17 @@ def test_verify_assertion_response(monkeypatch):
 
     not_a_real_user = pretend.stub(
         webauthn_keys=pretend.stub(
-            all=lambda: [
+            using=lambda alias: [
                 pretend.stub(
-                    public_key=bytes_to_base64url(b"fake public key"), sign_count=68
-                )
+                    credential_id="bar",
+                    public_key=bytes_to_base64url(b"other public key"),
+                    sign_count=1,
+                ),
+                pretend.stub(
+                    credential_id="foo",
+                    public_key=bytes_to_base64url(b"fake public key"),
+                    sign_count=68,
+                ),
             ]
         )
     )
@@ -177,7 +184,7 @@ def test_verify_assertion_response_failure(monkeypatch):
     )
 
     get_webauthn_users = pretend.call_recorder(
-        lambda *a, **kw: [(b"not a public key", 0)]
+        lambda *a, **kw: [("foo", b"not a public key", 0)]
     )
     monkeypatch.setattr(webauthn, "_get_webauthn_user_public_keys", get_webauthn_users)
 
@@ -193,3 +200,127 @@ def test_verify_assertion_response_failure(monkeypatch):
             origin="fake_origin",
             rp_id="fake_rp_id",
         )
+
+
+def test_verify_assertion_response_requires_a_key_of_the_user(monkeypatch):
+    verify_authentication_response = pretend.call_recorder(lambda **kw: None)
+    monkeypatch.setattr(
+        pywebauthn, "verify_authentication_response", verify_authentication_response
+    )
+    monkeypatch.setattr(
+        webauthn,
+        "_get_webauthn_user_public_keys",
+        lambda *a, **kw: [("bar", b"public key", 0)],
+    )
+
+    with pytest.raises(webauthn.AuthenticationRejectedError):
+        webauthn.verify_assertion_response(
+            (
+                '{"id": "foo", "rawId": "foo", "response": '
+                '{"authenticatorData": "foo", "clientDataJSON": "bar", '
+                '"signature": "wutang"}}'
+            ),
+            challenge=b"not_a_real_challenge",
+            user=pretend.stub(),
+            origin="fake_origin",
+            rp_id="fake_rp_id",
+        )
+    assert verify_authentication_response.calls == []
+
+
+def test_get_passkey_assertion_options():
+    options = webauthn.get_passkey_assertion_options(
+        challenge=b"not_a_real_challenge", rp_id="fake_rp_id"
+    )
+
+    assert options == {
+        "challenge": bytes_to_base64url(b"not_a_real_challenge"),
+        "timeout": 60000,
+        "rpId": "fake_rp_id",
+        "allowCredentials": [],
+        "userVerification": "required",
+    }
+
+
+def test_parse_assertion_decodes_the_user_handle():
+    credential, user_handle = webauthn.parse_assertion(
+        '{"id": "foo", "rawId": "foo", "response": '
+        '{"authenticatorData": "foo", "clientDataJSON": "bar", '
+        '"signature": "wutang", "userHandle": "MQ"}}'
+    )
+
+    assert credential.raw_id == b"~\x8a"
+    assert user_handle == b"1"
+
+
+def test_parse_assertion_without_user_handle():
+    _, user_handle = webauthn.parse_assertion(
+        '{"id": "foo", "rawId": "foo", "response": '
+        '{"authenticatorData": "foo", "clientDataJSON": "bar", '
+        '"signature": "wutang"}}'
+    )
+
+    assert user_handle is None
+
+
+def test_parse_assertion_failure():
+    with pytest.raises(webauthn.AuthenticationRejectedError):
+        webauthn.parse_assertion('{"id": "foo"}')
+
+
+def test_verify_passkey_assertion_response(monkeypatch):
+    fake_verified_authentication = VerifiedAuthentication(
+        credential_id=b"a credential id",
+        new_sign_count=69,
+        credential_device_type="multi_device",
+        credential_backed_up=True,
+    )
+    mock_verify_authentication_response = pretend.call_recorder(
+        lambda *a, **kw: fake_verified_authentication
+    )
+    monkeypatch.setattr(
+        pywebauthn,
+        "verify_authentication_response",
+        mock_verify_authentication_response,
+    )
+    credential = pretend.stub()
+    key = pretend.stub(public_key=bytes_to_base64url(b"fake public key"), sign_count=68)
+
+    resp = webauthn.verify_passkey_assertion_response(
+        credential,
+        challenge=b"not_a_real_challenge",
+        key=key,
+        origin="fake_origin",
+        rp_id="fake_rp_id",
+    )
+
+    assert mock_verify_authentication_response.calls == [
+        pretend.call(
+            credential=credential,
+            expected_challenge=b"bm90X2FfcmVhbF9jaGFsbGVuZ2U",
+            expected_rp_id="fake_rp_id",
+            expected_origin="fake_origin",
+            credential_public_key=b"fake public key",
+            credential_current_sign_count=68,
+            require_user_verification=True,
+        )
+    ]
+    assert resp == fake_verified_authentication
+
+
+def test_verify_passkey_assertion_response_failure(monkeypatch):
+    monkeypatch.setattr(
+        pywebauthn,
+        "verify_authentication_response",
+        pretend.raiser(pywebauthn.helpers.exceptions.InvalidAuthenticationResponse),
+    )
+    key = pretend.stub(public_key=bytes_to_base64url(b"fake public key"), sign_count=0)
+
+    with pytest.raises(webauthn.AuthenticationRejectedError):
+        webauthn.verify_passkey_assertion_response(
+            pretend.stub(),
+            challenge=b"not_a_real_challenge",
+            key=key,
+            origin="fake_origin",
+            rp_id="fake_rp_id",
+        )
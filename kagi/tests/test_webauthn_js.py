@@ -0,0 +1,109 @@
+import importlib.util
+import json
+from pathlib import Path
+import shutil
+import subprocess
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.urls import reverse
+
+import pytest
+from webauthn.authentication.verify_authentication_response import (
+    VerifiedAuthentication,
+)
+from webauthn.helpers import bytes_to_base64url
+
+from .test_webauthn_keys import passkey_assertion
+
+STATIC_DIR = Path(__file__).parents[1] / "static" / "kagi"
+SCRIPTS = [STATIC_DIR / "webauthn.js", STATIC_DIR / "webauthn.min.js"]
+# The minified script is built by tasks.py, next to the package in a checkout.
+TASKS = Path(__file__).parents[2] / "tasks.py"
+
+# Runs the script in a context with the few browser globals it uses when it is
+# loaded, then prints the bytes that it would hand to the authenticator as the
+# user handle.
+USER_HANDLE = """
+const vm = require("vm");
+const fs = require("fs");
+const [path, options] = process.argv.slice(1);
+const context = vm.createContext({
+  atob,
+  btoa,
+  TextEncoder,
+  document: { addEventListener: () => {} },
+  PublicKeyCredential: {},
+});
+vm.runInContext(fs.readFileSync(path, "utf8"), context);
+context.options = JSON.parse(options);
+const id = vm.runInContext("parseCreationOptions(options).user.id", context);
+process.stdout.write(JSON.stringify(Array.from(id)));
+"""
+
+requires_node = pytest.mark.skipif(
+    shutil.which("node") is None, reason="Node.js is not installed"
+)
+
+
+def browser_user_handle(options, script):
+    output = subprocess.run(
+        ["node", "-e", USER_HANDLE, str(script), json.dumps(options)],
+        capture_output=True,
+        check=True,
+        text=True,
+    ).stdout
+    return bytes(json.loads(output))
+
+
+@requires_node
+@pytest.mark.parametrize("script", SCRIPTS, ids=lambda script: script.name)
+def test_scripts_are_valid(script):
+    subprocess.run(["node", "--check", str(script)], check=True)
+
+
+@pytest.mark.skipif(not TASKS.exists(), reason="tasks.py is not available")
+def test_minified_script_is_up_to_date():
+    pytest.importorskip("invoke")
+    spec = importlib.util.spec_from_file_location("tasks", TASKS)
+    tasks = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(tasks)
+
+    assert (
+        tasks.minify_js(SCRIPTS[0].read_text()) == SCRIPTS[1].read_text()
+    ), "Run 'invoke assets' to rebuild webauthn.min.js."
+
+
+@requires_node
+@pytest.mark.django_db
+@pytest.mark.parametrize("script", SCRIPTS, ids=lambda script: script.name)
+def test_passkeys_log_in_with_the_user_handle_registered_by_the_browser(client, script):
+    user = User.objects.create_user("admin", "john.doe@kagi.com", "admin")
+    user.webauthn_keys.create(
+        key_name="SoloKey",
+        sign_count=0,
+        credential_id=bytes_to_base64url(b"credential-id"),
+        public_key=bytes_to_base64url(b"pubkey"),
+    )
+    client.force_login(user)
+    options = client.get(reverse("kagi:begin-activate")).json()
+    client.logout()
+
+    user_handle = browser_user_handle(options, script)
+
+    assert user_handle == str(user.pk).encode()
+    client.get(reverse("kagi:begin-passkey-assertion"))
+    with mock.patch(
+        "kagi.views.api.webauthn.verify_passkey_assertion_response",
+        return_value=VerifiedAuthentication(
+            credential_id=b"credential-id",
+            new_sign_count=1,
+            credential_device_type="multi_device",
+            credential_backed_up=True,
+        ),
+    ):
+        response = client.post(
+            reverse("kagi:verify-passkey-assertion"),
+            {"credentials": passkey_assertion(user_handle=user_handle)},
+        )
+    assert response.status_code == 200
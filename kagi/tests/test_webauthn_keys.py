@@ -75,6 +75,34 @@ def test_begin_activate_return_user_credential_options(admin_client):
     }
 
     assert "pubKeyCredParams" in credential_options
+    assert credential_options["excludeCredentials"] == []
+
+
+def test_begin_activate_excludes_the_user_existing_credentials(admin_client):
+    user = User.objects.get(pk=1)
+    user.webauthn_keys.create(
+        key_name="SoloKey",
+        sign_count=0,
+        credential_id=bytes_to_base64url(b"credential-id"),
+        public_key=bytes_to_base64url(b"pubkey"),
+    )
+    User.objects.create_user("other").webauthn_keys.create(
+        key_name="Other SoloKey",
+        sign_count=0,
+        credential_id=bytes_to_base64url(b"other-credential-id"),
+        public_key=bytes_to_base64url(b"other-pubkey"),
+    )
+
+    response = admin_client.get(reverse("kagi:begin-activate"))
+
+    assert response.status_code == 200
+    assert response.json()["excludeCredentials"] == [
+        {
+            "id": bytes_to_base64url(b"credential-id"),
+            "type": "public-key",
+            "transports": ["usb", "nfc", "ble", "internal"],
+        }
+    ]
 
 
 # Testing view verify credential info
@@ -285,6 +313,47 @@ def test_verify_assertion_validates_the_user_webauthn_key(client):
     }
 
 
+@pytest.mark.django_db
+def test_verify_assertion_rejects_keys_of_other_users(client):
+    user = User.objects.create_user("admin", "john.doe@kagi.com", "admin")
+    user.webauthn_keys.create(
+        key_name="SoloKey",
+        sign_count=0,
+        credential_id=bytes_to_base64url(b"credential-id"),
+        public_key=bytes_to_base64url(b"pubkey"),
+    )
+    other_user = User.objects.create_user("other")
+    other_user.webauthn_keys.create(
+        key_name="SoloKey",
+        sign_count=0,
+        credential_id=bytes_to_base64url(b"other-credential-id"),
+        public_key=bytes_to_base64url(b"other-pubkey"),
+    )
+    client.post(reverse("kagi:login"), {"username": "admin", "password": "admin"})
+    client.get(reverse("kagi:begin-assertion"))
+
+    for credential_id in [b"other-credential-id", b"unknown"]:
+        with mock.patch(
+            "kagi.views.api.webauthn.verify_assertion_response",
+            return_value=VerifiedAuthentication(
+                credential_id=credential_id,
+                new_sign_count=100,
+                credential_device_type="single_device",
+                credential_backed_up=False,
+            ),
+        ):
+            response = client.post(
+                reverse("kagi:verify-assertion"),
+                {"credentials": json.dumps({"fake": "payload"})},
+            )
+
+        assert response.status_code == 400
+        assert response.json() == {
+            "fail": "Assertion failed. Error: Unknown WebAuthn credential"
+        }
+    assert other_user.webauthn_keys.get().sign_count == 0
+
+
 @pytest.mark.django_db
 def test_verify_assertion_validates_the_assertion(client):
     # We need to create a couple of WebAuthnKey for our user.
@@ -332,3 +401,231 @@ def test_verify_assertion_validates_the_assertion(client):
     assert response.json() == {
         "fail": "Assertion failed. Error: Invalid WebAuthn credential"
     }
+
+
+@pytest.mark.django_db
+def test_verify_second_factor_page_embeds_the_assertion_options(client):
+    user = User.objects.create_user("admin", "john.doe@kagi.com", "admin")
+    user.webauthn_keys.create(
+        key_name="SoloKey",
+        sign_count=0,
+        credential_id=bytes_to_base64url(b"credential-id"),
+        public_key=bytes_to_base64url(b"pubkey"),
+    )
+    response = client.post(
+        reverse("kagi:login"), {"username": "admin", "password": "admin"}
+    )
+    assert response.url == reverse("kagi:verify-second-factor")
+
+    challenge = b"k31d65xGDFb0VUq4MEMXmWpuWkzPs889"
+    with mock.patch(
+        "kagi.utils.webauthn.generate_webauthn_challenge", return_value=challenge
+    ):
+        response = client.get(reverse("kagi:verify-second-factor"))
+
+    assert response.status_code == 200
+    assert response.context_data["assertion_options"] == {
+        "challenge": bytes_to_base64url(challenge),
+        "timeout": 60000,
+        "rpId": "localhost",
+        "allowCredentials": [
+            {
+                "id": bytes_to_base64url(b"credential-id"),
+                "type": "public-key",
+                "transports": ["usb", "nfc", "ble", "internal"],
+            }
+        ],
+        "userVerification": "discouraged",
+    }
+    assert b'<script id="webauthn-assertion-options"' in response.content
+    assert client.session["challenge"] == bytes_to_base64url(challenge)
+
+    # The embedded challenge can be used without calling begin-assertion.
+    fake_verified_authentication = VerifiedAuthentication(
+        credential_id=b"credential-id",
+        new_sign_count=1,
+        credential_device_type="single_device",
+        credential_backed_up=False,
+    )
+    with mock.patch(
+        "kagi.views.api.webauthn.verify_assertion_response",
+        return_value=fake_verified_authentication,
+    ) as mocked_verify_assertion_response:
+        response = client.post(
+            reverse("kagi:verify-assertion"),
+            {"credentials": json.dumps({"fake": "payload"})},
+        )
+
+    assert response.status_code == 200
+    assert mocked_verify_assertion_response.call_args.kwargs["challenge"] == challenge
+
+
+@pytest.mark.django_db
+def test_verify_second_factor_page_skips_assertion_options_without_keys(client):
+    user = User.objects.create_user("admin", "john.doe@kagi.com", "admin")
+    user.totp_devices.create()
+    client.post(reverse("kagi:login"), {"username": "admin", "password": "admin"})
+
+    response = client.get(reverse("kagi:verify-second-factor"))
+
+    assert response.status_code == 200
+    assert "assertion_options" not in response.context_data
+    assert "challenge" not in client.session
+
+
+# Testing passkey login
+def passkey_assertion(credential_id=b"credential-id", user_handle=b"1"):
+    response = {
+        "authenticatorData": bytes_to_base64url(b"authenticator-data"),
+        "clientDataJSON": bytes_to_base64url(b"client-data"),
+        "signature": bytes_to_base64url(b"signature"),
+    }
+    if user_handle is not None:
+        response["userHandle"] = bytes_to_base64url(user_handle)
+    return json.dumps(
+        {
+            "id": bytes_to_base64url(credential_id),
+            "rawId": bytes_to_base64url(credential_id),
+            "response": response,
+            "type": "public-key",
+        }
+    )
+
+
+@pytest.fixture
+def passkey_user(db):
+    user = User.objects.create_user("admin", "john.doe@kagi.com", "admin")
+    user.webauthn_keys.create(
+        key_name="SoloKey",
+        sign_count=0,
+        credential_id=bytes_to_base64url(b"credential-id"),
+        public_key=bytes_to_base64url(b"pubkey"),
+    )
+    return user
+
+
+@pytest.mark.django_db
+def test_begin_passkey_assertion_does_not_list_credentials(client):
+    challenge = b"k31d65xGDFb0VUq4MEMXmWpuWkzPs889"
+    with mock.patch(
+        "kagi.views.api.webauthn.generate_webauthn_challenge", return_value=challenge
+    ):
+        response = client.get(reverse("kagi:begin-passkey-assertion"))
+
+    assert response.status_code == 200
+    assert response.json() == {
+        "challenge": bytes_to_base64url(challenge),
+        "timeout": 60000,
+        "rpId": "localhost",
+        "allowCredentials": [],
+        "userVerification": "required",
+    }
+    assert client.session["passkey_challenge"] == bytes_to_base64url(challenge)
+
+
+def test_verify_passkey_assertion_logs_the_user_in(client, passkey_user):
+    client.get(reverse("kagi:begin-passkey-assertion"))
+
+    fake_verified_authentication = VerifiedAuthentication(
+        credential_id=b"credential-id",
+        new_sign_count=3,
+        credential_device_type="multi_device",
+        credential_backed_up=True,
+    )
+    with mock.patch(
+        "kagi.views.api.webauthn.verify_passkey_assertion_response",
+        return_value=fake_verified_authentication,
+    ) as mocked_verify:
+        response = client.post(
+            reverse("kagi:verify-passkey-assertion"),
+            {"credentials": passkey_assertion()},
+        )
+
+    assert response.status_code == 200
+    assert response.json() == {
+        "success": "Successfully authenticated as admin",
+        "redirect_to": reverse("kagi:two-factor-settings"),
+    }
+    assert mocked_verify.call_args.kwargs["key"].user == passkey_user
+    assert "passkey_challenge" not in client.session
+    key = passkey_user.webauthn_keys.get()
+    assert key.sign_count == 3
+    assert key.last_used_at is not None
+
+    # Are we truly logged in?
+    response = client.get(reverse("kagi:two-factor-settings"))
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize(
+    "assertion, error",
+    [
+        (passkey_assertion(credential_id=b"unknown"), "Unknown WebAuthn credential"),
+        (passkey_assertion(user_handle=b"2"), "Invalid user handle"),
+        (passkey_assertion(user_handle=None), "Invalid user handle"),
+        ('{"id": "foo"}', "Malformed WebAuthn assertion"),
+    ],
+)
+def test_verify_passkey_assertion_rejects_mismatching_credentials(
+    client, passkey_user, assertion, error
+):
+    client.get(reverse("kagi:begin-passkey-assertion"))
+
+    with mock.patch(
+        "kagi.views.api.webauthn.verify_passkey_assertion_response"
+    ) as mocked_verify:
+        response = client.post(
+            reverse("kagi:verify-passkey-assertion"), {"credentials": assertion}
+        )
+
+    assert response.status_code == 400
+    assert response.json() == {"fail": f"Assertion failed. Error: {error}"}
+    assert not mocked_verify.called
+
+
+def test_verify_passkey_assertion_rejects_inactive_users(client, passkey_user):
+    passkey_user.is_active = False
+    passkey_user.save()
+    client.get(reverse("kagi:begin-passkey-assertion"))
+
+    response = client.post(
+        reverse("kagi:verify-passkey-assertion"),
+        {"credentials": passkey_assertion()},
+    )
+
+    assert response.status_code == 400
+    assert response.json() == {"fail": "Assertion failed. Error: Inactive user"}
+
+
+def test_verify_passkey_assertion_rejects_invalid_signatures(client, passkey_user):
+    client.get(reverse("kagi:begin-passkey-assertion"))
+
+    with mock.patch(
+        "kagi.views.api.webauthn.verify_passkey_assertion_response",
+        side_effect=webauthn.AuthenticationRejectedError("Invalid signature"),
+    ):
+        response = client.post(
+            reverse("kagi:verify-passkey-assertion"),
+            {"credentials": passkey_assertion()},
+        )
+
+    assert response.status_code == 400
+    assert response.json() == {"fail": "Assertion failed. Error: Invalid signature"}
+    assert "_auth_user_id" not in client.session
+
+
+def test_verify_passkey_assertion_requires_a_challenge(client, passkey_user):
+    response = client.post(
+        reverse("kagi:verify-passkey-assertion"),
+        {"credentials": passkey_assertion()},
+    )
+
+    assert response.status_code == 400
+    assert response.json() == {"fail": "No passkey assertion pending."}
+
+
+def test_login_page_offers_passkey_login(client):
+    response = client.get(reverse("kagi:login"))
+
+    assert response.status_code == 200
+    assert b'id="webauthn-passkey-form"' in response.content
@@ -0,0 +1,90 @@
+"""
+"Remember this device" cookies, which let a browser skip the second factor for
+``KAGI_TRUSTED_DEVICE_DAYS`` days after a successful verification.
+
+The cookie is signed, and names the user, a hash of their password and their
+trusted device generation. Checking it takes a signature verification and a
+cache lookup of the generation, but no database query. Incrementing the
+generation with ``revoke_trusted_devices()`` invalidates every cookie issued
+to the user. The generation starts at a random value, so that cookies issued
+before it was evicted from the cache are invalidated as well.
+"""
+
+import datetime
+
+from django.conf import settings as django_settings
+from django.core import signing
+from django.core.cache import caches
+from django.utils.crypto import constant_time_compare
+
+from . import settings
+from .utils.cache import bump_counter, get_counter
+
+SALT = "kagi.trusted_devices"
+
+
+def get_generation(user):
+    return get_counter(
+        caches[settings.KAGI_TRUSTED_DEVICE_CACHE],
+        f"kagi:trusted-device-generation:{user.pk}",
+    )
+
+
+def revoke_trusted_devices(user):
+    """
+    Makes every browser of ``user`` verify a second factor on its next login.
+    """
+    bump_counter(
+        caches[settings.KAGI_TRUSTED_DEVICE_CACHE],
+        f"kagi:trusted-device-generation:{user.pk}",
+    )
+
+
+def trust_device(response, user):
+    """
+    Sets the trusted device cookie of ``user`` on ``response``, when trusted
+    devices are enabled.
+    """
+    if not settings.KAGI_TRUSTED_DEVICE_DAYS:
+        return
+    value = signing.dumps(
+        {
+            "user": str(user.pk),
+            "hash": user.get_session_auth_hash(),
+            "generation": get_generation(user),
+        },
+        salt=SALT,
+    )
+    response.set_cookie(
+        settings.KAGI_TRUSTED_DEVICE_COOKIE_NAME,
+        value,
+        max_age=datetime.timedelta(days=settings.KAGI_TRUSTED_DEVICE_DAYS),
+        secure=django_settings.SESSION_COOKIE_SECURE,
+        httponly=True,
+        samesite="Lax",
+    )
+
+
+def is_trusted_device(request, user):
+    """
+    Returns whether ``request`` carries a valid trusted device cookie of
+    ``user``.
+    """
+    if not settings.KAGI_TRUSTED_DEVICE_DAYS:
+        return False
+    value = request.COOKIES.get(settings.KAGI_TRUSTED_DEVICE_COOKIE_NAME)
+    if value is None:
+        return False
+    try:
+        data = signing.loads(
+            value,
+            salt=SALT,
+            max_age=datetime.timedelta(days=settings.KAGI_TRUSTED_DEVICE_DAYS),
+        )
+    except signing.BadSignature:
+        return False
+    return (
+        data["user"] == str(user.pk)
+        and constant_time_compare(data["hash"], user.get_session_auth_hash())
+        and data["generation"] == get_generation(user)
+    )
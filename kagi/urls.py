@@ -1,7 +1,6 @@
 from django.urls import path
 
 from . import views
-from .views import api
 
 app_name = "kagi"
 
@@ -17,17 +16,31 @@ urlpatterns = [
     path("two-factor-settings/", views.two_factor_settings, name="two-factor-settings"),
     path("backup-codes/", views.backup_codes, name="backup-codes"),
     path("add-totp-device/", views.add_totp, name="add-totp"),
+    path("totp-qrcode/", views.totp_qrcode, name="totp-qrcode"),
     path("totp-devices/", views.totp_devices, name="totp-devices"),
-    path("api/begin-activate/", api.webauthn_begin_activate, name="begin-activate"),
+    path("add-hotp-device/", views.add_hotp, name="add-hotp"),
+    path("hotp-devices/", views.hotp_devices, name="hotp-devices"),
+    path("api/begin-activate/", views.begin_activate, name="begin-activate"),
     path(
         "api/verify-credential-info/",
-        api.webauthn_verify_credential_info,
+        views.verify_credential_info,
         name="verify-credential-info",
     ),
-    path("api/begin-assertion/", api.webauthn_begin_assertion, name="begin-assertion"),
+    path("api/begin-assertion/", views.begin_assertion, name="begin-assertion"),
     path(
         "api/verify-assertion/",
-        api.webauthn_verify_assertion,
+        views.verify_assertion,
         name="verify-assertion",
     ),
+    path(
+        "api/begin-passkey-assertion/",
+        views.begin_passkey_assertion,
+        name="begin-passkey-assertion",
+    ),
+    path(
+        "api/verify-passkey-assertion/",
+        views.verify_passkey_assertion,
+        name="verify-passkey-assertion",
+    ),
+    path("api/verify-token/", views.verify_token, name="verify-token"),
 ]
@@ -1,5 +1,13 @@
 from django.conf import settings
+from django.contrib import auth
 from django.contrib.auth import load_backend
+from django.shortcuts import resolve_url
+from django.utils.http import url_has_allowed_host_and_scheme
+
+from asgiref.sync import sync_to_async
+
+from ..forms import TOKEN_FORM_CLASSES
+from ..repositories import get_repository
 
 
 def get_origin(request):
@@ -18,3 +26,47 @@ def get_user(request):
         return user
     except (KeyError, AssertionError):  # pragma: no cover
         return None
+
+
+def get_enabled_second_factors(user):
+    """
+    Returns which second factors the user has set up, as a dictionary of
+    booleans keyed by factor type.
+    """
+    return get_repository().get_enabled_factors(user)
+
+
+def get_redirect_url(request):
+    redirect_to = request.POST.get(
+        auth.REDIRECT_FIELD_NAME, request.GET.get(auth.REDIRECT_FIELD_NAME, "")
+    )
+    if not url_has_allowed_host_and_scheme(
+        url=redirect_to, allowed_hosts=[request.get_host()]
+    ):
+        redirect_to = resolve_url(settings.LOGIN_REDIRECT_URL)
+    return redirect_to
+
+
+def verify_second_factor_token(request, user, factor_type, token):
+    """
+    Validates a TOTP or HOTP token or a backup code for the given user, building
+    only the form of the requested factor type.
+
+    Returns a ``(verified, errors)`` tuple.
+    """
+    try:
+        form_class = TOKEN_FORM_CLASSES[factor_type]
+    except KeyError:
+        return False, {"type": [f"Unsupported second factor type: {factor_type!r}"]}
+
+    form = form_class(
+        {form_class.token_field: token},
+        user=user,
+        request=request,
+        appId=get_origin(request),
+    )
+    verified = form.is_valid() and form.validate_second_factor()
+    return verified, form.errors
+
+
+averify_second_factor_token = sync_to_async(verify_second_factor_token)
@@ -0,0 +1,229 @@
+"""
+A software WebAuthn authenticator, producing the same payloads as the
+browser-side code in ``kagi/static/kagi/webauthn.js``.
+
+It is meant for tests, benchmarks and load tests: the private key lives in
+memory and nothing is kept secret.
+"""
+
+import hashlib
+import json
+import os
+import struct
+
+import cbor2
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, padding, rsa
+from webauthn.helpers import base64url_to_bytes, bytes_to_base64url
+
+# Authenticator data flags.
+USER_PRESENT = 0x01
+USER_VERIFIED = 0x04
+ATTESTED_CREDENTIAL_DATA = 0x40
+
+# Software authenticators have no certified model.
+AAGUID = bytes(16)
+
+
+def _int_to_bytes(value):
+    return value.to_bytes((value.bit_length() + 7) // 8, "big")
+
+
+class ES256:
+    cose_algorithm = -7
+
+    def generate_private_key(self):
+        return ec.generate_private_key(ec.SECP256R1())
+
+    def cose_public_key(self, public_key):
+        numbers = public_key.public_numbers()
+        return {
+            1: 2,  # kty: EC2
+            3: self.cose_algorithm,
+            -1: 1,  # crv: P-256
+            -2: numbers.x.to_bytes(32, "big"),
+            -3: numbers.y.to_bytes(32, "big"),
+        }
+
+    def sign(self, private_key, data):
+        return private_key.sign(data, ec.ECDSA(hashes.SHA256()))
+
+
+class RS256:
+    cose_algorithm = -257
+
+    def generate_private_key(self):
+        return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+    def cose_public_key(self, public_key):
+        numbers = public_key.public_numbers()
+        return {
+            1: 3,  # kty: RSA
+            3: self.cose_algorithm,
+            -1: _int_to_bytes(numbers.n),
+            -2: _int_to_bytes(numbers.e),
+        }
+
+    def sign(self, private_key, data):
+        return private_key.sign(data, padding.PKCS1v15(), hashes.SHA256())
+
+
+class EdDSA:
+    cose_algorithm = -8
+
+    def generate_private_key(self):
+        return ed25519.Ed25519PrivateKey.generate()
+
+    def cose_public_key(self, public_key):
+        return {
+            1: 1,  # kty: OKP
+            3: self.cose_algorithm,
+            -1: 6,  # crv: Ed25519
+            -2: public_key.public_bytes_raw(),
+        }
+
+    def sign(self, private_key, data):
+        return private_key.sign(data)
+
+
+ALGORITHMS = {"ES256": ES256(), "RS256": RS256(), "EdDSA": EdDSA()}
+
+
+class SoftwareAuthenticator:
+    """
+    Holds a single credential, creates it for the options returned by the
+    ``begin-activate`` view, and signs assertions for the options returned by
+    the ``begin-assertion`` and ``begin-passkey-assertion`` views.
+
+    >>> authenticator = SoftwareAuthenticator("EdDSA", user_handle=b"1")
+    >>> authenticator.sign_count
+    0
+    """
+
+    def __init__(
+        self,
+        algorithm="ES256",
+        *,
+        credential_id=None,
+        user_handle=None,
+        private_key=None,
+    ):
+        self.algorithm = ALGORITHMS[algorithm]
+        self.private_key = private_key or self.algorithm.generate_private_key()
+        self.credential_id = credential_id or os.urandom(16)
+        self.user_handle = user_handle
+        self.sign_count = 0
+
+    @property
+    def public_key(self):
+        """The COSE-encoded public key, as stored by WebAuthn relying parties."""
+        return cbor2.dumps(
+            self.algorithm.cose_public_key(self.private_key.public_key())
+        )
+
+    def get_authenticator_data(
+        self, rp_id, *, user_verified=False, attested_credential_data=b""
+    ):
+        self.sign_count += 1
+        flags = USER_PRESENT | (USER_VERIFIED if user_verified else 0)
+        if attested_credential_data:
+            flags |= ATTESTED_CREDENTIAL_DATA
+        return (
+            hashlib.sha256(rp_id.encode()).digest()
+            + bytes([flags])
+            + struct.pack(">I", self.sign_count)
+            + attested_credential_data
+        )
+
+    def get_client_data(self, ceremony, options, *, origin):
+        # NOTE: Like webauthn.js, we use the characters of the base64-encoded
+        # challenge as the challenge bytes.
+        challenge = options["challenge"].encode("ascii")
+        return json.dumps(
+            {
+                "type": ceremony,
+                "challenge": bytes_to_base64url(challenge),
+                "origin": origin,
+                "crossOrigin": False,
+            }
+        ).encode()
+
+    def make_credential(self, options, *, origin):
+        """
+        Returns the JSON-encoded credential for the given credential creation
+        options, with a ``none`` attestation, as posted to the
+        ``verify-credential-info`` view.
+        """
+        excluded = [
+            credential["id"] for credential in options.get("excludeCredentials", [])
+        ]
+        credential_id = bytes_to_base64url(self.credential_id)
+        if credential_id in excluded:
+            raise ValueError("The credential is excluded by the options.")
+        algorithms = [param["alg"] for param in options["pubKeyCredParams"]]
+        if self.algorithm.cose_algorithm not in algorithms:
+            raise ValueError("The algorithm is not supported by the options.")
+
+        self.user_handle = base64url_to_bytes(options["user"]["id"])
+        client_data = self.get_client_data("webauthn.create", options, origin=origin)
+        authenticator_data = self.get_authenticator_data(
+            options["rp"]["id"],
+            attested_credential_data=(
+                AAGUID
+                + struct.pack(">H", len(self.credential_id))
+                + self.credential_id
+                + self.public_key
+            ),
+        )
+        attestation_object = cbor2.dumps(
+            {"fmt": "none", "attStmt": {}, "authData": authenticator_data}
+        )
+        return json.dumps(
+            {
+                "id": credential_id,
+                "rawId": credential_id,
+                "response": {
+                    "attestationObject": bytes_to_base64url(attestation_object),
+                    "clientDataJSON": bytes_to_base64url(client_data),
+                },
+                "type": "public-key",
+            }
+        )
+
+    def get_assertion(self, options, *, origin, user_verified=False):
+        """
+        Returns the JSON-encoded assertion for the given assertion options, as
+        posted to the ``verify-assertion`` views.
+        """
+        allowed = [
+            credential["id"] for credential in options.get("allowCredentials", [])
+        ]
+        credential_id = bytes_to_base64url(self.credential_id)
+        if allowed and credential_id not in allowed:
+            raise ValueError("The credential is not allowed by the options.")
+
+        client_data = self.get_client_data("webauthn.get", options, origin=origin)
+        authenticator_data = self.get_authenticator_data(
+            options["rpId"], user_verified=user_verified
+        )
+        signature = self.algorithm.sign(
+            self.private_key,
+            authenticator_data + hashlib.sha256(client_data).digest(),
+        )
+        return json.dumps(
+            {
+                "id": credential_id,
+                "rawId": credential_id,
+                "response": {
+                    "authenticatorData": bytes_to_base64url(authenticator_data),
+                    "clientDataJSON": bytes_to_base64url(client_data),
+                    "signature": bytes_to_base64url(signature),
+                    "userHandle": (
+                        bytes_to_base64url(self.user_handle)
+                        if self.user_handle
+                        else None
+                    ),
+                },
+                "type": "public-key",
+            }
+        )
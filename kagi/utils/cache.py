@@ -0,0 +1,31 @@
+"""
+Counters kept in a Django cache, which version the values derived from them.
+
+A counter starts at a random value, so that values derived from it before it
+was evicted from the cache are not served again once it is recreated.
+"""
+
+import secrets
+
+
+def get_counter(cache, key):
+    """
+    Returns the value of the counter ``key``, starting it if needed.
+    """
+    value = cache.get(key)
+    if value is None:
+        cache.add(key, secrets.randbits(32), timeout=None)
+        value = cache.get(key)
+    return value
+
+
+def bump_counter(cache, key):
+    """
+    Increments the counter ``key``, when it exists.
+    """
+    try:
+        cache.incr(key)
+    except ValueError:
+        # A missing counter is started anew when it is read, which already
+        # invalidates the values derived from it.
+        pass
@@ -16,7 +16,11 @@ import base64
 import json
 
 import webauthn as pywebauthn
-from webauthn.helpers import base64url_to_bytes, generate_challenge
+from webauthn.helpers import (
+    base64url_to_bytes,
+    bytes_to_base64url,
+    generate_challenge,
+)
 from webauthn.helpers.exceptions import (
     InvalidAuthenticationResponse,
     InvalidRegistrationResponse,
@@ -29,9 +33,14 @@ from webauthn.helpers.structs import (
     AuthenticatorTransport,
     PublicKeyCredentialDescriptor,
     RegistrationCredential,
+    ResidentKeyRequirement,
     UserVerificationRequirement,
 )
 
+from .. import shared_cache
+from ..instrumentation import STAGE_FAILURE, stage
+from ..repositories import get_repository
+
 
 class AuthenticationRejectedError(Exception):
     pass
@@ -47,9 +56,13 @@ def _get_webauthn_user_public_key_credential_descriptors(user, *, rp_id):
     to the given user model, with properties suitable for
     usage within the webauthn API.
     """
+    credential_ids = shared_cache.get_or_set(
+        shared_cache.credential_ids_key(user.pk),
+        lambda: get_repository().get_credential_ids(user),
+    )
     return [
         PublicKeyCredentialDescriptor(
-            id=base64url_to_bytes(credential.credential_id),
+            id=base64url_to_bytes(credential_id),
             transports=[
                 AuthenticatorTransport.USB,
                 AuthenticatorTransport.NFC,
@@ -57,17 +70,18 @@ def _get_webauthn_user_public_key_credential_descriptors(user, *, rp_id):
                 AuthenticatorTransport.INTERNAL,
             ],
         )
-        for credential in user.webauthn_keys.all()
+        for credential_id in credential_ids
     ]
 
 
 def _get_webauthn_user_public_keys(user, *, rp_id):
     return [
         (
+            credential.credential_id,
             base64url_to_bytes(credential.public_key),
             credential.sign_count,
         )
-        for credential in user.webauthn_keys.all()
+        for credential in get_repository().get_webauthn_keys(user)
     ]
 
 
@@ -89,9 +103,15 @@ def get_credential_options(user, *, challenge, rp_name, rp_id):
     """
     Returns a dictionary of options for credential creation
     on the client side.
+
+    The user's existing credentials are excluded, so that authenticators
+    refuse to register the same key twice before any attestation is sent.
     """
     _authenticator_selection = AuthenticatorSelectionCriteria()
     _authenticator_selection.user_verification = UserVerificationRequirement.DISCOURAGED
+    # Ask for a discoverable credential when the authenticator supports it, so
+    # that the key can later be used for usernameless (passkey) logins.
+    _authenticator_selection.resident_key = ResidentKeyRequirement.PREFERRED
     options = pywebauthn.generate_registration_options(
         rp_id=rp_id,
         rp_name=rp_name,
@@ -101,6 +121,9 @@ def get_credential_options(user, *, challenge, rp_name, rp_id):
         challenge=challenge,
         attestation=AttestationConveyancePreference.NONE,
         authenticator_selection=_authenticator_selection,
+        exclude_credentials=_get_webauthn_user_public_key_credential_descriptors(
+            user, rp_id=rp_id
+        ),
     )
     return json.loads(options_to_json(options))
 
@@ -121,6 +144,20 @@ def get_assertion_options(user, *, challenge, rp_id):
     return json.loads(options_to_json(options))
 
 
+def get_passkey_assertion_options(*, challenge, rp_id):
+    """
+    Returns a dictionary of options for the retrieval of a discoverable
+    credential, letting the authenticator choose the account.
+    """
+    options = pywebauthn.generate_authentication_options(
+        rp_id=rp_id,
+        challenge=challenge,
+        allow_credentials=[],
+        user_verification=UserVerificationRequirement.REQUIRED,
+    )
+    return json.loads(options_to_json(options))
+
+
 def verify_registration_response(response, challenge, *, rp_id, origin):
     """
     Validates the challenge and attestation information
@@ -134,17 +171,20 @@ def verify_registration_response(response, challenge, *, rp_id, origin):
     # first for the entire clientData payload, and then again
     # for the individual challenge.
     encoded_challenge = _webauthn_b64encode(challenge)
-    try:
+    with stage("webauthn.registration.parse"):
         _credential = RegistrationCredential.parse_raw(response)
-        return pywebauthn.verify_registration_response(
-            credential=_credential,
-            expected_challenge=encoded_challenge,
-            expected_rp_id=rp_id,
-            expected_origin=origin,
-            require_user_verification=False,
-        )
-    except InvalidRegistrationResponse as e:
-        raise RegistrationRejectedError(str(e))
+    with stage("webauthn.registration.verify") as timing:
+        try:
+            return pywebauthn.verify_registration_response(
+                credential=_credential,
+                expected_challenge=encoded_challenge,
+                expected_rp_id=rp_id,
+                expected_origin=origin,
+                require_user_verification=False,
+            )
+        except InvalidRegistrationResponse as e:
+            timing.outcome = STAGE_FAILURE
+            raise RegistrationRejectedError(str(e))
 
 
 def verify_assertion_response(assertion, *, challenge, user, origin, rp_id):
@@ -152,6 +192,10 @@ def verify_assertion_response(assertion, *, challenge, user, origin, rp_id):
     Validates the challenge and assertion information
     sent from the client during authentication.
 
+    The signature is only checked against the user's key with the credential
+    ID of the assertion, so that the verified credential ID is the one of the
+    key whose signature was checked.
+
     Returns an updated signage count on success.
     Raises AuthenticationRejectedError on failure.
     """
@@ -160,23 +204,76 @@ def verify_assertion_response(assertion, *, challenge, user, origin, rp_id):
     # first for the entire clientData payload, and then again
     # for the individual challenge.
     encoded_challenge = _webauthn_b64encode(challenge)
-    webauthn_user_public_keys = _get_webauthn_user_public_keys(user, rp_id=rp_id)
+    with stage("webauthn.assertion.query_keys"):
+        webauthn_user_public_keys = _get_webauthn_user_public_keys(user, rp_id=rp_id)
 
-    for public_key, current_sign_count in webauthn_user_public_keys:
+    with stage("webauthn.assertion.parse"):
+        _credential = AuthenticationCredential.parse_raw(assertion)
+    credential_id = bytes_to_base64url(_credential.raw_id)
+    for key_id, public_key, current_sign_count in webauthn_user_public_keys:
+        if key_id != credential_id:
+            continue
+        with stage("webauthn.assertion.verify_signature") as timing:
+            try:
+                return pywebauthn.verify_authentication_response(
+                    credential=_credential,
+                    expected_challenge=encoded_challenge,
+                    expected_rp_id=rp_id,
+                    expected_origin=origin,
+                    credential_public_key=public_key,
+                    credential_current_sign_count=current_sign_count,
+                    require_user_verification=False,
+                )
+            except InvalidAuthenticationResponse:
+                timing.outcome = STAGE_FAILURE
+
+    # If we exit the loop, then we've failed to verify the assertion against
+    # any of the user's WebAuthn credentials. Fail.
+    raise AuthenticationRejectedError("Invalid WebAuthn credential")
+
+
+def parse_assertion(assertion):
+    """
+    Parses the assertion sent from the client, so that its credential ID and
+    user handle can be used to look up the matching WebAuthn key.
+
+    Returns an ``(AuthenticationCredential, user_handle)`` tuple.
+    Raises AuthenticationRejectedError on malformed assertions.
+    """
+    try:
+        with stage("webauthn.passkey.parse"):
+            credential = AuthenticationCredential.parse_raw(assertion)
+        # NOTE: We decode the user handle ourselves, because depending on its
+        # version, the webauthn package leaves optional fields base64-encoded.
+        user_handle = json.loads(assertion)["response"].get("userHandle")
+        if user_handle is not None:
+            user_handle = base64url_to_bytes(user_handle)
+    except (ValueError, TypeError):
+        raise AuthenticationRejectedError("Malformed WebAuthn assertion")
+    return credential, user_handle
+
+
+def verify_passkey_assertion_response(credential, *, challenge, key, origin, rp_id):
+    """
+    Validates a parsed discoverable credential assertion against the single
+    WebAuthn key it claims to come from. User verification is required, since
+    the assertion replaces both the password and the second factor.
+
+    Returns an updated signage count on success.
+    Raises AuthenticationRejectedError on failure.
+    """
+    encoded_challenge = _webauthn_b64encode(challenge)
+    with stage("webauthn.passkey.verify_signature") as timing:
         try:
-            _credential = AuthenticationCredential.parse_raw(assertion)
             return pywebauthn.verify_authentication_response(
-                credential=_credential,
+                credential=credential,
                 expected_challenge=encoded_challenge,
                 expected_rp_id=rp_id,
                 expected_origin=origin,
-                credential_public_key=public_key,
-                credential_current_sign_count=current_sign_count,
-                require_user_verification=False,
+                credential_public_key=base64url_to_bytes(key.public_key),
+                credential_current_sign_count=key.sign_count,
+                require_user_verification=True,
             )
-        except InvalidAuthenticationResponse:
-            pass
-
-    # If we exit the loop, then we've failed to verify the assertion against
-    # any of the user's WebAuthn credentials. Fail.
-    raise AuthenticationRejectedError("Invalid WebAuthn credential")
+        except InvalidAuthenticationResponse as e:
+            timing.outcome = STAGE_FAILURE
+            raise AuthenticationRejectedError(str(e))
@@ -1,22 +1,74 @@
+from django.contrib import messages
 from django.contrib.auth.decorators import login_required
+from django.http import Http404, HttpResponse, HttpResponseRedirect
+from django.urls import reverse
+from django.utils.module_loading import import_string
+from django.utils.translation import gettext as _
+from django.views.decorators.csrf import csrf_exempt
 from django.views.generic import TemplateView
 
+from .. import instrumentation, settings
+from ..trusted_devices import revoke_trusted_devices
+from ..utils import get_enabled_second_factors
 from .backup_codes import BackupCodesView
+from .hotp_devices import AddHOTPDeviceView, HOTPDeviceManagementView
 from .login import KagiLoginView, VerifySecondFactorView
-from .totp_devices import AddTOTPDeviceView, TOTPDeviceManagementView
+from .totp_devices import AddTOTPDeviceView, TOTPDeviceManagementView, TOTPQRCodeView
 from .webauthn_keys import AddWebAuthnKeyView, KeyManagementView
 
 
+def lazy_view(dotted_path):
+    """
+    Returns a view that imports the view at ``dotted_path`` when first called.
+
+    The WebAuthn API views depend on the webauthn package and its cryptography
+    backends, which processes that never serve those views should not load.
+    Decorators checked before the view is called, such as ``csrf_exempt``,
+    must be applied to the returned view.
+    """
+    view = None
+
+    def wrapper(request, *args, **kwargs):
+        nonlocal view
+        if view is None:
+            view = import_string(dotted_path)
+        return view(request, *args, **kwargs)
+
+    return wrapper
+
+
 class TwoFactorSettingsView(TemplateView):
     template_name = "kagi/two_factor_settings.html"
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["webauthn_enabled"] = self.request.user.webauthn_keys.exists()
+        factors = get_enabled_second_factors(self.request.user)
+        context["webauthn_enabled"] = factors["webauthn"]
         context["backup_codes_count"] = self.request.user.backup_codes.count()
-        context["totp_enabled"] = self.request.user.totp_devices.exists()
+        context["totp_enabled"] = factors["totp"]
+        context["hotp_enabled"] = factors["hotp"]
+        context["trusted_device_days"] = settings.KAGI_TRUSTED_DEVICE_DAYS
         return context
 
+    def post(self, request):
+        assert "forget_devices" in request.POST
+        revoke_trusted_devices(request.user)
+        messages.success(request, _("Trusted devices forgotten."))
+        return HttpResponseRedirect(reverse("kagi:two-factor-settings"))
+
+
+def metrics(request):
+    """
+    Exposes the stage timings aggregated by ``PrometheusSink``, when it is the
+    configured instrumentation sink. This view is not part of ``kagi.urls``.
+    """
+    sink = instrumentation.get_sink()
+    if not isinstance(sink, instrumentation.PrometheusSink):
+        raise Http404("Metrics are not enabled.")
+    return HttpResponse(
+        sink.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
 
 add_webauthn_key = AddWebAuthnKeyView.as_view()
 verify_second_factor = VerifySecondFactorView.as_view()
@@ -25,4 +77,19 @@ keys = login_required(KeyManagementView.as_view())
 two_factor_settings = login_required(TwoFactorSettingsView.as_view())
 backup_codes = login_required(BackupCodesView.as_view())
 add_totp = login_required(AddTOTPDeviceView.as_view())
+totp_qrcode = login_required(TOTPQRCodeView.as_view())
 totp_devices = login_required(TOTPDeviceManagementView.as_view())
+add_hotp = login_required(AddHOTPDeviceView.as_view())
+hotp_devices = login_required(HOTPDeviceManagementView.as_view())
+
+begin_activate = lazy_view("kagi.views.api.webauthn_begin_activate")
+verify_credential_info = csrf_exempt(
+    lazy_view("kagi.views.api.webauthn_verify_credential_info")
+)
+begin_assertion = lazy_view("kagi.views.api.webauthn_begin_assertion")
+verify_assertion = csrf_exempt(lazy_view("kagi.views.api.webauthn_verify_assertion"))
+begin_passkey_assertion = lazy_view("kagi.views.api.webauthn_begin_passkey_assertion")
+verify_passkey_assertion = csrf_exempt(
+    lazy_view("kagi.views.api.webauthn_verify_passkey_assertion")
+)
+verify_token = csrf_exempt(lazy_view("kagi.views.api.verify_token"))
@@ -1,18 +1,23 @@
+import json
+
 from django.conf import settings as django_settings
 from django.contrib import auth
 from django.contrib.auth.decorators import login_required
 from django.http import JsonResponse
-from django.shortcuts import resolve_url
-from django.utils.http import url_has_allowed_host_and_scheme
-from django.utils.timezone import now
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 
 from webauthn.helpers import base64url_to_bytes, bytes_to_base64url
 
-from .. import settings, utils
+from .. import utils
+from ..events import record_event
 from ..forms import KeyRegistrationForm
-from ..models import WebAuthnKey
+from ..instrumentation import STAGE_FAILURE, stage
+from ..models import AuthEvent, WebAuthnKey
+from ..ratelimit import limit_attempts
+from ..relying_party import get_relying_party
+from ..repositories import get_repository
+from ..trusted_devices import trust_device
 from ..utils import webauthn
 
 # Registration
@@ -25,11 +30,12 @@ def webauthn_begin_activate(request):
 
     request.session["challenge"] = bytes_to_base64url(challenge)
 
+    relying_party = get_relying_party(request)
     credential_options = webauthn.get_credential_options(
         request.user,
         challenge=challenge,
-        rp_name=settings.RELYING_PARTY_NAME,
-        rp_id=settings.RELYING_PARTY_ID,
+        rp_name=relying_party.name,
+        rp_id=relying_party.id,
     )
 
     return JsonResponse(credential_options)
@@ -39,7 +45,8 @@ def webauthn_begin_activate(request):
 @csrf_exempt
 @require_http_methods(["POST"])
 def webauthn_verify_credential_info(request):
-    challenge = base64url_to_bytes(request.session["challenge"])
+    with stage("session.load"):
+        challenge = base64url_to_bytes(request.session["challenge"])
     credentials = request.POST["credentials"]
 
     form = KeyRegistrationForm(request.POST)
@@ -48,13 +55,21 @@ def webauthn_verify_credential_info(request):
         return JsonResponse({"errors": form.errors}, status=400)
 
     try:
+        relying_party = get_relying_party(request)
         webauthn_registration_response = webauthn.verify_registration_response(
             credentials,
-            rp_id=settings.RELYING_PARTY_ID,
-            origin=utils.get_origin(request),
+            rp_id=relying_party.id,
+            origin=list(relying_party.origins),
             challenge=challenge,
         )
     except webauthn.RegistrationRejectedError as e:
+        record_event(
+            request,
+            request.user,
+            "webauthn",
+            succeeded=False,
+            action=AuthEvent.REGISTER,
+        )
         return JsonResponse({"fail": f"Registration failed. Error: {e}"}, status=400)
 
     # W3C spec. Step 17.
@@ -64,20 +79,35 @@ def webauthn_verify_credential_info(request):
     # to a different user, the Relying Party SHOULD fail this registration
     # ceremony, or it MAY decide to accept the registration, e.g. while deleting
     # the older registration.
-    credential_id_exists = WebAuthnKey.objects.filter(
-        credential_id=bytes_to_base64url(webauthn_registration_response.credential_id)
-    ).first()
-    if credential_id_exists:
-        return JsonResponse({"fail": "Credential ID already exists."}, status=400)
-
-    WebAuthnKey.objects.create(
-        user=request.user,
-        key_name=form.cleaned_data["key_name"],
-        public_key=bytes_to_base64url(
-            webauthn_registration_response.credential_public_key
-        ),
-        credential_id=bytes_to_base64url(webauthn_registration_response.credential_id),
-        sign_count=webauthn_registration_response.sign_count,
+    with stage("webauthn.registration.create_key") as timing:
+        credential_id_exists = WebAuthnKey.objects.filter(
+            credential_id=bytes_to_base64url(
+                webauthn_registration_response.credential_id
+            )
+        ).first()
+        if credential_id_exists:
+            timing.outcome = STAGE_FAILURE
+            return JsonResponse({"fail": "Credential ID already exists."}, status=400)
+
+        key = WebAuthnKey.objects.create(
+            user=request.user,
+            key_name=form.cleaned_data["key_name"],
+            public_key=bytes_to_base64url(
+                webauthn_registration_response.credential_public_key
+            ),
+            credential_id=bytes_to_base64url(
+                webauthn_registration_response.credential_id
+            ),
+            sign_count=webauthn_registration_response.sign_count,
+        )
+
+    record_event(
+        request,
+        request.user,
+        "webauthn",
+        succeeded=True,
+        factor_id=key.pk,
+        action=AuthEvent.REGISTER,
     )
 
     try:
@@ -98,7 +128,7 @@ def webauthn_begin_assertion(request):
     user = utils.get_user(request)
 
     webauthn_assertion_options = webauthn.get_assertion_options(
-        user, challenge=challenge, rp_id=settings.RELYING_PARTY_ID
+        user, challenge=challenge, rp_id=get_relying_party(request).id
     )
 
     return JsonResponse(webauthn_assertion_options)
@@ -106,29 +136,45 @@ def webauthn_begin_assertion(request):
 
 @csrf_exempt
 @require_http_methods(["POST"])
+@limit_attempts
 def webauthn_verify_assertion(request):
-    challenge = base64url_to_bytes(request.session.get("challenge"))
+    with stage("session.load"):
+        challenge = base64url_to_bytes(request.session.get("challenge"))
 
-    user = utils.get_user(request)
+    with stage("session.user_lookup"):
+        user = utils.get_user(request)
 
+    repository = get_repository()
+    relying_party = get_relying_party(request)
     try:
         webauthn_assertion_response = webauthn.verify_assertion_response(
             request.POST["credentials"],
             challenge=challenge,
             user=user,
-            origin=utils.get_origin(request),
-            rp_id=settings.RELYING_PARTY_ID,
+            origin=list(relying_party.origins),
+            rp_id=relying_party.id,
         )
+
+        # Update counter.
+        with stage("webauthn.assertion.update_key"):
+            key = repository.get_webauthn_key(
+                bytes_to_base64url(webauthn_assertion_response.credential_id),
+                user=user,
+            )
+            if key is None:
+                raise webauthn.AuthenticationRejectedError(
+                    "Unknown WebAuthn credential"
+                )
+            updated = repository.update_sign_count(
+                key, webauthn_assertion_response.new_sign_count
+            )
+        if not updated:
+            raise webauthn.AuthenticationRejectedError("Concurrent use of the key")
     except webauthn.AuthenticationRejectedError as e:
+        record_event(request, user, "webauthn", succeeded=False)
         return JsonResponse({"fail": f"Assertion failed. Error: {e}"}, status=400)
 
-    # Update counter.
-    key = user.webauthn_keys.get(
-        credential_id=bytes_to_base64url(webauthn_assertion_response.credential_id)
-    )
-    key.sign_count = webauthn_assertion_response.new_sign_count
-    key.last_used_at = now()
-    key.save()
+    record_event(request, user, "webauthn", succeeded=True, factor_id=key.pk)
 
     try:
         del request.session["kagi_pre_verify_user_pk"]
@@ -139,17 +185,142 @@ def webauthn_verify_assertion(request):
 
     auth.login(request, user)
 
-    redirect_to = request.POST.get(
-        auth.REDIRECT_FIELD_NAME, request.GET.get(auth.REDIRECT_FIELD_NAME, "")
+    response = JsonResponse(
+        {
+            "success": f"Successfully authenticated as {user.get_username()}",
+            "redirect_to": utils.get_redirect_url(request),
+        }
+    )
+    if request.POST.get("remember_device"):
+        trust_device(response, user)
+    return response
+
+
+# Passkey login
+@require_http_methods(["GET"])
+def webauthn_begin_passkey_assertion(request):
+    challenge = webauthn.generate_webauthn_challenge()
+    request.session["passkey_challenge"] = bytes_to_base64url(challenge)
+
+    webauthn_assertion_options = webauthn.get_passkey_assertion_options(
+        challenge=challenge, rp_id=get_relying_party(request).id
     )
-    if not url_has_allowed_host_and_scheme(
-        url=redirect_to, allowed_hosts=[request.get_host()]
-    ):
-        redirect_to = resolve_url(django_settings.LOGIN_REDIRECT_URL)
+
+    return JsonResponse(webauthn_assertion_options)
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+@limit_attempts
+def webauthn_verify_passkey_assertion(request):
+    with stage("session.load"):
+        challenge = request.session.get("passkey_challenge")
+    if challenge is None:
+        return JsonResponse({"fail": "No passkey assertion pending."}, status=400)
+
+    repository = get_repository()
+    relying_party = get_relying_party(request)
+    user = None
+    try:
+        credential, user_handle = webauthn.parse_assertion(request.POST["credentials"])
+        # The credential ID is unique, so this resolves the user from a
+        # single indexed lookup instead of a password check.
+        with stage("webauthn.passkey.query_key"):
+            key = repository.get_webauthn_key(bytes_to_base64url(credential.raw_id))
+        if key is None:
+            record_event(request, None, "passkey", succeeded=False)
+            return JsonResponse(
+                {"fail": "Assertion failed. Error: Unknown WebAuthn credential"},
+                status=400,
+            )
+        user = key.user
+        if user_handle is None or user_handle != str(user.pk).encode():
+            raise webauthn.AuthenticationRejectedError("Invalid user handle")
+        if not user.is_active:
+            raise webauthn.AuthenticationRejectedError("Inactive user")
+
+        webauthn_assertion_response = webauthn.verify_passkey_assertion_response(
+            credential,
+            challenge=base64url_to_bytes(challenge),
+            key=key,
+            origin=list(relying_party.origins),
+            rp_id=relying_party.id,
+        )
+
+        # Update counter.
+        with stage("webauthn.passkey.update_key"):
+            updated = repository.update_sign_count(
+                key, webauthn_assertion_response.new_sign_count
+            )
+        if not updated:
+            raise webauthn.AuthenticationRejectedError("Concurrent use of the key")
+    except webauthn.AuthenticationRejectedError as e:
+        record_event(request, user, "passkey", succeeded=False)
+        return JsonResponse({"fail": f"Assertion failed. Error: {e}"}, status=400)
+
+    record_event(request, user, "passkey", succeeded=True, factor_id=key.pk)
+
+    del request.session["passkey_challenge"]
+
+    auth.login(request, user, backend=django_settings.AUTHENTICATION_BACKENDS[0])
 
     return JsonResponse(
         {
             "success": f"Successfully authenticated as {user.get_username()}",
-            "redirect_to": redirect_to,
+            "redirect_to": utils.get_redirect_url(request),
+        }
+    )
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+@limit_attempts
+def verify_token(request):
+    """
+    Verifies a TOTP token or a backup code sent as ``{"type": ..., "token": ...}``,
+    either JSON-encoded or form-encoded, and answers with a compact JSON result.
+    """
+    if request.content_type == "application/json":
+        try:
+            data = json.loads(request.body)
+            factor_type, token = data["type"], data["token"]
+            remember_device = data.get("remember_device", False)
+            if not isinstance(factor_type, str) or not isinstance(token, str):
+                raise TypeError
+        except (ValueError, KeyError, TypeError):
+            return JsonResponse({"fail": "Invalid request payload."}, status=400)
+    else:
+        factor_type = request.POST.get("type")
+        token = request.POST.get("token")
+        remember_device = request.POST.get("remember_device")
+
+    with stage("session.user_lookup"):
+        user = utils.get_user(request)
+    if user is None:
+        return JsonResponse(
+            {"fail": "No second factor verification pending."}, status=400
+        )
+
+    verified, errors = utils.verify_second_factor_token(
+        request, user, factor_type, token
+    )
+    record_event(request, user, factor_type, succeeded=verified)
+    if not verified:
+        return JsonResponse(
+            {"fail": "Verification failed.", "errors": errors}, status=400
+        )
+
+    del request.session["kagi_pre_verify_user_pk"]
+    del request.session["kagi_pre_verify_user_backend"]
+
+    auth.login(request, user)
+
+    response = JsonResponse(
+        {
+            "success": f"Successfully authenticated as {user.get_username()}",
+            "redirect_to": utils.get_redirect_url(request),
         }
     )
+    if remember_device:
+        trust_device(response, user)
+    return response
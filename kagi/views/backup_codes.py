@@ -1,11 +1,17 @@
 from django.http import HttpResponseRedirect
 from django.views.generic import ListView
 
+from .mixin import FactorListMixin
 
-class BackupCodesView(ListView):
+
+class BackupCodesView(FactorListMixin, ListView):
     template_name = "kagi/backup_codes.html"
+    rows_template_name = "kagi/backup_code_rows.html"
+    fields = ["code"]
+    # Backup codes are secrets, which are not copied to the cache.
+    cache_rows = False
 
-    def get_queryset(self):
+    def get_factors(self):
         return self.request.user.backup_codes.all()
 
     def post(self, request):
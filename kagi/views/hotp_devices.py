@@ -0,0 +1,64 @@
+from django.contrib import messages
+from django.http import HttpResponseRedirect
+from django.shortcuts import get_object_or_404
+from django.urls import reverse, reverse_lazy
+from django.utils.translation import gettext as _
+from django.views.generic import FormView, ListView
+
+from ..events import record_event
+from ..forms import HOTPDeviceForm, HOTPForm
+from ..models import AuthEvent, HOTPDevice
+from ..trusted_devices import revoke_trusted_devices
+from .mixin import FactorListMixin
+
+
+class AddHOTPDeviceView(FormView):
+    form_class = HOTPDeviceForm
+    template_name = "kagi/hotp_device.html"
+    success_url = reverse_lazy("kagi:hotp-devices")
+
+    def form_valid(self, form):
+        device = HOTPDevice(user=self.request.user, name=form.cleaned_data["name"])
+        device.set_secret(form.cleaned_data["secret"])
+        # A token that was pressed a few times already is found within the
+        # look-ahead window, which sets the counter of the new device.
+        if device.validate_token(form.cleaned_data["token"]):
+            device.save()
+            record_event(
+                self.request,
+                self.request.user,
+                "hotp",
+                succeeded=True,
+                factor_id=device.pk,
+                action=AuthEvent.REGISTER,
+            )
+            messages.success(self.request, _("Device added."))
+            return super().form_valid(form)
+        record_event(
+            self.request,
+            self.request.user,
+            "hotp",
+            succeeded=False,
+            action=AuthEvent.REGISTER,
+        )
+        form.add_error("token", HOTPForm.INVALID_ERROR_MESSAGE)
+        return self.form_invalid(form)
+
+
+class HOTPDeviceManagementView(FactorListMixin, ListView):
+    template_name = "kagi/hotpdevice_list.html"
+    rows_template_name = "kagi/hotpdevice_rows.html"
+    fields = ["name", "created_at", "last_used_at"]
+
+    def get_factors(self):
+        return self.request.user.hotp_devices.all()
+
+    def post(self, request):
+        assert "delete" in self.request.POST
+        device = get_object_or_404(
+            self.get_factors(), pk=self.request.POST["device_id"]
+        )
+        device.delete()
+        revoke_trusted_devices(request.user)
+        messages.success(request, _("Device removed."))
+        return HttpResponseRedirect(reverse("kagi:hotp-devices"))
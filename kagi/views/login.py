@@ -3,13 +3,20 @@ from django.contrib import auth
 from django.contrib.auth import load_backend
 from django.contrib.auth.forms import AuthenticationForm
 from django.contrib.auth.views import LoginView
-from django.http import HttpResponseRedirect
+from django.http import HttpResponse, HttpResponseRedirect
 from django.shortcuts import resolve_url
 from django.urls import reverse
+from django.utils.functional import cached_property
 from django.utils.http import url_has_allowed_host_and_scheme, urlencode
 from django.views.generic import TemplateView
 
-from ..forms import BackupCodeForm, SecondFactorForm, TOTPForm
+from .. import settings as kagi_settings
+from ..events import record_event
+from ..forms import BackupCodeForm, HOTPForm, SecondFactorForm, TOTPForm
+from ..ratelimit import check_attempt
+from ..relying_party import get_relying_party
+from ..trusted_devices import is_trusted_device, trust_device
+from ..utils import get_enabled_second_factors
 from .mixin import OriginMixin
 
 
@@ -22,10 +29,14 @@ class KagiLoginView(LoginView):
         return self.template_name == "admin/login.html"
 
     def requires_two_factor(self, user):
-        return user.webauthn_keys.exists() or user.totp_devices.exists()
+        factors = get_enabled_second_factors(user)
+        return factors["webauthn"] or factors["totp"] or factors["hotp"]
 
     def form_valid(self, form):
         user = form.get_user()
+        if is_trusted_device(self.request, user):
+            record_event(self.request, user, "trusted_device", succeeded=True)
+            return super().form_valid(form)
         if not self.requires_two_factor(user):
             # no keys registered, use single-factor auth
             return super().form_valid(form)
@@ -64,15 +75,18 @@ class KagiLoginView(LoginView):
 class VerifySecondFactorView(OriginMixin, TemplateView):
     template_name = "kagi/verify_second_factor.html"
 
-    @property
+    @cached_property
     def form_classes(self):
+        factors = get_enabled_second_factors(self.user)
         ret = {}
-        if self.user.webauthn_keys.exists():
+        if factors["webauthn"]:
             ret["webauthn"] = SecondFactorForm
-        if self.user.backup_codes.exists():
+        if factors["backup"]:
             ret["backup"] = BackupCodeForm
-        if self.user.totp_devices.exists():
+        if factors["totp"]:
             ret["totp"] = TOTPForm
+        if factors["hotp"]:
+            ret["hotp"] = HOTPForm
 
         return ret
 
@@ -90,6 +104,16 @@ class VerifySecondFactorView(OriginMixin, TemplateView):
             return None
 
     def dispatch(self, request, *args, **kwargs):
+        if request.method == "POST":
+            retry_after = check_attempt(request)
+            if retry_after is not None:
+                response = HttpResponse(
+                    "Too many attempts. Try again later.",
+                    content_type="text/plain",
+                    status=429,
+                )
+                response["Retry-After"] = str(retry_after)
+                return response
         self.user = self.get_user()
         if self.user is None:
             return HttpResponseRedirect(reverse("kagi:login"))
@@ -104,6 +128,9 @@ class VerifySecondFactorView(OriginMixin, TemplateView):
             return self.form_invalid(forms)
 
     def form_invalid(self, forms):
+        record_event(
+            self.request, self.user, self.request.POST["type"], succeeded=False
+        )
         return self.render_to_response(self.get_context_data(forms=forms))
 
     def get_form_kwargs(self):
@@ -132,9 +159,38 @@ class VerifySecondFactorView(OriginMixin, TemplateView):
         else:
             kwargs["base_template"] = "base.html"
         kwargs["user"] = self.user
+        kwargs["trusted_device_days"] = kagi_settings.KAGI_TRUSTED_DEVICE_DAYS
+        if "webauthn" in kwargs["forms"]:
+            kwargs["assertion_options"] = self.get_assertion_options()
         return kwargs
 
+    def get_assertion_options(self):
+        # Embedding the assertion options in the page saves the browser a
+        # round trip to the begin-assertion endpoint before it can prompt for
+        # the security key.
+        # The webauthn package is imported here, so that processes which only
+        # serve the login page do not have to load it.
+        from webauthn.helpers import bytes_to_base64url
+
+        from ..utils import webauthn
+
+        challenge = webauthn.generate_webauthn_challenge()
+        self.request.session["challenge"] = bytes_to_base64url(challenge)
+        return webauthn.get_assertion_options(
+            self.user,
+            challenge=challenge,
+            rp_id=get_relying_party(self.request).id,
+        )
+
     def form_valid(self, form, forms):
+        device = getattr(form, "device", None)
+        record_event(
+            self.request,
+            self.user,
+            self.request.POST["type"],
+            succeeded=True,
+            factor_id=device.pk if device else None,
+        )
         del self.request.session["kagi_pre_verify_user_pk"]
         del self.request.session["kagi_pre_verify_user_backend"]
 
@@ -147,4 +203,7 @@ class VerifySecondFactorView(OriginMixin, TemplateView):
             url=redirect_to, allowed_hosts=[self.request.get_host()]
         ):
             redirect_to = resolve_url(settings.LOGIN_REDIRECT_URL)
-        return HttpResponseRedirect(redirect_to)
+        response = HttpResponseRedirect(redirect_to)
+        if self.request.POST.get("remember_device"):
+            trust_device(response, self.user)
+        return response
@@ -1,5 +1,71 @@
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.http import urlencode
+from django.utils.translation import get_language
+
+from .. import fragments, settings
+
+
 class OriginMixin:
     def get_origin(self):
         return "{scheme}://{host}".format(
             scheme=self.request.scheme, host=self.request.get_host()
         )
+
+
+class FactorListMixin:
+    """
+    Lists the factors returned by ``get_factors()``, ``KAGI_FACTOR_PAGE_SIZE``
+    at a time, loading only ``fields``. The rows are rendered with
+    ``rows_template_name``, and cached with ``kagi.fragments`` when
+    ``cache_rows`` is set.
+
+    Pages start after the primary key given in the ``after`` parameter rather
+    than at an offset, so that each page is read from an index range.
+    """
+
+    fields = []
+    rows_template_name = None
+    cache_rows = True
+
+    def get_factors(self):
+        raise NotImplementedError
+
+    def get_after(self):
+        after = self.request.GET.get("after", "")
+        return int(after) if after.isdigit() else None
+
+    def get_queryset(self):
+        # Related managers set the user of each row, which reads its user_id.
+        queryset = self.get_factors().only("user", *self.fields).order_by("pk")
+        after = self.get_after()
+        if after is not None:
+            queryset = queryset.filter(pk__gt=after)
+        # One more row tells whether there is a next page.
+        return queryset[: settings.KAGI_FACTOR_PAGE_SIZE + 1]
+
+    def render_rows(self):
+        rows = list(self.object_list)
+        page = rows[: settings.KAGI_FACTOR_PAGE_SIZE]
+        next_after = page[-1].pk if len(rows) > len(page) else None
+        html = render_to_string(self.rows_template_name, {"object_list": page})
+        return html, next_after
+
+    def get_context_data(self, **kwargs):
+        after = self.get_after()
+        if self.cache_rows:
+            # Rendered dates depend on the language and time zone.
+            parts = [after, get_language(), timezone.get_current_timezone_name()]
+            rows, next_after = fragments.get_or_render(
+                self.rows_template_name, self.request.user, parts, self.render_rows
+            )
+        else:
+            rows, next_after = self.render_rows()
+        kwargs["rows"] = rows
+        kwargs["first_page_url"] = self.request.path if after is not None else None
+        kwargs["next_page_url"] = (
+            f"{self.request.path}?{urlencode({'after': next_after})}"
+            if next_after is not None
+            else None
+        )
+        return super().get_context_data(**kwargs)
@@ -1,25 +1,69 @@
 from base64 import b32decode, b32encode
 from collections import OrderedDict
+from functools import lru_cache
+import hashlib
 from io import BytesIO
 import os
 from urllib.parse import quote
+import warnings
 
 from django.contrib import messages
 from django.contrib.sites.shortcuts import get_current_site
-from django.http import HttpResponseRedirect
+from django.http import Http404, HttpResponse, HttpResponseRedirect
 from django.shortcuts import get_object_or_404, redirect
 from django.urls import reverse, reverse_lazy
-from django.utils.http import url_has_allowed_host_and_scheme, urlencode
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag, url_has_allowed_host_and_scheme, urlencode
+from django.utils.module_loading import import_string
 from django.utils.translation import gettext as _
-from django.views.generic import FormView, ListView
-
-import qrcode
-from qrcode.image.svg import SvgPathFillImage
+from django.views.generic import FormView, ListView, View
 
+from .. import settings
 from ..constants import SESSION_TOTP_SECRET_KEY
+from ..events import record_event
 from ..forms import TOTPForm
-from ..models import TOTPDevice
-from .mixin import OriginMixin
+from ..models import AuthEvent, TOTPDevice
+from ..trusted_devices import revoke_trusted_devices
+from .mixin import FactorListMixin, OriginMixin
+
+QRCODE_FORMATS = {
+    "svg": ("image/svg+xml", "qrcode.image.svg.SvgPathFillImage"),
+    "png": ("image/png", "qrcode.image.pure.PyPNGImage"),
+}
+
+
+@lru_cache(maxsize=settings.KAGI_TOTP_QRCODE_CACHE_SIZE)
+def render_qrcode(data, image_format="svg"):
+    """
+    Renders the QR code of the given data as an SVG or PNG image.
+
+    Rendering takes several milliseconds, and the same secret is displayed
+    again whenever a token is mistyped, so the most recent images are kept.
+    """
+    # qrcode is only needed by this view, so it is not imported with the module.
+    import qrcode
+
+    image_factory = import_string(QRCODE_FORMATS[image_format][1])
+    img = qrcode.make(data, image_factory=image_factory)
+    buf = BytesIO()
+    img.save(buf)
+    return buf.getvalue()
+
+
+def get_otpauth_url(request, secret):
+    issuer = get_current_site(request).name
+
+    params = OrderedDict([("secret", secret), ("digits", 6), ("issuer", issuer)])
+
+    return "otpauth://totp/{issuer}:{username}?{params}".format(
+        issuer=quote(issuer),
+        username=quote(request.user.get_username()),
+        params=urlencode(params),
+    )
+
+
+def get_qrcode_version(otpauth):
+    return hashlib.sha256(otpauth.encode()).hexdigest()[:16]
 
 
 class AddTOTPDeviceView(OriginMixin, FormView):
@@ -54,27 +98,31 @@ class AddTOTPDeviceView(OriginMixin, FormView):
         return b32encode(os.urandom(20)).decode()
 
     def get_otpauth_url(self, secret):
-        issuer = get_current_site(self.request).name
-
-        params = OrderedDict([("secret", secret), ("digits", 6), ("issuer", issuer)])
-
-        return "otpauth://totp/{issuer}:{username}?{params}".format(
-            issuer=quote(issuer),
-            username=quote(self.request.user.get_username()),
-            params=urlencode(params),
-        )
+        return get_otpauth_url(self.request, secret)
 
     def get_qrcode(self, data):
-        img = qrcode.make(data, image_factory=SvgPathFillImage)
-        buf = BytesIO()
-        img.save(buf)
-        return buf.getvalue().decode("utf-8")
+        warnings.warn(
+            "AddTOTPDeviceView.get_qrcode() and the qr_svg template variable are "
+            "deprecated, link to the qr_url image instead.",
+            DeprecationWarning,
+            stacklevel=2,
+        )
+        return render_qrcode(data).decode()
 
     def get_context_data(self, **kwargs):
         kwargs = super().get_context_data(**kwargs)
         kwargs["base32_key"] = self.secret
         kwargs["otpauth"] = self.get_otpauth_url(self.secret)
-        kwargs["qr_svg"] = self.get_qrcode(kwargs["otpauth"])
+        # The QR code is served separately, so that re-rendering this page
+        # after a mistyped token does not render it again. The version changes
+        # along with the secret, which lets browsers cache the image.
+        kwargs["qr_url"] = "{url}?{params}".format(
+            url=reverse("kagi:totp-qrcode"),
+            params=urlencode({"v": get_qrcode_version(kwargs["otpauth"])}),
+        )
+        # Templates are handed a callable, so that the inline SVG of templates
+        # still using it is only rendered for them.
+        kwargs["qr_svg"] = lambda: self.get_qrcode(kwargs["otpauth"])
         return kwargs
 
     def get_form_kwargs(self):
@@ -85,14 +133,30 @@ class AddTOTPDeviceView(OriginMixin, FormView):
         return kwargs
 
     def form_valid(self, form):
-        device = TOTPDevice(user=self.request.user, key=b32decode(self.secret))
+        device = TOTPDevice(user=self.request.user)
+        device.set_secret(b32decode(self.secret))
         if device.validate_token(form.cleaned_data["token"]):
             del self.request.session[SESSION_TOTP_SECRET_KEY]
             device.save()
+            record_event(
+                self.request,
+                self.request.user,
+                "totp",
+                succeeded=True,
+                factor_id=device.pk,
+                action=AuthEvent.REGISTER,
+            )
             messages.success(self.request, _("Device added."))
             return super().form_valid(form)
         else:
             assert not device.pk
+            record_event(
+                self.request,
+                self.request.user,
+                "totp",
+                succeeded=False,
+                action=AuthEvent.REGISTER,
+            )
             form.add_error("token", TOTPForm.INVALID_ERROR_MESSAGE)
             return self.form_invalid(form)
 
@@ -110,17 +174,42 @@ class AddTOTPDeviceView(OriginMixin, FormView):
             return super().get_success_url()
 
 
-class TOTPDeviceManagementView(ListView):
+class TOTPDeviceManagementView(FactorListMixin, ListView):
     template_name = "kagi/totpdevice_list.html"
+    rows_template_name = "kagi/totpdevice_rows.html"
+    fields = ["created_at", "last_used_at"]
 
-    def get_queryset(self):
+    def get_factors(self):
         return self.request.user.totp_devices.all()
 
     def post(self, request):
         assert "delete" in self.request.POST
         device = get_object_or_404(
-            self.get_queryset(), pk=self.request.POST["device_id"]
+            self.get_factors(), pk=self.request.POST["device_id"]
         )
         device.delete()
+        revoke_trusted_devices(request.user)
         messages.success(request, _("Device removed."))
         return HttpResponseRedirect(reverse("kagi:totp-devices"))
+
+
+class TOTPQRCodeView(View):
+    def get(self, request):
+        secret = request.session.get(SESSION_TOTP_SECRET_KEY, None)
+        image_format = request.GET.get("format", "svg")
+        if not secret or image_format not in QRCODE_FORMATS:
+            raise Http404
+
+        otpauth = get_otpauth_url(request, secret)
+        etag = quote_etag(f"{get_qrcode_version(otpauth)}-{image_format}")
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = HttpResponse(
+                render_qrcode(otpauth, image_format),
+                content_type=QRCODE_FORMATS[image_format][0],
+            )
+        response["ETag"] = etag
+        patch_cache_control(
+            response, private=True, max_age=settings.KAGI_TOTP_QRCODE_MAX_AGE
+        )
+        return response
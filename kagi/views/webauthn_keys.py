@@ -6,7 +6,8 @@ from django.utils.translation import gettext as _
 from django.views.generic import ListView, TemplateView
 
 from ..forms import KeyRegistrationForm
-from .mixin import OriginMixin
+from ..trusted_devices import revoke_trusted_devices
+from .mixin import FactorListMixin, OriginMixin
 
 
 class AddWebAuthnKeyView(OriginMixin, TemplateView):
@@ -18,15 +19,18 @@ class AddWebAuthnKeyView(OriginMixin, TemplateView):
         return kwargs
 
 
-class KeyManagementView(ListView):
+class KeyManagementView(FactorListMixin, ListView):
     template_name = "kagi/key_list.html"
+    rows_template_name = "kagi/key_rows.html"
+    fields = ["key_name", "created_at", "last_used_at"]
 
-    def get_queryset(self):
+    def get_factors(self):
         return self.request.user.webauthn_keys.all()
 
     def post(self, request):
         assert "delete" in self.request.POST
-        key = get_object_or_404(self.get_queryset(), pk=self.request.POST["key_id"])
+        key = get_object_or_404(self.get_factors(), pk=self.request.POST["key_id"])
         key.delete()
+        revoke_trusted_devices(request.user)
         messages.success(request, _("Key removed."))
         return HttpResponseRedirect(reverse("kagi:webauthn-keys"))
@@ -1,5 +1,6 @@
 import os
 from pathlib import Path
+import re
 from shutil import which
 
 from invoke import task
@@ -58,6 +59,64 @@ def tests(c):
     )
 
 
+@task
+def benchmarks(c, save_baseline=False):
+    """Run the benchmarks and compare them against the stored baseline"""
+    save_flag = "--save-baseline" if save_baseline else ""
+    c.run(f"{VENV_BIN}/python benchmarks/run.py {save_flag}", pty=PTY)
+
+
+def minify_js(source):
+    """
+    Strips the comments and most whitespace of JavaScript ``source``, keeping
+    ``/*!`` license comments. Line breaks are only removed next to punctuation
+    that cannot end a statement, so automatic semicolon insertion still works.
+    Regular expression literals and template literals nesting other strings are
+    not supported. kagi/tests/test_webauthn_js.py checks the minified module
+    with Node.js, and that it matches its source.
+    """
+    output, code, i = [], [], 0
+
+    def flush():
+        text = "".join(code)
+        text = re.sub(r"\s*\n\s*", "\n", text)
+        text = re.sub(r"[ \t]+", " ", text)
+        text = re.sub(r" ?([{}()\[\],;:=<>*&|?!.]) ?", r"\1", text)
+        text = re.sub(r"\n(?=[.)\]}?:,;])|(?<=[{(\[,;:=>&|?])\n", "", text)
+        output.append(text)
+        code.clear()
+
+    while i < len(source):
+        if source[i] in "'\"`":
+            end = i + 1
+            while source[end] != source[i]:
+                end += 2 if source[end] == "\\" else 1
+            flush()
+            output.append(source[i : end + 1])
+            i = end + 1
+        elif source.startswith("/*", i):
+            end = source.index("*/", i) + 2
+            if source.startswith("/*!", i):
+                flush()
+                output.append(source[i:end])
+            i = end
+        elif source.startswith("//", i):
+            i = source.index("\n", i)
+        else:
+            code.append(source[i])
+            i += 1
+    flush()
+    return "".join(output).strip() + "\n"
+
+
+@task
+def assets(c):
+    """Build the minified JavaScript module from kagi/static/kagi/webauthn.js"""
+    static_dir = Path("kagi") / "static" / "kagi"
+    source = (static_dir / "webauthn.js").read_text()
+    (static_dir / "webauthn.min.js").write_text(minify_js(source))
+
+
 @task
 def makemigrations(c):
     """Create database migrations if needed"""